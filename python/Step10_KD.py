@@ -1,12 +1,285 @@
 '''
 計算KD曲線
 參考: https://medium.com/%E5%8F%B0%E8%82%A1etf%E8%B3%87%E6%96%99%E7%A7%91%E5%AD%B8-%E7%A8%8B%E5%BC%8F%E9%A1%9E/%E7%A8%8B%E5%BC%8F%E8%AA%9E%E8%A8%80-%E8%87%AA%E5%BB%BAkd%E5%80%BC-819d6fd707c8
-資料來源: https://www.twse.com.tw/exchangeReport/STOCK_DAY?response=json&date={date}&stockNo={stockId}
+資料來源: 全市場股價矩陣 (Data/PriceStore/exchange，由 market_prices.py 以交易所每日整批行情建立)
+
+RSV = (今日收盤 - 最近 N 日最低價) / (最近 N 日最高價 - 最近 N 日最低價) × 100
+K = 2/3 × 昨日K + 1/3 × RSV
+D = 2/3 × 昨日D + 1/3 × 今日K
+
+- 所有股票一次計算: K、D 的遞迴是一階線性濾波，以分段的下三角 Toeplitz 矩陣乘法計算，不逐日迴圈
+- 只計算有收盤價的交易日 (停牌日略過，不影響前後的 K、D)
+- 交易日數不足 N 日時 K、D 維持初始值 50；N 日內最高價等於最低價時 RSV 為 50
+- 增量更新: 以上次存檔的 K、D 為初始值，只計算之後新增的交易日；
+  存檔的狀態與股價矩陣的來源、股票清單或已計算的交易日不同 (例如之後補進較早的交易日) 時以完整股價重新計算
 '''
 
 
-import datetime
-import pandas as pd
+import argparse
+import os
+
 import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+import utils
+from price_store import compact_rows, history_unchanged, load_price_store, right_align
+
+KD_PERIOD = 9              # RSV 的天數
+KD_WEIGHT = 1 / 3          # 新數值的權重 (K = (1 - w) × 昨日K + w × RSV)
+KD_INITIAL = 50.0          # K、D 的初始值
+KD_BLOCK = 64              # 線性濾波每段的天數 (每段一次矩陣乘法)
+KD_CONTEXT_DAYS = 60       # 增量更新時往前取用的交易日數 (計算新交易日的 RSV 視窗)
+
+KD_STATE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Data", "KDState", "kd_state.pkl")
+
+
+def rolling_extremes(high, low, period=KD_PERIOD):
+    """每個位置往前 period 個數值的最高價與最低價 (不足 period 個時以現有的數值計算)"""
+    pad = np.full((len(high), period - 1), np.nan)
+    high_windows = sliding_window_view(np.hstack([pad, high]), period, axis=1)
+    low_windows = sliding_window_view(np.hstack([pad, low]), period, axis=1)
+    with np.errstate(invalid="ignore"):
+        return np.fmax.reduce(high_windows, axis=2), np.fmin.reduce(low_windows, axis=2)
+
+
+def calculate_rsv(close, high, low, seen, period=KD_PERIOD):
+    """
+    計算 RSV (close/high/low 為每列依序排列的有值數值)
+    seen: 每列在第一欄之前已經累積的交易日數，累積交易日數不足 period 時 RSV 為 KD_INITIAL
+    """
+    highest, lowest = rolling_extremes(high, low, period)
+    spread = highest - lowest
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rsv = np.where(spread > 0, (close - lowest) / spread * 100, KD_INITIAL)
+
+    count = seen[:, None] + np.arange(1, close.shape[1] + 1)
+    rsv[count < period] = KD_INITIAL
+    return rsv
+
+
+def exponential_filter(values, initial, weight=KD_WEIGHT, block=KD_BLOCK):
+    """
+    一階線性濾波 y[t] = (1 - weight) × y[t-1] + weight × x[t]，y[-1] = initial (每列各自的初始值)
+    每段 block 天的輸出為 x @ T + y[-1] × decay^(1..block)，T 為下三角 Toeplitz 矩陣 weight × decay^(i-j)，
+    所有股票同時計算，只在段與段之間迴圈
+    """
+    values = np.asarray(values, dtype=np.float64)
+    decay = 1 - weight
+    steps = np.arange(block)
+    lags = steps[None, :] - steps[:, None]
+    toeplitz = np.where(lags >= 0, weight * decay ** np.maximum(lags, 0), 0.0)
+    powers = decay ** (steps + 1)
+
+    result = np.empty_like(values)
+    previous = np.asarray(initial, dtype=np.float64)
+    for start in range(0, values.shape[1], block):
+        chunk = values[:, start:start + block]
+        size = chunk.shape[1]
+        output = chunk @ toeplitz[:size, :size] + previous[:, None] * powers[:size]
+        result[:, start:start + size] = output
+        previous = output[:, -1]
+    return result
+
+
+def kd_from_state(close, high, low, k0, d0, seen, period=KD_PERIOD):
+    """
+    以 (k0, d0) 為前一日的 K、D 計算之後每個交易日的 K、D
+    close/high/low: 每列的前 period - 1 欄為之前的交易日 (只用於 RSV 視窗，可為 NaN)，之後為要計算的交易日
+    seen: 每列在要計算的交易日之前已累積的交易日數
+    """
+    context = period - 1
+    rsv = calculate_rsv(close, high, low, seen - context, period)[:, context:]
+    rsv = np.nan_to_num(rsv, nan=KD_INITIAL)
+    k = exponential_filter(rsv, k0)
+    d = exponential_filter(k, d0)
+    return k, d
+
+
+def scatter_rows(values, order, counts, shape):
+    """compact_rows 排列的數值放回原始欄位，其餘為 NaN"""
+    result = np.full(shape, np.nan)
+    rows, positions = np.nonzero(np.arange(values.shape[1])[None, :] < counts[:, None])
+    result[rows, order[rows, positions]] = values[rows, positions]
+    return result
+
+
+def calculate_kd(prices, period=KD_PERIOD):
+    """
+    計算所有股票每個交易日的 K、D
+    回傳 (K, D) 兩個 DataFrame，索引為股票代號、欄位為日期，停牌日為 NaN
+    """
+    close = np.asarray(prices.close, dtype=np.float64)
+    valid = ~np.isnan(close)
+    order, counts = compact_rows(valid)
+
+    def compacted(array):
+        values = np.take_along_axis(np.asarray(array, dtype=np.float64), order, axis=1)
+        return np.hstack([np.full((len(values), period - 1), np.nan), values])
+
+    n = len(close)
+    initial = np.full(n, KD_INITIAL)
+    k, d = kd_from_state(compacted(close), compacted(prices.high), compacted(prices.low),
+                         initial, initial, np.zeros(n, dtype=np.int64), period)
+
+    index = pd.Index(prices.symbols, name="代號")
+    return (
+        pd.DataFrame(scatter_rows(k, order, counts, close.shape), index=index, columns=prices.dates),
+        pd.DataFrame(scatter_rows(d, order, counts, close.shape), index=index, columns=prices.dates),
+    )
+
+
+def calculate_kd_loop(prices, period=KD_PERIOD):
+    """逐檔、逐日計算最新的 K、D (對照用，與 calculate_kd 的結果相同)"""
+    rows = {}
+    for symbol in prices.symbols:
+        frame = prices.frame(symbol).dropna(subset=["Close"])
+        k = d = KD_INITIAL
+        highs, lows = [], []
+        for close, high, low in zip(frame["Close"], frame["High"], frame["Low"]):
+            highs = (highs + [high])[-period:]
+            lows = (lows + [low])[-period:]
+            rsv = KD_INITIAL
+            if len(highs) >= period:
+                highest, lowest = np.nanmax(highs), np.nanmin(lows)
+                if highest - lowest > 0:
+                    rsv = (close - lowest) / (highest - lowest) * 100
+            k = (1 - KD_WEIGHT) * k + KD_WEIGHT * rsv
+            d = (1 - KD_WEIGHT) * d + KD_WEIGHT * k
+        rows[symbol] = {"K": k, "D": d}
+    return pd.DataFrame.from_dict(rows, orient="index")
+
+
+def latest_kd(k, d):
+    """每檔股票最後一個交易日的 K、D 與日期"""
+    values = k.to_numpy()
+    has = ~np.isnan(values)
+    last = np.where(has.any(axis=1), values.shape[1] - 1 - np.argmax(has[:, ::-1], axis=1), -1)
+    rows = np.arange(len(values))
+    return pd.DataFrame({
+        "K": np.where(last >= 0, values[rows, last], np.nan),
+        "D": np.where(last >= 0, d.to_numpy()[rows, last], np.nan),
+        "日期": k.columns[np.maximum(last, 0)].where(last >= 0),
+    }, index=k.index)
+
+
+def build_kd_state(prices, period=KD_PERIOD):
+    """
+    由完整的股價矩陣建立 K、D 狀態 (索引為股票代號)
+    欄位: K、D (最後一個交易日)、交易日數 (累積的交易日數)
+    attrs["日期"] 為狀態的最後日期，attrs["交易日"] 為已計算的交易日，attrs["來源"] 為股價矩陣的來源 (PriceStore.source)
+    """
+    k, d = calculate_kd(prices, period)
+    state = latest_kd(k, d)[["K", "D"]]
+    state["交易日數"] = (~np.isnan(np.asarray(prices.close))).sum(axis=1)
+    state.attrs["日期"] = prices.dates[-1] if len(prices.dates) else None
+    state.attrs["交易日"] = prices.dates
+    state.attrs["來源"] = prices.source
+    return state
+
+
+def state_matches(state, prices):
+    """
+    存檔的狀態是否可由股價矩陣接續更新: 來源與股票清單相同，且矩陣中狀態日期 (含) 以前的交易日
+    與狀態已計算的交易日相同 (之後補進較早的交易日時需重新計算)
+    """
+    return (
+        state.attrs.get("來源") == prices.source
+        and state.index.tolist() == list(prices.symbols)
+        and history_unchanged(state.attrs.get("交易日"), prices.dates, state.attrs.get("日期"))
+    )
+
+
+def update_kd_state(prices, state, period=KD_PERIOD, context_days=KD_CONTEXT_DAYS):
+    """
+    只計算 state 的日期之後新增的交易日，回傳更新後的狀態
+    新股票從初始值開始計算；停牌超過 context_days 個交易日的股票 RSV 視窗以現有的交易日計算
+    狀態無法接續更新 (見 state_matches) 時以完整股價重新計算
+    """
+    last_date = state.attrs.get("日期")
+    if last_date is None or not state_matches(state, prices):
+        return build_kd_state(prices, period)
+
+    start = prices.dates.searchsorted(last_date, side="right")
+    if start >= len(prices.dates):
+        return state
+
+    state = state.reindex(prices.symbols)
+    n = len(prices.symbols)
+    k0 = state["K"].fillna(KD_INITIAL).to_numpy()
+    d0 = state["D"].fillna(KD_INITIAL).to_numpy()
+    seen = state["交易日數"].fillna(0).to_numpy(dtype=np.int64)
+
+    close = np.asarray(prices.close, dtype=np.float64)
+    begin = max(start - context_days, 0)
+
+    # 之前的交易日: 每列最近 period - 1 個有值的數值 (靠右對齊)；新的交易日: 有值的數值依序排在前面
+    fields = (prices.close, prices.high, prices.low)
+    old = right_align(~np.isnan(close[:, begin:start]), period - 1, *(array[:, begin:start] for array in fields))
+    new_order, new_counts = compact_rows(~np.isnan(close[:, start:]))
+    new = (np.take_along_axis(np.asarray(array[:, start:], dtype=np.float64), new_order, axis=1) for array in fields)
+
+    k, d = kd_from_state(*(np.hstack(pair) for pair in zip(old, new)), k0, d0, seen, period)
+
+    rows = np.arange(n)
+    last = np.maximum(new_counts - 1, 0)
+    updated = pd.DataFrame({
+        "K": np.where(new_counts > 0, k[rows, last], state["K"].to_numpy()),
+        "D": np.where(new_counts > 0, d[rows, last], state["D"].to_numpy()),
+        "交易日數": seen + new_counts,
+    }, index=pd.Index(prices.symbols, name="代號"))
+    updated.attrs["日期"] = prices.dates[-1]
+    updated.attrs["交易日"] = prices.dates
+    updated.attrs["來源"] = prices.source
+    return updated
+
+
+def load_kd_state(path=KD_STATE_PATH):
+    """讀取 K、D 狀態，沒有存檔時回傳 None"""
+    if not os.path.exists(path):
+        return None
+    return pd.read_pickle(path)
+
+
+def save_kd_state(state, path=KD_STATE_PATH):
+    """寫入 K、D 狀態 (中斷時不會留下寫到一半的檔案)"""
+    utils.save_pickle(state, path)
+
+
+def get_kd(prices=None, full=False, path=KD_STATE_PATH):
+    """
+    取得所有股票最新的 K、D (索引為股票代號)
+    有存檔的狀態時只計算新增的交易日並寫回；full=True 時以完整股價重新計算
+    prices 未指定時讀取全市場股價矩陣，沒有存檔時回傳 None
+    """
+    if prices is None:
+        prices = load_price_store("exchange")
+        if prices is None:
+            return None
+
+    state = None if full else load_kd_state(path)
+    if state is not None and not state_matches(state, prices):
+        print("KD 狀態與股價矩陣的來源、股票清單或已計算的交易日不同，以完整股價重新計算")
+        state = None
+    if state is None:
+        print(f"以完整股價計算 KD: {len(prices.symbols)} 檔 × {len(prices.dates)} 日")
+        state = build_kd_state(prices)
+    else:
+        print(f"增量更新 KD: {state.attrs.get('日期'):%Y-%m-%d} 之後的交易日")
+        state = update_kd_state(prices, state)
+    save_kd_state(state, path)
+    return state
+
+
+def main():
+    parser = argparse.ArgumentParser(description="計算全部股票的 KD 值")
+    parser.add_argument("--full", action="store_true", help="忽略存檔的狀態，以完整股價重新計算")
+    args = parser.parse_args()
+
+    state = get_kd(full=args.full)
+    if state is not None:
+        print(state.sort_values("K").round(2).to_string(max_rows=40))
+
 
-def getRSV():
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,222 @@ import pandas as pd
 import numpy as np
 import twstock
 import os
-import datetime
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from price_store import PriceStore, download_prices, PRICE_STORE_DIRS
+from market_prices import update_daily_quotes, update_price_store
+from metric_merge import coalesce_metrics, parse_float_series
+from screening_rules import compile_screens, load_screen_rules, run_prefilter, run_screens
+from export_format import format_frame
+from stock_universe import get_universe_symbols
+from mops_statements import get_latest_report_period, get_statements
+from statement_history import load_statement_history, recent_periods
+from technical_indicators import calculate_technical_indicators
+
+# 可產生的輸出檔 (public 資料夾)，同一次抓取可同時輸出
+OUTPUT_FILES = {
+    'gvi': 'Stock_GVI_ThreeFactor.csv',
+    'quality': 'Stock_Quality_Filtered.csv',
+}
+
+# Stock_GVI_ThreeFactor.csv 的欄位 ('收盤' 會換成帶日期的收盤欄位)
+EXPORT_COLUMNS = [
+    '證券代號', '證券名稱', '收盤', '決策建議',
+    '三好一公道評等', '三好一公道分數', '三好_ROE', '三好_淨負債', '三好_EPS成長', '一公道_本益比', '四關卡_基本面',
+    '估值狀態', 'L1_獲利能力', 'L2_財務安全', 'L3_成長動能',
+    # --- choose_stock.py 選股評估 ---
+    'CS選股評等', 'CS_價值面得分', 'CS_本業獲利得分', 'CS_總得分', 'CS_冠軍股得分',
+    'CS_A1_本益比<15', 'CS_A2_殖利率>5%',
+    'CS_B1_本益比<10', 'CS_B2_低於五年最低PE',
+    'CS_C1_營收成長>0', 'CS_C2_毛利率>0', 'CS_C3_營業利益率>0',
+    'CS_C4_稅前淨利率>0', 'CS_C5_稅後淨利率>0',
+    'CS_C6_本業比例>60%', 'CS_C7_ROE>10',
+    'CS_D1_資本額>15億', 'CS_D2_毛利率>30%', 'CS_D3_營業利益率>30%',
+    'GVI指標', '三因子評分', '財務健康評分', '通過品質篩選',
+    '20日報酬率',
+    # --- 成交量分析欄位 ---
+    '5日均量', '20日均量', '量能倍數', '量能訊號',
+    # --- 技術指標 ---
+    '技術面得分', 'RSI', 'MACD', 'MACD訊號線', 'MACD柱狀體', '布林%B', '布林帶寬', 'ATR', 'ATR(%)',
+    '5日動能', '20日動能', '60日動能', '120日動能', '250日動能', '創新高天數', '創新低天數',
+    '殖利率', '本益比', '近五年最低本益比', '淨值比', 'ROE', 'EPS成長率',
+    '資本額', '每股淨值',
+    '外資持股(%)', '張數', '毛利率', '營業利益率', '稅後淨利率', '稅前淨利率', '本業比例', '營收成長率', '淨利成長率',
+    '自由現金流', '負債比率', '淨負債', '淨負債比率', '流動比率', '速動比率', '現金流量比',
+    '本益比區間', '產業', '細產業', '排除原因'
+]
+
+# 輸出欄位格式 (見 export_format.py)
+EXPORT_FORMATS = {
+    '收盤': '%.1f',
+    'GVI指標': '%.2f', '三因子評分': '%.2f', '財務健康評分': '%.2f',
+    '淨值比': '%.2f', '本益比': '%.2f', '近五年最低本益比': '%.2f', '每股淨值': '%.2f',
+    '三好一公道分數': '%d',
+    'CS_價值面得分': '%d', 'CS_本業獲利得分': '%d', 'CS_總得分': '%d', 'CS_冠軍股得分': '%d',
+    '資本額': '%.1f億',
+    '量能倍數': '%.2fx',
+    '技術面得分': '%d', 'RSI': '%.1f', 'MACD': '%.2f', 'MACD訊號線': '%.2f', 'MACD柱狀體': '%.2f',
+    '布林%B': '%.2f', 'ATR': '%.2f', '創新高天數': '%d', '創新低天數': '%d',
+    '5日均量': 'volume', '20日均量': 'volume',
+    '自由現金流': 'cash', '淨負債': 'cash',
+    '張數': 'thousands',
+    **{c: '%.2f%%' for c in [
+        '20日報酬率', '殖利率', 'ROE', 'EPS成長率', '外資持股(%)', '毛利率', '營業利益率', '稅後淨利率',
+        '稅前淨利率', '本業比例', '營收成長率', '淨利成長率', '負債比率', '淨負債比率', '流動比率', '速動比率', '現金流量比',
+        '布林帶寬', 'ATR(%)', '5日動能', '20日動能', '60日動能', '120日動能', '250日動能',
+    ]},
+}
+
+# Stock_Quality_Filtered.csv 的欄位 ('收盤' 會換成帶日期的收盤欄位)
+QUALITY_COLUMNS = [
+    '證券代號', '證券名稱', '收盤', '決策建議', '四關卡_基本面', '估值狀態',
+    'L1_獲利能力', 'L2_財務安全', 'L3_成長動能',
+    'GVI指標', '三因子評分', '財務健康評分', '通過品質篩選',
+    '20日報酬率', '5日均量', '20日均量', '量能倍數', '量能訊號',
+    '技術面得分', 'RSI', 'MACD柱狀體', '60日動能', '250日動能', '創新高天數',
+    '殖利率', '本益比', '近五年最低本益比', '淨值比', 'ROE', '外資持股(%)', '張數',
+    '毛利率', '營業利益率', '稅後淨利率', '稅前淨利率', '本業比例', '營收成長率', '淨利成長率',
+    '自由現金流', '負債比率', '流動比率', '速動比率', '現金流量比',
+    '本益比區間', '產業', '細產業', '排除原因',
+]
+
+# yfinance info 中會用到的欄位
+INFO_KEYS = [
+    'currentPrice', 'previousClose', 'trailingPE', 'priceToBook', 'returnOnEquity',
+    'dividendRate', 'grossMargins', 'operatingMargins', 'profitMargins',
+    'revenueGrowth', 'earningsGrowth', 'trailingEps', 'heldPercentInstitutions',
+    'volume', 'regularMarketTime', 'sector', 'industry', 'sharesOutstanding',
+    'bookValue', 'debtToEquity', 'currentRatio', 'quickRatio', 'freeCashflow',
+    'totalDebt', 'totalCash',
+]
+
+# 各輸出欄位的來源優先順序 (第一階段: 直接取自各來源表)
+METRIC_SOURCES = {
+    '收盤': [('info', 'close'), ('hist', 'close'), ('ref', '收盤')],
+    '收盤日期': [('hist', 'close_date'), ('info', 'close_date'), ('default', '')],
+    '本益比': [('ref', '本益比'), ('info', 'trailingPE')],
+    '淨值比': [('ref', '淨值比'), ('info', 'priceToBook')],
+    'ROE': [('ref', 'ROE'), ('info', 'roe')],
+    '外資持股(%)': [('ref', '外資持股(%)'), ('info', 'foreign_pct')],
+    '張數': [('ref', '張數'), ('info', 'vol_lots'), ('default', 0)],
+    '毛利率': [('ref', '毛利率'), ('mops', 'gross_margin'), ('info', 'gross_margin')],
+    '營業利益率': [('ref', '營業利益率'), ('mops', 'op_margin'), ('info', 'op_margin')],
+    '稅後淨利率': [('ref', '稅後淨利率'), ('mops', 'net_margin'), ('info', 'net_margin')],
+    '稅前淨利率': [('mops', 'pretax_margin'), ('stmt', 'pretax_margin')],
+    '營收成長率': [('info', 'revenue_growth')],
+    'EPS成長率': [('ref', 'EPS成長率'), ('info', 'earnings_growth')],
+    '自由現金流': [('stmt', 'free_cash_flow'), ('info', 'freeCashflow')],
+    '負債比率': [('mops', 'debt_ratio'), ('stmt', 'debt_ratio'), ('info', 'debt_ratio')],
+    '淨負債': [('stmt', 'net_debt'), ('info', 'net_debt')],
+    '流動比率': [('mops', 'current_ratio'), ('stmt', 'current_ratio'), ('info', 'current_ratio')],
+    '速動比率': [('stmt', 'quick_ratio'), ('info', 'quick_ratio')],
+    '現金流量比': [('stmt', 'cash_flow_ratio')],
+    '資本額': [('ref', '資本額'), ('mops', 'capital'), ('info', 'capital')],
+    '每股淨值': [('ref', '每股淨值'), ('mops', 'book_value'), ('info', 'bookValue')],
+    '產業': [('info', 'sector'), ('default', '')],
+    '細產業': [('info', 'industry'), ('default', '')],
+}
+
+# 第二階段: 需要用到第一階段合併結果 (收盤、淨值比、ROE...) 才能計算的欄位
+CALC_SOURCES = {
+    'GVI指標': [('calc', 'gvi'), ('ref', 'GVI指標')],
+    '20日報酬率': [('calc', 'r_20d')],
+    '殖利率': [('ref', '殖利率'), ('calc', 'div_yield')],
+    '本業比例': [('calc', 'core_ratio')],
+    '本益比區間': [('ref', '本益比區間'), ('calc', 'pe_range'), ('default', '-')],
+    '淨負債比率': [('stmt', 'net_debt_ratio'), ('calc', 'net_debt_ratio')],
+}
+
+# 會觸發網路請求的原始資料
+#   prices: 歷史股價矩陣 (yf.download)，mops: MOPS 彙總報表 (全市場每種報表一次請求)，info: ticker.info
+#   financials / cashflow / balance_sheet: 損益表 / 現金流量表 / 資產負債表 (逐檔各自是一次請求)
+STATEMENT_PARTS = ['financials', 'cashflow', 'balance_sheet']
+RAW_INPUTS = ['prices', 'mops', 'info'] + STATEMENT_PARTS
+
+# 逐檔請求的原始資料 (全市場模式不抓取，見 fetch_stock_data 的 per_symbol)
+PER_SYMBOL_INPUTS = ['info'] + STATEMENT_PARTS
+
+# 逐檔抓取前就已取得的全市場來源: 這些來源有值時，排在後面的逐檔財報欄位不會被用到，該檔不必抓取
+BULK_SOURCES = ['ref', 'mops']
+
+# MOPS 彙總報表 (最新一季) 中用到的報表類型
+MOPS_REPORT_TYPES = ('資產負債', '營益分析')
+
+# 逐檔抓取 info 與財報時同時進行的請求數 (全市場約 1,900 檔時逐檔依序抓取太慢)
+FETCH_MAX_WORKERS = 8
+
+# 各來源欄位需要的原始資料 (ref、default 不需網路)
+SOURCE_INPUTS = {
+    'info': ['info'],
+    'hist': ['prices'],
+    'mops': ['mops'],
+}
+STATEMENT_INPUTS = {
+    'pretax_margin': ['financials'],
+    'free_cash_flow': ['cashflow'],
+    'debt_ratio': ['balance_sheet'],
+    'current_ratio': ['balance_sheet'],
+    'quick_ratio': ['balance_sheet'],
+    'net_debt': ['balance_sheet'],
+    'net_debt_ratio': ['balance_sheet'],
+    'cash_flow_ratio': ['cashflow', 'financials'],
+}
+# 計算欄位需要的已合併欄位與原始資料
+CALC_INPUTS = {
+    'gvi': ['淨值比', 'ROE'],
+    'r_20d': ['收盤', 'prices'],
+    'div_yield': ['收盤', 'info'],
+    'core_ratio': ['營業利益率', '稅前淨利率', '稅後淨利率'],
+    'pe_range': ['收盤', 'info', 'prices'],
+    'net_debt_ratio': ['淨負債', 'info'],
+}
+# 不經來源表合併、直接計算的欄位
+DERIVED_INPUTS = {
+    '證券名稱': [],
+    '淨利成長率': ['EPS成長率'],
+    '近五年最低本益比': ['prices', 'financials'],
+    '5日均量': ['prices'],
+    '20日均量': ['prices'],
+    '量能倍數': ['prices'],
+    '量能訊號': ['prices'],
+    **{name: ['prices'] for name in [
+        'RSI', 'MACD', 'MACD訊號線', 'MACD柱狀體', '布林%B', '布林帶寬', 'ATR', 'ATR(%)',
+        '5日動能', '20日動能', '60日動能', '120日動能', '250日動能', '創新高天數', '創新低天數',
+    ]},
+}
+
+# 三因子評分使用的欄位
+SCORE_COLUMNS = ['淨值比', 'ROE', '20日報酬率']
+
+# 成交量分析輸出欄位 -> calculate_volume_analysis_batch 欄位
+VOLUME_COLUMNS = {'5日均量': 'vol_ma5', '20日均量': 'vol_ma20', '量能倍數': 'vol_ratio', '量能訊號': 'vol_signal'}
+
+# 技術指標輸出欄位 -> calculate_technical_indicators 欄位
+TECHNICAL_COLUMNS = {
+    'RSI': 'rsi', 'MACD': 'macd', 'MACD訊號線': 'macd_signal', 'MACD柱狀體': 'macd_hist',
+    '布林%B': 'boll_pctb', '布林帶寬': 'boll_width', 'ATR': 'atr', 'ATR(%)': 'atr_pct',
+    '5日動能': 'mom_5', '20日動能': 'mom_20', '60日動能': 'mom_60', '120日動能': 'mom_120', '250日動能': 'mom_250',
+    '創新高天數': 'new_high_days', '創新低天數': 'new_low_days',
+}
+
+# 0 視為缺值、繼續往下一個來源找
+ZERO_AS_MISSING = {'收盤', '張數'}
+
+# 輸出欄位順序
+OUTPUT_COLUMNS = [
+    '證券代號', '證券名稱', '收盤', '收盤日期', 'GVI指標', '20日報酬率', '殖利率',
+    '本益比', '淨值比', 'ROE', '外資持股(%)', '張數',
+    '毛利率', '營業利益率', '稅後淨利率', '稅前淨利率', '本業比例',
+    '營收成長率', '淨利成長率', 'EPS成長率', '近五年最低本益比', '本益比區間',
+    # --- 新增: 財務健康指標 ---
+    '自由現金流', '負債比率', '淨負債', '淨負債比率', '流動比率', '速動比率', '現金流量比',
+    '資本額', '每股淨值', '產業', '細產業',
+    # --- 新增: 成交量分析 ---
+    '5日均量', '20日均量', '量能倍數', '量能訊號',
+    # --- 新增: 技術指標 ---
+    *TECHNICAL_COLUMNS,
+]
+
 
 def get_stock_list(filename="stock_list.txt"):
     current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -89,45 +304,51 @@ def parse_float(value, default=np.nan):
         return default
 
 
-def calculate_min_pe_5y(ticker, history_data, symbol):
-    """計算近五年(或四年)最低本益比"""
+def get_annual_eps(ticker):
+    """取得年度財報中的 EPS (以西元年為索引)"""
     try:
-        # 取得年度財報中的 EPS
         fin = ticker.financials
-        if fin.empty:
-            return np.nan
-
-        if 'Basic EPS' not in fin.index:
-            return np.nan
+        if fin.empty or 'Basic EPS' not in fin.index:
+            return pd.Series(dtype=float)
 
-        eps_series = fin.loc['Basic EPS']
         # 確保是數值
-        eps_series = pd.to_numeric(eps_series, errors='coerce').dropna()
+        eps_series = pd.to_numeric(fin.loc['Basic EPS'], errors='coerce').dropna()
+        eps_series.index = pd.to_datetime(eps_series.index).year
+        return eps_series
+    except Exception:
+        return pd.Series(dtype=float)
+
 
+def calculate_min_pe_5y(ticker, prices, symbol):
+    """計算近五年(或四年)最低本益比"""
+    try:
+        # 取得年度財報中的 EPS
+        eps_series = get_annual_eps(ticker)
         if eps_series.empty:
             return np.nan
 
         min_pes = []
 
-        # 取得股價歷史
-        df_p = history_data[symbol] if not history_data.empty and symbol in history_data else pd.DataFrame()
-        if df_p.empty:
+        # 取得股價歷史 (股價矩陣的列視圖)
+        view = prices.view(symbol)
+        if view is not None and view['valid'].any():
+            closes = view['close']
+            valid = view['valid']
+            years = prices.years
+        else:
             # 若批量抓取沒有，嘗試個別抓取
             df_p = ticker.history(period="5y")
+            if df_p.empty:
+                return np.nan
+            closes = df_p['Close'].to_numpy()
+            valid = ~np.isnan(closes)
+            years = pd.to_datetime(df_p.index).year.to_numpy()
 
-        if df_p.empty:
-            return np.nan
-
-        df_p.index = pd.to_datetime(df_p.index)
-
-        for date, eps in eps_series.items():
-            year = date.year
+        for year, eps in eps_series.items():
             # 取得該年度的股價數據
-            mask = df_p.index.year == year
-            year_prices = df_p.loc[mask]
-
-            if not year_prices.empty and eps > 0:
-                min_price = year_prices['Close'].min()
+            mask = (years == year) & valid
+            if mask.any() and eps > 0:
+                min_price = closes[mask].min()
                 min_pe = min_price / eps
                 min_pes.append(min_pe)
 
@@ -138,7 +359,69 @@ def calculate_min_pe_5y(ticker, history_data, symbol):
         return np.nan
 
 
-def calculate_volume_analysis(history_data, symbol, stock_list):
+def get_history_annual_eps(symbols, years=5):
+    """
+    由財報歷史 (statement_history) 取得最近 years 年的年度 EPS 長表 (欄位與 fetch_symbol_details 的年度 EPS 相同)
+    第四季的年度累計基本每股盈餘即為全年 EPS，民國年換算為西元年；沒有存檔的年度略過
+    """
+    periods = [(year, season) for year, season in recent_periods(years * 4) if season == 4]
+    income = load_statement_history('綜合損益', periods)
+    if income.empty:
+        return pd.DataFrame(columns=['證券代號', '年度', 'EPS'])
+
+    # 財報以證券代號 (2330) 對應股價矩陣的 yfinance 代號 (2330.TW)
+    codes = pd.Series(symbols, index=[symbol.split('.')[0] for symbol in symbols])
+    codes = codes[~codes.index.duplicated()]
+    income = income[income['證券代號'].isin(codes.index)]
+    eps = pd.DataFrame({
+        '證券代號': codes.reindex(income['證券代號']).to_numpy(),
+        '年度': income['年度'].to_numpy() + 1911,
+        'EPS': pd.to_numeric(income['基本每股盈餘'], errors='coerce').to_numpy(),
+    })
+    return eps.dropna(subset=['EPS']).reset_index(drop=True)
+
+
+def calculate_yearly_close_range(prices):
+    """
+    每檔股票各年度的最低 / 最高收盤價
+    回傳 (lows, highs) 兩個 DataFrame，索引為證券代號、欄位為西元年
+    """
+    years = prices.years
+    if years.size == 0:
+        empty = pd.DataFrame(index=pd.Index(prices.symbols, name='證券代號'))
+        return empty, empty.copy()
+
+    # 日期已排序，同一年度為連續欄位，以 reduceat 一次取得各年度極值 (fmin/fmax 會略過 NaN)
+    starts = np.flatnonzero(np.r_[True, years[1:] != years[:-1]])
+    index = pd.Index(prices.symbols, name='證券代號')
+    columns = pd.Index(years[starts], name='年度')
+    lows = pd.DataFrame(np.fmin.reduceat(prices.close, starts, axis=1), index=index, columns=columns)
+    highs = pd.DataFrame(np.fmax.reduceat(prices.close, starts, axis=1), index=index, columns=columns)
+    return lows, highs
+
+
+def calculate_min_pe_5y_batch(prices, eps_df):
+    """
+    一次計算所有股票的近五年最低本益比 (與 calculate_min_pe_5y 相同邏輯)
+
+    參數:
+      prices: PriceStore
+      eps_df: 年度 EPS 長表，欄位為 證券代號 / 年度 / EPS
+    回傳:
+      (近五年最低本益比 Series, 各年度本益比區間 DataFrame)
+    """
+    lows, highs = calculate_yearly_close_range(prices)
+    bands = pd.concat({'最低收盤': lows.stack(), '最高收盤': highs.stack()}, axis=1).dropna().reset_index()
+
+    bands = bands.merge(eps_df[eps_df['EPS'] > 0], on=['證券代號', '年度'], how='inner')
+    bands['最低本益比'] = bands['最低收盤'] / bands['EPS']
+    bands['最高本益比'] = bands['最高收盤'] / bands['EPS']
+
+    min_pe = bands.groupby('證券代號')['最低本益比'].min().reindex(prices.symbols)
+    return min_pe.rename('近五年最低本益比'), bands
+
+
+def calculate_volume_analysis(prices, symbol):
     """
     計算成交量相關指標，用於偵測「低檔盤整後成交量大增」以及「底部起漲」的技術型態
 
@@ -160,30 +443,23 @@ def calculate_volume_analysis(history_data, symbol, stock_list):
     }
 
     try:
-        if history_data.empty:
+        # 取得股價歷史 (股價矩陣的列視圖)
+        view = prices.view(symbol)
+        if view is None:
             return result
 
-        # 取得股價歷史
-        df_p = history_data[symbol] if len(stock_list) > 1 else history_data
+        # 只取有收盤價的交易日
+        valid = view['valid']
+        volumes = view['volume'][valid]
+        closes = view['close'][valid].astype(np.float64)
 
-        if df_p.empty or len(df_p) < 20:
-            return result
-
-        # 取得成交量數據
-        if 'Volume' not in df_p.columns:
-            return result
-
-        # 確保資料為數值
-        volumes = pd.to_numeric(df_p['Volume'], errors='coerce').dropna()
-        closes = pd.to_numeric(df_p['Close'], errors='coerce').dropna()
-
-        if len(volumes) < 20 or len(closes) < 20:
+        if len(closes) < 20:
             return result
 
         # 計算均量
-        vol_ma5 = volumes.tail(5).mean()
-        vol_ma20 = volumes.tail(20).mean()
-        current_vol = volumes.iloc[-1]
+        vol_ma5 = volumes[-5:].mean()
+        vol_ma20 = volumes[-20:].mean()
+        current_vol = volumes[-1]
 
         # 若當日成交量資料異常(例如0)，則不予計算
         if current_vol == 0:
@@ -200,7 +476,7 @@ def calculate_volume_analysis(history_data, symbol, stock_list):
         if vol_ma20 > 0 and current_vol > vol_ma20 * 2:
             result['vol_breakout'] = True
 
-        current_close = closes.iloc[-1]
+        current_close = closes[-1]
 
         # --- 策略 A: 底部起漲 (Long-term Consolidation Breakout) ---
         # 描述: 長期盤整(約半年)後，帶量突破箱型高點
@@ -213,8 +489,8 @@ def calculate_volume_analysis(history_data, symbol, stock_list):
         if len(closes) >= 125:
             # 取樣範圍: T-5 到 T-125 (約半年)
             # 排除最近 5 天，用來定義「箱型區間」，這樣突破才不會被包含在箱型內
-            past_period = closes.iloc[-125:-5]
-            if not past_period.empty:
+            past_period = closes[-125:-5]
+            if past_period.size > 0:
                 box_high = past_period.max()
                 box_low = past_period.min()
 
@@ -238,8 +514,8 @@ def calculate_volume_analysis(history_data, symbol, stock_list):
         # --- 策略 B: 低檔佈局 (Buying at the bottom of the box) ---
         # 條件1: 股價接近近20日低點 (在低點5%範圍內)
         # 條件2: 最近5日均量 < 20日均量 (量能萎縮)
-        low_20d = closes.tail(20).min()
-        high_20d = closes.tail(20).max()
+        low_20d = closes[-20:].min()
+        high_20d = closes[-20:].max()
 
         price_near_low = (current_close - low_20d) / low_20d < 0.05 if low_20d > 0 else False
         # 另一種判斷: 股價在近20日震幅的下半部
@@ -273,825 +549,620 @@ def calculate_volume_analysis(history_data, symbol, stock_list):
     return result
 
 
-def fetch_stock_data(stock_list, ref_df=None):
-    print(f"正在抓取 {len(stock_list)} 檔股票資料...")
-    result_list = []
+def calculate_volume_analysis_batch(prices):
+    """
+    一次計算股價矩陣中所有股票的成交量指標 (與 calculate_volume_analysis 相同邏輯)
 
-    # 批量下載歷史股價（擴展至 3 年以計算最低本益比）
-    try:
-        # 注意: 3y 資料量較大，若股票多可能會慢。
-        history_data = yf.download(stock_list, period="3y", group_by='ticker', threads=True, auto_adjust=True)
-    except Exception:
-        history_data = pd.DataFrame()
+    回傳以證券代號為索引的 DataFrame:
+    vol_ma5, vol_ma20, vol_ratio, vol_breakout, box_amplitude, bottom_breakout,
+    low_consolidation, vol_signal
+    """
+    # 取最近 125 個有效交易日 (靠右對齊)，有效天數不足的列以 NaN 補齊
+    tail, counts = prices.tail(125, fields=("close", "volume"))
+    closes = tail["close"]
+    volumes = tail["volume"]
+    return classify_volume_signals(
+        current_close=closes[:, -1],
+        current_vol=volumes[:, -1],
+        vol_ma5=volumes[:, -5:].mean(axis=1),
+        vol_ma20=volumes[:, -20:].mean(axis=1),
+        box_high=closes[:, :-5].max(axis=1),
+        box_low=closes[:, :-5].min(axis=1),
+        high_20d=closes[:, -20:].max(axis=1),
+        low_20d=closes[:, -20:].min(axis=1),
+        counts=counts,
+        index=pd.Index(prices.symbols, name='證券代號'),
+    )
+
+
+def classify_volume_signals(current_close, current_vol, vol_ma5, vol_ma20, box_high, box_low,
+                            high_20d, low_20d, counts, index):
+    """
+    由最新收盤 / 成交量、均量、箱型 (T-125 ~ T-5) 與近 20 日高低點判斷成交量訊號
+    (calculate_volume_analysis_batch 與 indicator_state 共用，各欄位為每檔股票一個數值的陣列)
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ok = (counts >= 20) & (current_vol != 0)
+
+        # 均量與成交量放大倍數
+        vol_ma5 = np.where(ok, vol_ma5, np.nan)
+        vol_ma20 = np.where(ok, vol_ma20, np.nan)
+        vol_ratio = np.where(ok & (vol_ma20 > 0), current_vol / vol_ma20, np.nan)
+        vol_breakout = ok & (vol_ma20 > 0) & (current_vol > vol_ma20 * 2)
+
+        # 策略 A: 底部起漲 (T-125 ~ T-5 箱型震幅 < 45%，收盤突破箱頂但不超過 15%，且爆量)
+        has_box = ok & (counts >= 125) & (box_low > 0)
+        box_amplitude = np.where(has_box, (box_high - box_low) / box_low, np.nan)
+        bottom_breakout = (
+            has_box
+            & (box_amplitude < 0.45)
+            & (current_close > box_high)
+            & (current_close <= box_high * 1.15)
+            & vol_breakout
+        )
 
-    for symbol in stock_list:
+        # 策略 B: 低檔佈局 (接近近20日低點或位於下半部，且近5日均量 < 20日均量的80%)
+        price_near_low = (low_20d > 0) & ((current_close - low_20d) / low_20d < 0.05)
+        price_in_lower_half = (high_20d > low_20d) & ((current_close - low_20d) < (high_20d - low_20d) * 0.4)
+        vol_contraction = vol_ma5 < vol_ma20 * 0.8
+        low_consolidation = ok & (price_near_low | price_in_lower_half) & vol_contraction
+
+    # 綜合訊號判斷
+    vol_signal = np.select(
+        [
+            ~ok,
+            bottom_breakout,
+            low_consolidation & vol_breakout,
+            vol_breakout,
+            low_consolidation,
+            vol_ratio > 1.5,
+            vol_ratio < 0.5,
+        ],
+        ['-', '★底部起漲', '★低檔量增', '量能放大', '低檔盤整', '量能增加', '量能萎縮'],
+        default='正常'
+    )
+
+    return pd.DataFrame({
+        'vol_ma5': vol_ma5,
+        'vol_ma20': vol_ma20,
+        'vol_ratio': vol_ratio,
+        'vol_breakout': vol_breakout,
+        'box_amplitude': box_amplitude,
+        'bottom_breakout': bottom_breakout,
+        'low_consolidation': low_consolidation,
+        'vol_signal': vol_signal,
+    }, index=index)
+
+
+def get_first_value(df, keys, default=np.nan):
+    """從財報 DataFrame 依序找第一個存在的科目，取最新一期數值"""
+    for key in keys:
+        if key in df.index:
+            return df.loc[key].iloc[0]
+    return default
+
+
+def get_statement_items(ticker, parts=STATEMENT_PARTS):
+    """抓取單一股票損益表、現金流量表、資產負債表中會用到的科目 (最新一期)，只抓 parts 指定的報表"""
+    items = {}
+    if 'financials' in parts:
         try:
-            stock_id = symbol.split('.')[0]
-
-            # 取得參考資料 (如果有的話)
-            ref_data = None
-            if ref_df is not None and stock_id in ref_df.index:
-                ref_data = ref_df.loc[stock_id]
-
-            ticker = yf.Ticker(symbol)
-            # 嘗試取得 info，若失敗則為空字典
-            try:
-                info = ticker.info
-            except Exception:
-                info = {}
-
-            # --- 1. 基礎價格 ---
-            # 優先使用 yfinance 即時資料，再回退到參考資料
-            close = np.nan
-
-            # 先嘗試從 yfinance info 取得
-            close = info.get('currentPrice') or info.get('previousClose')
-
-            # 若 info 沒有，嘗試從歷史資料取得
-            if (pd.isna(close) or close == 0) and not history_data.empty:
-                try:
-                    df_price = history_data[symbol] if len(stock_list) > 1 else history_data
-                    valid_closes = df_price['Close'].dropna()
-                    if not valid_closes.empty:
-                        close = valid_closes.iloc[-1]
-                except Exception:
-                    pass
-
-            # 最後才使用參考資料（可能是舊的）
-            if (pd.isna(close) or close == 0) and ref_data is not None:
-                close = parse_float(ref_data.get('收盤'))
-
-            # --- 2. 估值指標 ---
-            pe = np.nan
-            pb = np.nan
-            roe = np.nan
-
-            if ref_data is not None:
-                pe = parse_float(ref_data.get('本益比'))
-                pb = parse_float(ref_data.get('淨值比'))
-                roe = parse_float(ref_data.get('ROE'))
-
-            if pd.isna(pe):
-                pe = info.get('trailingPE', np.nan)
-            if pd.isna(pb):
-                pb = info.get('priceToBook', np.nan)
-            if pd.isna(roe):
-                roe_yf = info.get('returnOnEquity', np.nan)
-                roe = roe_yf * 100 if roe_yf else np.nan
-
-            # --- 3. 20 日報酬率 ---
-            r_20d = np.nan
-            if not history_data.empty:
-                try:
-                    df_p = history_data[symbol] if len(stock_list) > 1 else history_data
-                    if len(df_p) >= 20:
-                        current_close = close if (close and not pd.isna(close)) else df_p['Close'].iloc[-1]
-                        price_20d_ago = df_p['Close'].iloc[-20]
-                        r_20d = (current_close - price_20d_ago) / price_20d_ago
-                except Exception:
-                    pass
-
-            # --- 4. GVI 計算 ---
-            roe_ratio = roe / 100 if (roe and roe > 1) else roe
-            gvi = np.nan
-            if pb and pb > 0 and roe_ratio and roe_ratio > 0:
-                gvi = (1/pb * (1+roe_ratio)**5)
-            elif ref_data is not None:
-                gvi = parse_float(ref_data.get('GVI指標'))
-
-            # --- 5. 殖利率 ---
-            div_yield = np.nan
-            if ref_data is not None:
-                raw_yield = parse_float(ref_data.get('殖利率'))
-                if not pd.isna(raw_yield):
-                    div_yield = raw_yield / 100
-
-            if pd.isna(div_yield):
-                div_rate = info.get('dividendRate', 0)
-                div_yield = (div_rate / close * 100) if (div_rate and close) else 0
-
-            # --- 6. 獲利能力 (毛利率, 營業利益率, 稅後淨利率, 稅前淨利率) ---
-            gross_margin = np.nan
-            op_margin = np.nan
-            net_margin = np.nan
-            pretax_margin = np.nan
-            revenue_growth = np.nan
-
-            if ref_data is not None:
-                gross_margin = parse_float(ref_data.get('毛利率'))
-                op_margin = parse_float(ref_data.get('營業利益率'))
-                net_margin = parse_float(ref_data.get('稅後淨利率'))
-
-            # 從 Info 獲取基礎數據
-            if pd.isna(gross_margin):
-                gross_margin = info.get('grossMargins', 0) * 100
-            if pd.isna(op_margin):
-                op_margin = info.get('operatingMargins', 0) * 100
-            if pd.isna(net_margin):
-                net_margin = info.get('profitMargins', 0) * 100
-
-            revenue_growth_raw = info.get('revenueGrowth', np.nan)
-            revenue_growth = revenue_growth_raw * 100 if not pd.isna(revenue_growth_raw) else np.nan
-
-            earnings_growth = np.nan
-            if ref_data is not None:
-                earnings_growth = parse_float(ref_data.get('EPS成長率'))
-
-            if pd.isna(earnings_growth):
-                earnings_growth_raw = info.get('earningsGrowth', np.nan)
-                earnings_growth = earnings_growth_raw * 100 if not pd.isna(earnings_growth_raw) else np.nan
-
-            # 嘗試從 Financials 計算 稅前淨利率 & 補強其他數據
-            try:
-                fin = ticker.financials
-                if not fin.empty:
-                    # 稅前淨利率 = Pretax Income / Total Revenue
-                    if 'Pretax Income' in fin.index and 'Total Revenue' in fin.index:
-                        pretax_income = fin.loc['Pretax Income'].iloc[0]
-                        total_revenue = fin.loc['Total Revenue'].iloc[0]
-                        if total_revenue != 0:
-                            pretax_margin = (pretax_income / total_revenue) * 100
-            except Exception as e:
-                pass
-
-            # 本業比例 (營業利益率 / 稅前淨利率)
-            core_ratio = np.nan
-            denominator = pretax_margin if (pretax_margin and not pd.isna(pretax_margin)) else net_margin
-
-            if not pd.isna(op_margin) and not pd.isna(denominator) and denominator > 0:
-                core_ratio = (op_margin / denominator * 100)
-
-            # --- 7. PE 區間 & 5年最低 PE ---
-            pe_range_str = "-"
-            pe_min_5y = np.nan
-
-            # 計算 5年最低 PE
-            pe_min_5y = calculate_min_pe_5y(ticker, history_data, symbol)
-
-            if ref_data is not None and '本益比區間' in ref_data:
-                pe_range_str = str(ref_data['本益比區間'])
-
-            if pe_range_str == "-" or pe_range_str == "nan":
-                eps = info.get('trailingEps')
-                if not history_data.empty and eps and eps > 0 and close:
-                    try:
-                        df_p = history_data[symbol] if len(stock_list) > 1 else history_data
-                        high_y = df_p['Close'].tail(250).max()
-                        low_y = df_p['Close'].tail(250).min()
-                        pe_cur = close / eps
-                        pe_min = low_y / eps
-                        pe_max = high_y / eps
-                        pe_range_str = f"{pe_cur:.1f} [{pe_min:.1f}-{pe_max:.1f}]"
-                    except Exception:
-                        pass
-
-            # --- 8. 籌碼 (外資持股) ---
-            foreign_pct = np.nan
-            if ref_data is not None:
-                foreign_pct = parse_float(ref_data.get('外資持股(%)'))
-
-            if pd.isna(foreign_pct):
-                foreign_pct = info.get('heldPercentInstitutions', 0) * 100
-                if foreign_pct > 100:
-                    foreign_pct = np.nan
-
-            vol_lots = 0
-            if ref_data is not None:
-                vol_lots = parse_float(ref_data.get('張數'), 0)
-
-            if vol_lots == 0:
-                vol_shares = info.get('volume', 0)
-                vol_lots = int(vol_shares / 1000) if vol_shares else 0
-
-            # --- 9. 收盤日期 ---
-            close_date = ""
-            if not history_data.empty:
-                try:
-                    df_p = history_data[symbol] if len(stock_list) > 1 else history_data
-                    if not df_p.empty:
-                        # 找出實際有收盤價的最後一筆日期
-                        # 過濾掉 NaN 值，取最後一筆有效資料的日期
-                        valid_closes = df_p['Close'].dropna()
-                        if not valid_closes.empty:
-                            last_date = valid_closes.index[-1]
-                            close_date = last_date.strftime('%Y-%m-%d')
-                except Exception:
-                    pass
-
-            if not close_date and info.get('regularMarketTime'):
-                try:
-                    ts = info.get('regularMarketTime')
-                    close_date = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d')
-                except Exception:
-                    pass
-
-            # --- 10. 財務健康指標 (現金流穩定、低負債) ---
-            # 自由現金流 (Free Cash Flow)
-            free_cash_flow = np.nan
-            # 營業現金流 (Operating Cash Flow)
-            operating_cash_flow = np.nan
-            # 負債比率 (Debt Ratio) = 總負債 / 總資產
-            debt_ratio = np.nan
-            # 流動比率 (Current Ratio) = 流動資產 / 流動負債
-            current_ratio = np.nan
-            # 速動比率 (Quick Ratio) = (流動資產-存貨) / 流動負債
-            quick_ratio = np.nan
-            # 現金流量比 (Cash Flow Ratio) = 營業現金流 / 稅後淨利
-            cash_flow_ratio = np.nan
-            # 淨負債 (Net Debt) = 總負債 - 現金
-            net_debt = np.nan
-            # 淨負債比率 (Net Debt / Equity)
-            net_debt_ratio = np.nan
-            # 產業類別
-            sector = info.get('sector', '')
-            industry = info.get('industry', '')
-
-            # 從 yfinance 抓取現金流與資產負債表資料
-            try:
-                # 現金流量表
-                cf = ticker.cashflow
-                if not cf.empty:
-                    if 'Free Cash Flow' in cf.index:
-                        free_cash_flow = cf.loc['Free Cash Flow'].iloc[0]
-                    if 'Operating Cash Flow' in cf.index:
-                        operating_cash_flow = cf.loc['Operating Cash Flow'].iloc[0]
-
-                # 資產負債表
-                bs = ticker.balance_sheet
-                if not bs.empty:
-                    total_assets = bs.loc['Total Assets'].iloc[0] if 'Total Assets' in bs.index else np.nan
-                    total_liab = bs.loc['Total Liabilities Net Minority Interest'].iloc[0] if 'Total Liabilities Net Minority Interest' in bs.index else np.nan
-                    total_debt = bs.loc['Total Debt'].iloc[0] if 'Total Debt' in bs.index else np.nan
-
-                    cash_equiv = np.nan
-                    for cash_key in ['Cash And Cash Equivalents', 'Cash Cash Equivalents And Short Term Investments', 'Cash Financial']:
-                        if cash_key in bs.index:
-                            cash_equiv = bs.loc[cash_key].iloc[0]
-                            break
-
-                    total_equity = np.nan
-                    for eq_key in ['Stockholders Equity', 'Total Equity Gross Minority Interest']:
-                        if eq_key in bs.index:
-                            total_equity = bs.loc[eq_key].iloc[0]
-                            break
-
-                    current_assets = bs.loc['Current Assets'].iloc[0] if 'Current Assets' in bs.index else np.nan
-                    current_liab = bs.loc['Current Liabilities'].iloc[0] if 'Current Liabilities' in bs.index else np.nan
-                    inventory = bs.loc['Inventory'].iloc[0] if 'Inventory' in bs.index else 0
-
-                    # 計算負債比率
-                    if not pd.isna(total_liab) and not pd.isna(total_assets) and total_assets > 0:
-                        debt_ratio = (total_liab / total_assets) * 100
-
-                    # 計算流動比率
-                    if not pd.isna(current_assets) and not pd.isna(current_liab) and current_liab > 0:
-                        current_ratio = (current_assets / current_liab) * 100
-
-                    # 計算速動比率
-                    if not pd.isna(current_assets) and not pd.isna(current_liab) and current_liab > 0:
-                        quick_assets = current_assets - (inventory if not pd.isna(inventory) else 0)
-                        quick_ratio = (quick_assets / current_liab) * 100
-
-                    # 計算淨負債與淨負債比率
-                    if not pd.isna(total_debt) and not pd.isna(cash_equiv):
-                        net_debt = total_debt - cash_equiv
-                        if not pd.isna(total_equity) and total_equity > 0:
-                            net_debt_ratio = (net_debt / total_equity) * 100
-
-                # 計算現金流量比 (營業現金流 / 稅後淨利)
-                income_stmt = ticker.financials
-                if not income_stmt.empty and not pd.isna(operating_cash_flow):
-                    net_income = income_stmt.loc['Net Income'].iloc[0] if 'Net Income' in income_stmt.index else np.nan
-                    if not pd.isna(net_income) and net_income > 0:
-                        cash_flow_ratio = (operating_cash_flow / net_income) * 100
-
-            except Exception as e:
-                pass
-
-            # --- 新增: 資本額 & 每股淨值 (choose_stock.py 使用的欄位) ---
-            capital = np.nan  # 資本額(億)
-            bvps = np.nan     # 每股淨值
-
-            if ref_data is not None:
-                capital = parse_float(ref_data.get('資本額'))
-                bvps = parse_float(ref_data.get('每股淨值'))
-
-            if pd.isna(capital):
-                # yfinance: sharesOutstanding * 面額(10) / 1e8 得到億元
-                shares = info.get('sharesOutstanding', np.nan)
-                if not pd.isna(shares):
-                    capital = shares * 10 / 1e8
-
-            if pd.isna(bvps):
-                bvps = info.get('bookValue', np.nan)
-
-            # 從 info 補充（若上面沒抓到）
-            if pd.isna(debt_ratio):
-                debt_to_equity = info.get('debtToEquity', np.nan)
-                if not pd.isna(debt_to_equity):
-                    # 負債權益比轉負債比率: D/E -> D/(D+E) = 1/(1+E/D)
-                    debt_ratio = (debt_to_equity / (100 + debt_to_equity)) * 100
-
-            if pd.isna(current_ratio):
-                current_ratio = info.get('currentRatio', np.nan)
-                if not pd.isna(current_ratio):
-                    current_ratio = current_ratio * 100
-
-            if pd.isna(quick_ratio):
-                quick_ratio = info.get('quickRatio', np.nan)
-                if not pd.isna(quick_ratio):
-                    quick_ratio = quick_ratio * 100
-
-            if pd.isna(free_cash_flow):
-                free_cash_flow = info.get('freeCashflow', np.nan)
-
-            if pd.isna(net_debt):
-                total_debt_info = info.get('totalDebt', np.nan)
-                total_cash_info = info.get('totalCash', np.nan)
-                if not pd.isna(total_debt_info) and not pd.isna(total_cash_info):
-                    net_debt = total_debt_info - total_cash_info
-
-            if pd.isna(net_debt_ratio) and not pd.isna(net_debt):
-                debt_to_equity = info.get('debtToEquity', np.nan)
-                if not pd.isna(debt_to_equity):
-                    # D/E = Debt/Equity，推估 Equity = Debt / (D/E)
-                    total_debt_info = info.get('totalDebt', np.nan)
-                    if not pd.isna(total_debt_info) and debt_to_equity > 0:
-                        est_equity = total_debt_info / (debt_to_equity / 100)
-                        if est_equity > 0:
-                            net_debt_ratio = (net_debt / est_equity) * 100
-
-            # --- 11. 成交量分析 (低檔盤整+量能放大) ---
-            vol_analysis = calculate_volume_analysis(history_data, symbol, stock_list)
-
-            result_list.append({
-                '證券代號': symbol,
-                '證券名稱': get_tw_name(symbol),
-                '收盤': close,
-                '收盤日期': close_date,
-                'GVI指標': gvi,
-                '20日報酬率': r_20d,
-                '殖利率': div_yield,
-                '本益比': pe,
-                '淨值比': pb,
-                'ROE': roe,
-                '外資持股(%)': foreign_pct,
-                '張數': vol_lots,
-                '毛利率': gross_margin,
-                '營業利益率': op_margin,
-                '稅後淨利率': net_margin,
-                '稅前淨利率': pretax_margin,
-                '本業比例': core_ratio,
-                '營收成長率': revenue_growth,
-                '淨利成長率': earnings_growth,
-                'EPS成長率': earnings_growth,
-                '近五年最低本益比': pe_min_5y,
-                '本益比區間': pe_range_str,
-                # --- 新增: 財務健康指標 ---
-                '自由現金流': free_cash_flow,
-                '負債比率': debt_ratio,
-                '淨負債': net_debt,
-                '淨負債比率': net_debt_ratio,
-                '流動比率': current_ratio,
-                '速動比率': quick_ratio,
-                '現金流量比': cash_flow_ratio,
-                '資本額': capital,
-                '每股淨值': bvps,
-                '產業': sector,
-                '細產業': industry,
-                # --- 新增: 成交量分析 ---
-                '5日均量': vol_analysis['vol_ma5'],
-                '20日均量': vol_analysis['vol_ma20'],
-                '量能倍數': vol_analysis['vol_ratio'],
-                '量能訊號': vol_analysis['vol_signal']
-            })
-
-        except Exception as e:
-            print(f"Error {symbol}: {e}")
-
-    return pd.DataFrame(result_list)
-
-
-def calculate_scores(df):
-    """計算三因子評分"""
-    # 確保數值型態
-    numeric_cols = ['淨值比', 'ROE', '20日報酬率']
-    for col in numeric_cols:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors='coerce')
-
-    df_valid = df[(df['淨值比'] > 0) & (df['ROE'] > 0)].copy()
-
-    if df_valid.empty:
-        return df
+            fin = ticker.financials
+            if not fin.empty:
+                items['pretax_income'] = get_first_value(fin, ['Pretax Income'])
+                items['total_revenue'] = get_first_value(fin, ['Total Revenue'])
+                items['net_income'] = get_first_value(fin, ['Net Income'])
+        except Exception:
+            pass
 
-    # 百分位排名（0-100）
-    df_valid['ROE_Score'] = df_valid['ROE'].rank(pct=True) * 100
-    df_valid['PB_Score'] = (1 / df_valid['淨值比']).rank(pct=True) * 100
-    df_valid['R_Score'] = df_valid['20日報酬率'].rank(pct=True) * 100 if '20日報酬率' in df_valid.columns else 0
+    if 'cashflow' in parts:
+        try:
+            # 現金流量表
+            cf = ticker.cashflow
+            if not cf.empty:
+                items['free_cash_flow'] = get_first_value(cf, ['Free Cash Flow'])
+                items['operating_cash_flow'] = get_first_value(cf, ['Operating Cash Flow'])
+        except Exception:
+            pass
 
-    # 三因子等權重評分
-    df_valid['三因子評分'] = df_valid['ROE_Score'] * 0.33 + df_valid['PB_Score'] * 0.33 + df_valid['R_Score'] * 0.34
+    if 'balance_sheet' in parts:
+        try:
+            # 資產負債表
+            bs = ticker.balance_sheet
+            if not bs.empty:
+                items['total_assets'] = get_first_value(bs, ['Total Assets'])
+                items['total_liab'] = get_first_value(bs, ['Total Liabilities Net Minority Interest'])
+                items['total_debt'] = get_first_value(bs, ['Total Debt'])
+                items['cash_equiv'] = get_first_value(bs, ['Cash And Cash Equivalents', 'Cash Cash Equivalents And Short Term Investments', 'Cash Financial'])
+                items['total_equity'] = get_first_value(bs, ['Stockholders Equity', 'Total Equity Gross Minority Interest'])
+                items['current_assets'] = get_first_value(bs, ['Current Assets'])
+                items['current_liab'] = get_first_value(bs, ['Current Liabilities'])
+                items['inventory'] = get_first_value(bs, ['Inventory'], 0)
+        except Exception:
+            pass
 
-    return df_valid
+    return items
 
 
-def calculate_financial_health_score(df):
+def fetch_symbol_details(symbol, with_info, statement_parts, with_eps):
     """
-    計算財務健康評分
-    評分邏輯：
-    - 現金流正向 (+20分): 自由現金流 > 0
-    - 低負債 (+20分): 負債比率 < 50%
-    - 高流動性 (+15分): 流動比率 > 150%
-    - 本業強健 (+15分): 本業比例 > 60%
-    - 獲利穩定 (+15分): 現金流量比 > 80%
-    - 本益比合理 (+15分): PE < 15 或 PE < 近5年最低PE
+    抓取單一股票的 info、財報科目與年度 EPS (供多執行緒同時抓取)
+    回傳 (info 欄位 dict, 財報科目 dict, 年度 EPS DataFrame 或 None)
     """
-    df = df.copy()
-
-    # 確保數值型態
-    health_cols = ['自由現金流', '負債比率', '流動比率', '本業比例', '現金流量比', '本益比', '近五年最低本益比']
-    for col in health_cols:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors='coerce')
-
-    # 初始化評分
-    df['財務健康評分'] = 0.0
-
-    # 1. 現金流正向 (+20分)
-    if '自由現金流' in df.columns:
-        df.loc[df['自由現金流'] > 0, '財務健康評分'] += 20
-
-    # 2. 低負債 (+20分): 負債比率 < 50%
-    if '負債比率' in df.columns:
-        df.loc[df['負債比率'] < 50, '財務健康評分'] += 20
+    ticker = yf.Ticker(symbol)
+    info_row = {}
+    if with_info:
+        # 嘗試取得 info，若失敗則為空字典
+        try:
+            info = ticker.info
+        except Exception:
+            info = {}
+        info_row = {key: info.get(key) for key in INFO_KEYS}
+    statement_row = get_statement_items(ticker, statement_parts)
+
+    # 收集年度 EPS，之後對整個股價矩陣一次計算 5年最低 PE
+    eps_frame = None
+    if with_eps:
+        eps_series = get_annual_eps(ticker)
+        eps_frame = pd.DataFrame({'證券代號': symbol, '年度': eps_series.index, 'EPS': eps_series.values})
+    return info_row, statement_row, eps_frame
+
+
+def build_reference_table(ref_df, symbols):
+    """將參考資料一次轉為數值欄位，索引為證券代號 (含 .TW)"""
+    if ref_df is None or ref_df.empty:
+        return pd.DataFrame(index=symbols)
+
+    ref_df = ref_df[~ref_df.index.duplicated()]
+    codes = [symbol.split('.')[0] for symbol in symbols]
+    ref = ref_df.reindex(codes)
+    ref.index = symbols
+
+    table = pd.DataFrame(index=symbols)
+    numeric_cols = ['收盤', '本益比', '淨值比', 'ROE', 'GVI指標', '殖利率', '毛利率', '營業利益率',
+                    '稅後淨利率', 'EPS成長率', '外資持股(%)', '張數', '資本額', '每股淨值']
+    for col in numeric_cols:
+        if col in ref.columns:
+            table[col] = parse_float_series(ref[col])
 
-    # 3. 高流動性 (+15分): 流動比率 > 150%
-    if '流動比率' in df.columns:
-        df.loc[df['流動比率'] > 150, '財務健康評分'] += 15
+    # 參考資料殖利率為百分比，統一轉為小數
+    if '殖利率' in table.columns:
+        table['殖利率'] = table['殖利率'] / 100
 
-    # 4. 本業強健 (+15分): 本業比例 > 60%
-    if '本業比例' in df.columns:
-        df.loc[df['本業比例'] > 60, '財務健康評分'] += 15
+    if '本益比區間' in ref.columns:
+        pe_range = ref['本益比區間'].astype('string').str.strip()
+        table['本益比區間'] = pe_range.where(~pe_range.isin(['-', 'nan']))
 
-    # 5. 獲利穩定 (+15分): 現金流量比 > 80%
-    if '現金流量比' in df.columns:
-        df.loc[df['現金流量比'] > 80, '財務健康評分'] += 15
+    return table
 
-    # 6. 本益比合理 (+15分): PE < 15 或 PE < 近5年最低PE
-    if '本益比' in df.columns:
-        pe_reasonable = (df['本益比'] < 15) & (df['本益比'] > 0)
-        if '近五年最低本益比' in df.columns:
-            pe_undervalued = (df['本益比'] < df['近五年最低本益比']) & (df['本益比'] > 0)
-            df.loc[pe_reasonable | pe_undervalued, '財務健康評分'] += 15
-        else:
-            df.loc[pe_reasonable, '財務健康評分'] += 15
 
-    return df
+def get_mops_fundamentals():
+    """抓取最新一季 MOPS 彙總報表 (上市、上櫃，各報表同時抓取)，回傳 {報表類型: DataFrame}"""
+    year, season = get_latest_report_period()
+    return get_statements(year, season, MOPS_REPORT_TYPES)
 
 
-def filter_quality_stocks(df, strict=False):
+def build_mops_table(statements, symbols):
     """
-    篩選高品質股票 (現金流穩定、低負債、真正賺錢)
-
-    篩選條件 (寬鬆模式):
-    - 本益比 < 20 (避開高本益比夢想股)
-    - 負債比率 < 60%
-    - 本業比例 > 50%
-
-    篩選條件 (嚴格模式 strict=True):
-    - 本益比 < 15
-    - 負債比率 < 50%
-    - 流動比率 > 150%
-    - 本業比例 > 60%
-    - 自由現金流 > 0
-    - ROE > 10%
+    由 MOPS 彙總報表整理各項比率，索引為證券代號 (含 .TW / .TWO)
+    金額單位為仟元；營益分析的比率已是百分比
     """
-    df = df.copy()
-
-    # 確保數值型態
-    filter_cols = ['本益比', '負債比率', '流動比率', '本業比例', '自由現金流', 'ROE']
-    for col in filter_cols:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors='coerce')
-
-    # 建立篩選標籤欄位
-    df['通過品質篩選'] = True
-    df['排除原因'] = ''
-
-    if strict:
-        # 嚴格模式
-        # 1. 本益比 < 15
-        if '本益比' in df.columns:
-            fail_pe = (df['本益比'] >= 15) | (df['本益比'] <= 0)
-            df.loc[fail_pe, '通過品質篩選'] = False
-            df.loc[fail_pe, '排除原因'] += '高PE;'
-
-        # 2. 負債比率 < 50%
-        if '負債比率' in df.columns:
-            fail_debt = df['負債比率'] >= 50
-            df.loc[fail_debt, '通過品質篩選'] = False
-            df.loc[fail_debt, '排除原因'] += '高負債;'
-
-        # 3. 流動比率 > 150%
-        if '流動比率' in df.columns:
-            fail_current = df['流動比率'] <= 150
-            df.loc[fail_current, '通過品質篩選'] = False
-            df.loc[fail_current, '排除原因'] += '低流動;'
-
-        # 4. 本業比例 > 60%
-        if '本業比例' in df.columns:
-            fail_core = df['本業比例'] <= 60
-            df.loc[fail_core, '通過品質篩選'] = False
-            df.loc[fail_core, '排除原因'] += '低本業;'
-
-        # 5. 自由現金流 > 0
-        if '自由現金流' in df.columns:
-            fail_fcf = df['自由現金流'] <= 0
-            df.loc[fail_fcf, '通過品質篩選'] = False
-            df.loc[fail_fcf, '排除原因'] += '負現金流;'
-
-        # 6. ROE > 10%
-        if 'ROE' in df.columns:
-            fail_roe = df['ROE'] <= 10
-            df.loc[fail_roe, '通過品質篩選'] = False
-            df.loc[fail_roe, '排除原因'] += '低ROE;'
-    else:
-        # 寬鬆模式
-        # 1. 本益比 < 20 (避開高本益比夢想股)
-        if '本益比' in df.columns:
-            fail_pe = (df['本益比'] >= 20) | (df['本益比'] <= 0)
-            df.loc[fail_pe, '通過品質篩選'] = False
-            df.loc[fail_pe, '排除原因'] += '高PE;'
-
-        # 2. 負債比率 < 60%
-        if '負債比率' in df.columns:
-            fail_debt = df['負債比率'] >= 60
-            df.loc[fail_debt, '通過品質篩選'] = False
-            df.loc[fail_debt, '排除原因'] += '高負債;'
-
-        # 3. 本業比例 > 50%
-        if '本業比例' in df.columns:
-            fail_core = df['本業比例'] <= 50
-            df.loc[fail_core, '通過品質篩選'] = False
-            df.loc[fail_core, '排除原因'] += '低本業;'
-
-    return df
-
+    table = pd.DataFrame(index=symbols)
+    codes = [symbol.split('.')[0] for symbol in symbols]
+
+    def aligned(report_type):
+        df = statements.get(report_type)
+        if df is None or df.empty:
+            return None
+        df = df.drop_duplicates('證券代號').set_index('證券代號').reindex(codes)
+        df.index = symbols
+        return df
 
-def evaluate_four_levels(df):
+    margins = aligned('營益分析')
+    if margins is not None:
+        table['gross_margin'] = margins['毛利率']
+        table['op_margin'] = margins['營業利益率']
+        table['pretax_margin'] = margins['稅前純益率']
+        table['net_margin'] = margins['稅後純益率']
+
+    balance = aligned('資產負債')
+    if balance is not None:
+        assets = balance['資產總額']
+        table['debt_ratio'] = (balance['負債總額'] / assets * 100).where(assets > 0)
+        current_liab = balance['流動負債']
+        table['current_ratio'] = (balance['流動資產'] / current_liab * 100).where(current_liab > 0)
+        # 股本 (仟元) 換算為億元
+        table['capital'] = balance['股本'] / 1e5
+        table['book_value'] = balance['每股參考淨值']
+    return table
+
+
+def plan_statement_parts(metrics, bulk_sources, symbols, need_eps):
     """
-    四道關卡選股法：從篩選到決策
-    1. 獲利能力: ROE > 15, 毛利率 > 20, 營業利益率 > 10
-    2. 財務安全: 營現比 > 80%, 自由現金流 > 0, 負債比 < 50%
-    3. 成長動能: 營收年增 > 0, 淨利年增 > 0
-    4. 估值與買賣:
-       - 買進: 股價落入「合理偏低」估值區間
-       - 賣出: 基本面惡化 或 股價「過於昂貴」
+    決定每檔股票需要逐檔抓取的財報 (financials / cashflow / balance_sheet)
+    某欄位在優先順序較前的全市場來源 (參考資料、MOPS) 已有值時，後面的逐檔財報欄位不會被用到，不必抓取
+    回傳 {財報: bool 陣列 (每檔是否需要)}
     """
-    df = df.copy()
-
-    # 確保數值
-    numeric_cols = ['ROE', '毛利率', '營業利益率', '現金流量比', '自由現金流', '負債比率', '營收成長率', '淨利成長率', '本益比', '近五年最低本益比']
-    for c in numeric_cols:
-        if c in df.columns:
-            df[c] = pd.to_numeric(df[c], errors='coerce')
-
-    # Level 1: 獲利能力
-    c1 = (df['ROE'] > 15) & (df['毛利率'] > 20) & (df['營業利益率'] > 10)
-    df['L1_獲利能力'] = c1.map({True: 'Pass', False: 'Fail'})
-
-    # Level 2: 財務安全
-    c2 = (df['現金流量比'] > 80) & (df['自由現金流'] > 0) & (df['負債比率'] < 50)
-    df['L2_財務安全'] = c2.map({True: 'Pass', False: 'Fail'})
+    n = len(symbols)
+    needed = {part: np.zeros(n, dtype=bool) for part in STATEMENT_PARTS}
+    if need_eps:
+        needed['financials'][:] = True
+
+    for name in metrics:
+        covered = np.zeros(n, dtype=bool)
+        for source, column in METRIC_SOURCES.get(name, []) + CALC_SOURCES.get(name, []):
+            if source in bulk_sources and column in bulk_sources[source].columns:
+                covered |= bulk_sources[source][column].reindex(symbols).notna().to_numpy()
+            elif source == 'stmt':
+                for part in STATEMENT_INPUTS[column]:
+                    needed[part] |= ~covered
+    return needed
+
+
+def build_info_table(info_rows, symbols):
+    """將各股 yfinance info 整理成表格，並換算成輸出所需單位"""
+    info = pd.DataFrame(info_rows, index=symbols).reindex(columns=INFO_KEYS)
+    text_cols = ['sector', 'industry']
+    num = info.drop(columns=text_cols).apply(pd.to_numeric, errors='coerce')
+    table = num.copy()
+    table[text_cols] = info[text_cols]
+
+    # 現價: currentPrice 為空或 0 時改用 previousClose
+    current = num['currentPrice']
+    table['close'] = current.where(current.notna() & (current != 0), num['previousClose'])
+
+    table['roe'] = (num['returnOnEquity'] * 100).where(num['returnOnEquity'] != 0)
+
+    # 缺少毛利率等欄位時以 0 計
+    table['gross_margin'] = num['grossMargins'].fillna(0) * 100
+    table['op_margin'] = num['operatingMargins'].fillna(0) * 100
+    table['net_margin'] = num['profitMargins'].fillna(0) * 100
+    table['revenue_growth'] = num['revenueGrowth'] * 100
+    table['earnings_growth'] = num['earningsGrowth'] * 100
+
+    foreign_pct = num['heldPercentInstitutions'].fillna(0) * 100
+    table['foreign_pct'] = foreign_pct.where(foreign_pct <= 100)
+    table['vol_lots'] = (num['volume'].fillna(0) // 1000).astype(int)
+
+    market_time = pd.to_datetime(num['regularMarketTime'], unit='s', errors='coerce')
+    table['close_date'] = market_time.dt.strftime('%Y-%m-%d')
+
+    # yfinance: sharesOutstanding * 面額(10) / 1e8 得到億元
+    table['capital'] = num['sharesOutstanding'] * 10 / 1e8
+
+    # 負債權益比轉負債比率: D/E -> D/(D+E)
+    debt_to_equity = num['debtToEquity']
+    table['debt_ratio'] = debt_to_equity / (100 + debt_to_equity) * 100
+    table['current_ratio'] = num['currentRatio'] * 100
+    table['quick_ratio'] = num['quickRatio'] * 100
+    table['net_debt'] = num['totalDebt'] - num['totalCash']
+
+    # D/E = Debt/Equity，推估 Equity = Debt / (D/E)
+    est_equity = num['totalDebt'] / (debt_to_equity / 100)
+    table['est_equity'] = est_equity.where((debt_to_equity > 0) & (est_equity > 0))
+    return table
+
+
+def build_statement_table(statement_rows, symbols):
+    """由財報科目一次計算各項比率"""
+    columns = ['pretax_income', 'total_revenue', 'net_income', 'free_cash_flow', 'operating_cash_flow',
+               'total_assets', 'total_liab', 'total_debt', 'cash_equiv', 'total_equity',
+               'current_assets', 'current_liab', 'inventory']
+    raw = pd.DataFrame(statement_rows, index=symbols).reindex(columns=columns).apply(pd.to_numeric, errors='coerce')
+    table = pd.DataFrame(index=symbols)
+
+    # 稅前淨利率 = Pretax Income / Total Revenue
+    revenue = raw['total_revenue']
+    table['pretax_margin'] = (raw['pretax_income'] / revenue * 100).where(revenue != 0)
+    table['free_cash_flow'] = raw['free_cash_flow']
+
+    assets = raw['total_assets']
+    table['debt_ratio'] = (raw['total_liab'] / assets * 100).where(assets > 0)
+
+    current_liab = raw['current_liab']
+    table['current_ratio'] = (raw['current_assets'] / current_liab * 100).where(current_liab > 0)
+    quick_assets = raw['current_assets'] - raw['inventory'].fillna(0)
+    table['quick_ratio'] = (quick_assets / current_liab * 100).where(current_liab > 0)
+
+    # 淨負債 = 總負債 - 現金，淨負債比率 = 淨負債 / 股東權益
+    table['net_debt'] = raw['total_debt'] - raw['cash_equiv']
+    equity = raw['total_equity']
+    table['net_debt_ratio'] = (table['net_debt'] / equity * 100).where(equity > 0)
+
+    # 現金流量比 = 營業現金流 / 稅後淨利
+    net_income = raw['net_income']
+    table['cash_flow_ratio'] = (raw['operating_cash_flow'] / net_income * 100).where(net_income > 0)
+    return table
+
+
+def build_history_table(prices, symbols):
+    """由股價矩陣一次取出最新收盤、收盤日期、20 日前收盤與近 250 日高低點"""
+    columns = ['close', 'close_date', 'close_20d', 'high_250', 'low_250']
+    if len(prices.dates) == 0:
+        return pd.DataFrame(index=symbols, columns=columns, dtype=float)
+
+    tail, counts = prices.tail(250, fields=('close',))
+    closes = tail['close']
+
+    # 每檔最後一筆有效收盤的日期
+    valid = ~np.isnan(prices.close)
+    last_idx = valid.shape[1] - 1 - np.argmax(valid[:, ::-1], axis=1)
+    close_date = pd.Series(prices.dates[last_idx].strftime('%Y-%m-%d'), index=prices.symbols)
+
+    table = pd.DataFrame({
+        'close': closes[:, -1],
+        'close_date': close_date.where(counts > 0),
+        'close_20d': closes[:, -20],
+        'high_250': np.fmax.reduce(closes, axis=1),
+        'low_250': np.fmin.reduce(closes, axis=1),
+    }, index=prices.symbols)
+    return table.reindex(symbols)
+
+
+def build_calc_table(merged, hist, info, stmt):
+    """以第一階段合併後的欄位計算 GVI、20日報酬率、殖利率、本業比例、本益比區間等"""
+    table = pd.DataFrame(index=merged.index)
+    close = pd.to_numeric(merged['收盤'], errors='coerce')
+
+    # 20 日報酬率
+    table['r_20d'] = (close.fillna(hist['close']) - hist['close_20d']) / hist['close_20d']
+
+    # GVI = (1/PB) * (1+ROE)^5
+    pb = pd.to_numeric(merged['淨值比'], errors='coerce')
+    roe = pd.to_numeric(merged['ROE'], errors='coerce')
+    roe_ratio = roe.where(roe <= 1, roe / 100)
+    table['gvi'] = (1 / pb * (1 + roe_ratio) ** 5).where((pb > 0) & (roe_ratio > 0))
+
+    # 殖利率 (yfinance 股利 / 現價)
+    div_rate = info['dividendRate']
+    has_div = div_rate.notna() & (div_rate != 0) & close.notna() & (close != 0)
+    table['div_yield'] = (div_rate / close * 100).where(has_div, 0)
+
+    # 本業比例 = 營業利益率 / 稅前淨利率 (無稅前淨利率時改用稅後淨利率)
+    op_margin = pd.to_numeric(merged['營業利益率'], errors='coerce')
+    pretax_margin = pd.to_numeric(merged['稅前淨利率'], errors='coerce')
+    net_margin = pd.to_numeric(merged['稅後淨利率'], errors='coerce')
+    denominator = pretax_margin.where(pretax_margin.notna() & (pretax_margin != 0), net_margin)
+    table['core_ratio'] = (op_margin / denominator * 100).where(denominator > 0)
+
+    # 本益比區間: 現價本益比 [近一年最低-最高]
+    eps = info['trailingEps']
+    has_range = (eps > 0) & close.notna() & (close != 0) & hist['high_250'].notna()
+    table['pe_range'] = np.nan
+    if has_range.any():
+        pe_cur = (close / eps)[has_range]
+        pe_min = (hist['low_250'] / eps)[has_range]
+        pe_max = (hist['high_250'] / eps)[has_range]
+        table['pe_range'] = (
+            pe_cur.map('{:.1f}'.format) + ' [' + pe_min.map('{:.1f}'.format) + '-' + pe_max.map('{:.1f}'.format) + ']'
+        ).reindex(table.index)
+
+    # 淨負債比率: 以 info 推估的股東權益計算
+    net_debt = pd.to_numeric(merged['淨負債'], errors='coerce')
+    table['net_debt_ratio'] = net_debt / info['est_equity'] * 100
+    return table
+
+
+def resolve_metric_inputs(columns):
+    """
+    依要輸出的欄位展開相依關係
+    回傳 (需要合併或計算的欄位 set, 需要抓取的原始資料 set)
+    """
+    metrics = set()
+    inputs = set()
+    pending = list(columns)
+    while pending:
+        name = pending.pop()
+        if name in RAW_INPUTS:
+            inputs.add(name)
+            continue
+        if name in metrics:
+            continue
+        metrics.add(name)
+
+        for source, column in METRIC_SOURCES.get(name, []) + CALC_SOURCES.get(name, []):
+            if source == 'stmt':
+                pending.extend(STATEMENT_INPUTS[column])
+            elif source == 'calc':
+                pending.extend(CALC_INPUTS[column])
+            else:
+                pending.extend(SOURCE_INPUTS.get(source, []))
+        pending.extend(DERIVED_INPUTS.get(name, []))
 
-    # Level 3: 成長動能
-    c3 = (df['營收成長率'] > 0) & (df['淨利成長率'] > 0)
-    df['L3_成長動能'] = c3.map({True: 'Pass', False: 'Fail'})
+    return metrics, inputs
 
-    # 綜合基本面狀態 (是否全過)
-    df['四關卡_基本面'] = (c1 & c2 & c3).map({True: '優良', False: '未達標'})
 
-    # Level 4: 估值與決策
-    def get_valuation_status(row):
-        pe = row.get('本益比', np.nan)
-        min_pe = row.get('近五年最低本益比', np.nan)
+def fetch_stock_data(stock_list, ref_df=None, with_provenance=False, columns=None, price_source='yfinance',
+                     per_symbol=True):
+    """
+    抓取股票資料並依來源優先順序合併各項指標
+    columns: 要輸出的欄位 (預設 OUTPUT_COLUMNS)，只抓取與計算這些欄位用得到的資料
+    price_source: yfinance 逐批下載還原股價，exchange 使用交易所整批行情建立的全市場股價矩陣 (見 market_prices.py)
+    per_symbol: False 時不做逐檔請求 (yfinance info、逐檔財報)，只使用參考資料、MOPS 彙總報表、股價矩陣，
+                近五年最低本益比的年度 EPS 改由財報歷史 (statement_history) 取得；只有逐檔來源的欄位為缺值
+    with_provenance=True 時一併回傳每格資料的來源代碼 (見 metric_merge.SOURCE_CODES)
+    """
+    if columns is None:
+        columns = OUTPUT_COLUMNS
+    metrics, inputs = resolve_metric_inputs(columns)
+    if not per_symbol:
+        inputs -= set(PER_SYMBOL_INPUTS)
+        print("不逐檔抓取 info 與財報，相關欄位只使用參考資料、MOPS 彙總報表與財報歷史")
+    needed = [name for name in RAW_INPUTS if name in inputs]
+    print(f"正在抓取 {len(stock_list)} 檔股票資料 (資料來源: {', '.join(needed) or '僅參考資料'})...")
+
+    info_rows = [{} for _ in stock_list]
+    statement_rows = [{} for _ in stock_list]
+    eps_frames = []
+
+    # 分批下載歷史股價（擴展至 3 年以計算最低本益比），寫入 memory-mapped 股價矩陣
+    if 'prices' in inputs and price_source == 'exchange':
+        update_daily_quotes()
+        prices = update_price_store()
+    elif 'prices' in inputs:
+        prices = download_prices(stock_list, period="3y", path=PRICE_STORE_DIRS['yfinance'])
+    else:
+        prices = PriceStore(stock_list, [])
+
+    # 全市場來源 (參考資料、MOPS 彙總報表) 先整理好，用來判斷哪些股票還需要逐檔抓財報
+    symbols = pd.Index(stock_list, name='證券代號')
+    bulk_sources = {'ref': build_reference_table(ref_df, symbols)}
+    if 'mops' in inputs:
+        bulk_sources['mops'] = build_mops_table(get_mops_fundamentals(), symbols)
+
+    # 逐檔只做網路抓取 (info、財報)，指標計算留到合併階段一次處理
+    need_eps = '近五年最低本益比' in metrics
+    needed_parts = plan_statement_parts(metrics, bulk_sources, symbols, need_eps)
+    symbol_parts = [
+        [part for part in STATEMENT_PARTS if part in inputs and needed_parts[part][i]]
+        for i in range(len(stock_list))
+    ]
+    requested = {part: int(needed_parts[part].sum()) for part in STATEMENT_PARTS if part in inputs}
+    if requested:
+        print("逐檔財報請求: " + ", ".join(
+            f"{part} {count}/{len(stock_list)} 檔" for part, count in requested.items()
+        ))
+
+    if 'info' in inputs or any(symbol_parts):
+        def fetch_one(args):
+            symbol, parts = args
+            return fetch_symbol_details(symbol, 'info' in inputs, parts, need_eps)
+
+        # 依序取回結果，列的順序與 stock_list 相同
+        with ThreadPoolExecutor(max_workers=FETCH_MAX_WORKERS) as executor:
+            results = executor.map(fetch_one, zip(stock_list, symbol_parts))
+            for i, (info_row, statement_row, eps_frame) in enumerate(results):
+                info_rows[i] = info_row
+                statement_rows[i] = statement_row
+                if eps_frame is not None:
+                    eps_frames.append(eps_frame)
+
+    sources = {
+        **bulk_sources,
+        'info': build_info_table(info_rows, symbols),
+        'stmt': build_statement_table(statement_rows, symbols),
+        'hist': build_history_table(prices, symbols),
+    }
 
-        if pd.isna(pe) or pe <= 0:
-            return 'N/A'
+    metric_spec = {name: spec for name, spec in METRIC_SOURCES.items() if name in metrics}
+    merged, provenance = coalesce_metrics(sources, metric_spec, symbols, ZERO_AS_MISSING)
 
-        # 判斷是否落在便宜區間：PE < 12 或接近近五年最低PE
-        is_cheap = (pe < 12) or (
-            not pd.isna(min_pe) and min_pe > 0 and pe < min_pe * 1.1
+    calc_spec = {name: spec for name, spec in CALC_SOURCES.items() if name in metrics}
+    if calc_spec:
+        sources['calc'] = build_calc_table(
+            merged.reindex(columns=list(METRIC_SOURCES)), sources['hist'], sources['info'], sources['stmt']
         )
-        if is_cheap:
-            return '便宜'
-
-        if pe > 25:
-            return '昂貴'
+        calc_values, calc_provenance = coalesce_metrics(sources, calc_spec, symbols)
+        merged = merged.join(calc_values)
+        provenance = provenance.join(calc_provenance)
+
+    if '證券名稱' in metrics:
+        merged['證券名稱'] = [get_tw_name(symbol) for symbol in stock_list]
+    if '淨利成長率' in metrics:
+        merged['淨利成長率'] = merged['EPS成長率']
+
+    # 近五年最低本益比: 整個股價矩陣一次計算，矩陣沒有資料的股票改以個別抓取的股價計算
+    if need_eps:
+        if not per_symbol:
+            eps_frames.append(get_history_annual_eps(stock_list))
+        eps_df = pd.concat(eps_frames, ignore_index=True) if eps_frames else pd.DataFrame(columns=['證券代號', '年度', 'EPS'])
+        min_pe, _ = calculate_min_pe_5y_batch(prices, eps_df)
+        merged['近五年最低本益比'] = min_pe.reindex(symbols)
+        if per_symbol:
+            for symbol in symbols[sources['hist']['close'].isna().to_numpy()]:
+                merged.loc[symbol, '近五年最低本益比'] = calculate_min_pe_5y(yf.Ticker(symbol), prices, symbol)
+
+    # 成交量分析: exchange 股價矩陣只追加新的交易日，由存檔的指標狀態只加入新交易日後取得；
+    # yfinance 的還原股價每次重新下載 (除權息後歷史股價會改變)，一次對整個股價矩陣計算
+    volume_columns = {name: column for name, column in VOLUME_COLUMNS.items() if name in metrics}
+    if volume_columns:
+        if price_source == 'exchange':
+            # indicator_state 引用本模組的 classify_volume_signals，於此處才載入
+            from indicator_state import update_indicator_state
+            vol_df = update_indicator_state(prices).volume_analysis().reindex(symbols)
+        else:
+            vol_df = calculate_volume_analysis_batch(prices).reindex(symbols)
+        for name, column in volume_columns.items():
+            merged[name] = vol_df[column]
+        if '量能訊號' in merged.columns:
+            merged['量能訊號'] = merged['量能訊號'].fillna('-')
+
+    # 技術指標一次對整個股價矩陣計算
+    technical_columns = {name: column for name, column in TECHNICAL_COLUMNS.items() if name in metrics}
+    if technical_columns:
+        tech_df = calculate_technical_indicators(prices).reindex(symbols)
+        for name, column in technical_columns.items():
+            merged[name] = tech_df[column]
+
+    # 只輸出要求的欄位 (計算過程用到的中間欄位不輸出)
+    df = merged.reset_index()[[c for c in OUTPUT_COLUMNS if c == '證券代號' or c in columns]]
+    if with_provenance:
+        return df, provenance
+    return df
 
-        return '合理'
 
-    df['估值狀態'] = df.apply(get_valuation_status, axis=1)
+def calculate_scores(df):
+    """計算三因子評分"""
+    # 確保數值型態
+    for col in SCORE_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
 
-    def get_decision(row):
-        cols_check = ['L1_獲利能力', 'L2_財務安全', 'L3_成長動能']
-        if not all(col in row for col in cols_check):
-            return '-'
+    df_valid = df[(df['淨值比'] > 0) & (df['ROE'] > 0)].copy()
 
-        fund_pass = (row['L1_獲利能力'] == 'Pass') and (row['L2_財務安全'] == 'Pass') and (row['L3_成長動能'] == 'Pass')
-        val = row['估值狀態']
+    if df_valid.empty:
+        return df
 
-        if fund_pass:
-            if val == '便宜':
-                return '★強烈買進'
-            elif val == '合理':
-                return '持有/買進'
-            elif val == '昂貴':
-                return '分批獲利'
-            else:
-                return '觀察'
-        else:
-            if val == '昂貴':
-                return '★賣出 (貴且差)'
-            else:
-                return '基本面未標'
+    # 百分位排名（0-100）
+    df_valid['ROE_Score'] = df_valid['ROE'].rank(pct=True) * 100
+    df_valid['PB_Score'] = (1 / df_valid['淨值比']).rank(pct=True) * 100
+    df_valid['R_Score'] = df_valid['20日報酬率'].rank(pct=True) * 100 if '20日報酬率' in df_valid.columns else 0
 
-    df['決策建議'] = df.apply(get_decision, axis=1)
+    # 三因子等權重評分
+    df_valid['三因子評分'] = df_valid['ROE_Score'] * 0.33 + df_valid['PB_Score'] * 0.33 + df_valid['R_Score'] * 0.34
 
-    return df
+    return df_valid
 
 
-def evaluate_three_good_one_fair(df):
+def apply_screens(df, strict=True, plan=None):
     """
-    三好一公道選股術
-    三好：
-    1. ROE 夠高
-    2. 淨負債低 (或為淨現金)
-    3. EPS 成長為正
-    一公道：
-    4. 本益比合理
+    一次計算所有選股方案 (規則定義於 screening_rules.json)
+    - 財務健康評分: 現金流、負債、流動性、本業、獲利穩定、本益比合理
+    - 四道關卡: 獲利能力 / 財務安全 / 成長動能 / 估值與決策建議
+    - 三好一公道: ROE、淨負債、EPS 成長、本益比
+    - choose_stock.py 選股條件: 價值面 / 本益比低估 / 本業獲利 / 冠軍股
+    - 品質篩選: strict=True 為嚴格模式，否則為寬鬆模式
+    plan: 已編譯的執行計畫 (未指定時依 strict 編譯)
     """
-    df = df.copy()
-
-    target_cols = ['ROE', '淨負債', '淨負債比率', 'EPS成長率', '本益比']
-    for c in target_cols:
-        if c in df.columns:
-            df[c] = pd.to_numeric(df[c], errors='coerce')
-
-    roe_good = df['ROE'] >= 12
-    net_debt_good = (df['淨負債'] <= 0) | (df['淨負債比率'] <= 30)
-    eps_growth_good = df['EPS成長率'] > 0
-    pe_fair = (df['本益比'] > 0) & (df['本益比'] <= 20)
-
-    df['三好_ROE'] = roe_good.map({True: 'Pass', False: 'Fail'})
-    df['三好_淨負債'] = net_debt_good.map({True: 'Pass', False: 'Fail'})
-    df['三好_EPS成長'] = eps_growth_good.map({True: 'Pass', False: 'Fail'})
-    df['一公道_本益比'] = pe_fair.map({True: 'Pass', False: 'Fail'})
-
-    df['三好一公道分數'] = (
-        roe_good.astype(int) +
-        net_debt_good.astype(int) +
-        eps_growth_good.astype(int) +
-        pe_fair.astype(int)
-    ) * 25
-
-    def grade(score):
-        if score >= 100:
-            return '★三好一公道'
-        if score >= 75:
-            return '三好一公道(佳)'
-        if score >= 50:
-            return '觀察'
-        return '待加強'
-
-    df['三好一公道評等'] = df['三好一公道分數'].apply(grade)
+    if plan is None:
+        plan = compile_screens(load_screen_rules(), quality='strict' if strict else 'loose')
+    print(f"選股規則: {len(plan.conditions)} 個條件 (共引用 {plan.reference_count} 次)，{len(plan.criteria)} 個組合條件")
+    return run_screens(df, plan)
+
+
+def sort_for_export(df):
+    """依三好一公道分數、四關卡、財務健康評分、品質篩選、三因子評分綜合排序 (以數值排序，需在格式化前呼叫)"""
+    if '三好一公道分數' in df.columns and '財務健康評分' in df.columns:
+        return df.sort_values(
+            by=['三好一公道分數', '四關卡_基本面', '財務健康評分', '通過品質篩選', '三因子評分'],
+            ascending=[False, True, False, False, False]
+        )
+    if '三好一公道分數' in df.columns:
+        return df.sort_values('三好一公道分數', ascending=False)
+    if '三因子評分' in df.columns:
+        return df.sort_values('三因子評分', ascending=False)
     return df
 
 
-def evaluate_choose_stock_criteria(df):
+def format_and_export(df, columns=EXPORT_COLUMNS, plan=None):
     """
-    choose_stock.py 選股條件評估
-    ───────────────────────────────────────────────────
-    來自 choose_stock.py 中的選股邏輯，分為三大面向：
-
-    【A】價值面 — 評估價值是否被低估（股價不會太貴）
-      A1. 本益比 < 15
-      A2. 現金殖利率 > 5%
-
-    【B】本益比低估
-      B1. 本益比 < 10
-      B2. 本益比 < 近五年最小級距本益比
-
-    【C】本業獲利 — 確認本業利益成長、非靠業外收益
-      C1. 營收成長率 > 0% (營收累計年增率)
-      C2. 毛利率 > 0%
-      C3. 營業利益率 > 0%
-      C4. 稅前淨利率 > 0%
-      C5. 稅後淨利率 > 0%
-      C6. 本業收益比例 (營業利益率 / 稅前淨利率) > 60%
-      C7. ROE > 10
-
-    【D】資本額門檻 (GetChampionStock op=0 的過濾)
-      D1. 資本額 > 15 (億)
-      D2. 毛利率 > 30%
-      D3. 營業利益率 > 30%
-
-    GVI（成長價值指標）公式：
-      GVI = (B/P) × (1 + ROE)^n , n=5
-      其中 B/P = 1 / 淨值比(P/B)
+    只保留要輸出的欄位，以數值綜合排序後再依 EXPORT_FORMATS 格式化
+    columns: 要輸出的欄位 ('收盤' 會換成帶日期的收盤欄位)
+    plan: 計算選股結果時使用的執行計畫 (決定哪些欄位是條件旗標，未指定時為預設的嚴格模式)
     """
-    df = df.copy()
+    if plan is None:
+        plan = compile_screens()
 
-    # 確保數值型態
-    cs_cols = [
-        '本益比', '近五年最低本益比', '殖利率', '營收成長率',
-        '毛利率', '營業利益率', '稅前淨利率', '稅後淨利率',
-        '本業比例', 'ROE', '資本額'
-    ]
-    for c in cs_cols:
-        if c in df.columns:
-            df[c] = pd.to_numeric(df[c], errors='coerce')
-
-    # --- A: 價值面 ---
-    a1 = (df['本益比'] > 0) & (df['本益比'] < 15)
-    # 殖利率在 Stock_Filter 中以小數儲存（0.05 = 5%），轉為百分比比較
-    div_pct = df['殖利率'] * 100 if df['殖利率'].max(skipna=True) < 1 else df['殖利率']
-    a2 = div_pct > 5
-
-    df['CS_A1_本益比<15'] = a1.map({True: 'Pass', False: 'Fail'})
-    df['CS_A2_殖利率>5%'] = a2.map({True: 'Pass', False: 'Fail'})
-
-    # --- B: 本益比低估 ---
-    b1 = (df['本益比'] > 0) & (df['本益比'] < 10)
-    b2 = pd.Series(False, index=df.index)
-    if '近五年最低本益比' in df.columns:
-        b2 = (df['本益比'] > 0) & (df['本益比'] < df['近五年最低本益比'])
-
-    df['CS_B1_本益比<10'] = b1.map({True: 'Pass', False: 'Fail'})
-    df['CS_B2_低於五年最低PE'] = b2.map({True: 'Pass', False: 'Fail'})
-
-    # --- C: 本業獲利 ---
-    c1 = df['營收成長率'] > 0 if '營收成長率' in df.columns else pd.Series(False, index=df.index)
-    c2 = df['毛利率'] > 0
-    c3 = df['營業利益率'] > 0
-    c4 = df['稅前淨利率'] > 0 if '稅前淨利率' in df.columns else pd.Series(False, index=df.index)
-    c5 = df['稅後淨利率'] > 0 if '稅後淨利率' in df.columns else pd.Series(False, index=df.index)
-    c6 = df['本業比例'] > 60 if '本業比例' in df.columns else pd.Series(False, index=df.index)
-    c7 = df['ROE'] > 10
-
-    df['CS_C1_營收成長>0'] = c1.map({True: 'Pass', False: 'Fail'})
-    df['CS_C2_毛利率>0'] = c2.map({True: 'Pass', False: 'Fail'})
-    df['CS_C3_營業利益率>0'] = c3.map({True: 'Pass', False: 'Fail'})
-    df['CS_C4_稅前淨利率>0'] = c4.map({True: 'Pass', False: 'Fail'})
-    df['CS_C5_稅後淨利率>0'] = c5.map({True: 'Pass', False: 'Fail'})
-    df['CS_C6_本業比例>60%'] = c6.map({True: 'Pass', False: 'Fail'})
-    df['CS_C7_ROE>10'] = c7.map({True: 'Pass', False: 'Fail'})
-
-    # --- D: 冠軍股過濾(嚴選) ---
-    d1 = df['資本額'] > 15 if '資本額' in df.columns else pd.Series(False, index=df.index)
-    d2 = df['毛利率'] > 30
-    d3 = df['營業利益率'] > 30
-
-    df['CS_D1_資本額>15億'] = d1.map({True: 'Pass', False: 'Fail'})
-    df['CS_D2_毛利率>30%'] = d2.map({True: 'Pass', False: 'Fail'})
-    df['CS_D3_營業利益率>30%'] = d3.map({True: 'Pass', False: 'Fail'})
-
-    # --- 綜合評分 ---
-    # 價值面得分 (A1 + A2): 最高 2 分
-    value_score = a1.astype(int) + a2.astype(int)
-    # 低估得分 (B1 + B2): 最高 2 分
-    undervalue_score = b1.astype(int) + b2.astype(int)
-    # 本業獲利得分 (C1~C7): 最高 7 分
-    profit_score = (c1.astype(int) + c2.astype(int) + c3.astype(int) +
-                    c4.astype(int) + c5.astype(int) + c6.astype(int) + c7.astype(int))
-    # 冠軍股得分 (D1~D3): 最高 3 分
-    champion_score = d1.astype(int) + d2.astype(int) + d3.astype(int)
-
-    df['CS_價值面得分'] = value_score
-    df['CS_本業獲利得分'] = profit_score
-    df['CS_總得分'] = value_score + undervalue_score + profit_score
-    df['CS_冠軍股得分'] = champion_score
-
-    # 評等
-    total = df['CS_總得分']
-    def cs_grade(s):
-        if s >= 10:
-            return '★極優'
-        if s >= 8:
-            return '優良'
-        if s >= 6:
-            return '中等'
-        if s >= 4:
-            return '普通'
-        return '待加強'
-
-    df['CS選股評等'] = total.apply(cs_grade)
-
-    return df
-
-
-def format_and_export(df):
     # 找出最常見的收盤日期 (Mode)
     date_str = ""
     if '收盤日期' in df.columns and not df['收盤日期'].dropna().empty:
@@ -1100,168 +1171,144 @@ def format_and_export(df):
         except Exception:
             pass
 
-    # 決定收盤欄位名稱
-    close_col_name = f'收盤 ({date_str})' if date_str else '收盤'
+    # 只保留存在的欄位，先排序再格式化
+    df = sort_for_export(df[[c for c in columns if c in df.columns]])
+    df = format_frame(df, EXPORT_FORMATS)
+
+    # 條件旗標在輸出時才轉成 Pass / Fail
+    for c in plan.flag_columns:
+        if c in df.columns:
+            df[c] = np.where(df[c], 'Pass', 'Fail')
 
     # 若有日期，將 '收盤' 欄位重新命名
     if date_str and '收盤' in df.columns:
-        df = df.rename(columns={'收盤': close_col_name})
-
-    cols = [
-        '證券代號', '證券名稱', close_col_name,  '決策建議', 
-        '三好一公道評等', '三好一公道分數','三好_ROE', '三好_淨負債', '三好_EPS成長', '一公道_本益比','四關卡_基本面', 
-        '估值狀態', 'L1_獲利能力', 'L2_財務安全', 'L3_成長動能',
-        # --- choose_stock.py 選股評估 ---
-        'CS選股評等', 'CS_價值面得分', 'CS_本業獲利得分', 'CS_總得分', 'CS_冠軍股得分',
-        'CS_A1_本益比<15', 'CS_A2_殖利率>5%',
-        'CS_B1_本益比<10', 'CS_B2_低於五年最低PE',
-        'CS_C1_營收成長>0', 'CS_C2_毛利率>0', 'CS_C3_營業利益率>0',
-        'CS_C4_稅前淨利率>0', 'CS_C5_稅後淨利率>0',
-        'CS_C6_本業比例>60%', 'CS_C7_ROE>10',
-        'CS_D1_資本額>15億', 'CS_D2_毛利率>30%', 'CS_D3_營業利益率>30%',
-        'GVI指標', '三因子評分', '財務健康評分', '通過品質篩選',
-        '20日報酬率',
-        # --- 成交量分析欄位 ---
-        '5日均量', '20日均量', '量能倍數', '量能訊號',
-        '殖利率', '本益比', '近五年最低本益比', '淨值比', 'ROE', 'EPS成長率',
-        '資本額', '每股淨值',
-        '外資持股(%)', '張數', '毛利率', '營業利益率', '稅後淨利率', '稅前淨利率', '本業比例', '營收成長率', '淨利成長率',
-        '自由現金流', '負債比率', '淨負債', '淨負債比率', '流動比率', '速動比率', '現金流量比',
-        '本益比區間', '產業', '細產業', '排除原因'
-    ]
-
-    # 只保留存在的欄位
-    df = df[[c for c in cols if c in df.columns]].copy()
-
-    # 格式化
-    def fmt_f2(x): return f"{x:.2f}" if isinstance(x, (int, float)) and not pd.isna(x) else "-"
-    def fmt_pct(x): return f"{x:.2f}%" if isinstance(x, (int, float)) and not pd.isna(x) else "-"
-
-    def fmt_cash(x):
-        if pd.isna(x) or not isinstance(x, (int, float)):
-            return "-"
-        # 以億為單位顯示
-        return f"{x/1e8:.1f}億" if abs(x) >= 1e8 else f"{x/1e6:.1f}百萬"
-
-    def fmt_volume(x):
-        """將成交量(股)轉為張數顯示"""
-        if pd.isna(x) or not isinstance(x, (int, float)):
-            return "-"
-        lots = x / 1000  # 1張 = 1000股
-        if lots >= 10000:
-            return f"{lots/10000:.1f}萬張"
-        elif lots >= 1000:
-            return f"{lots/1000:.1f}千張"
-        else:
-            return f"{lots:.0f}張"
-
-    if close_col_name in df.columns:
-        df[close_col_name] = df[close_col_name].apply(lambda x: f"{x:.1f}" if isinstance(x, (int, float)) and not pd.isna(x) else "-")
-
-    df['GVI指標'] = df['GVI指標'].apply(fmt_f2)
-    if '三因子評分' in df.columns:
-        df['三因子評分'] = df['三因子評分'].apply(fmt_f2)
-    if '財務健康評分' in df.columns:
-        df['財務健康評分'] = df['財務健康評分'].apply(fmt_f2)
+        df = df.rename(columns={'收盤': f'收盤 ({date_str})'})
 
-    # 格式化 choose_stock 相關得分欄位
-    for sc in ['CS_價值面得分', 'CS_本業獲利得分', 'CS_總得分', 'CS_冠軍股得分']:
-        if sc in df.columns:
-            df[sc] = df[sc].apply(lambda x: f"{int(x)}" if isinstance(x, (int, float)) and not pd.isna(x) else "-")
+    return df
 
-    # 格式化資本額(億)
-    if '資本額' in df.columns:
-        df['資本額'] = df['資本額'].apply(lambda x: f"{x:.1f}億" if isinstance(x, (int, float)) and not pd.isna(x) else "-")
-    if '每股淨值' in df.columns:
-        df['每股淨值'] = df['每股淨值'].apply(fmt_f2)
 
-    if '三好一公道分數' in df.columns:
-        df['三好一公道分數'] = df['三好一公道分數'].apply(lambda x: f"{int(x)}" if isinstance(x, (int, float)) and not pd.isna(x) else "-")
-    df['淨值比'] = df['淨值比'].apply(fmt_f2)
-    df['本益比'] = df['本益比'].apply(fmt_f2)
-    df['近五年最低本益比'] = df['近五年最低本益比'].apply(fmt_f2)
-
-    # 格式化量能倍數
-    if '量能倍數' in df.columns:
-        df['量能倍數'] = df['量能倍數'].apply(lambda x: f"{x:.2f}x" if isinstance(x, (int, float)) and not pd.isna(x) else "-")
-
-    # 格式化均量
-    if '5日均量' in df.columns:
-        df['5日均量'] = df['5日均量'].apply(fmt_volume)
-    if '20日均量' in df.columns:
-        df['20日均量'] = df['20日均量'].apply(fmt_volume)
-
-    pct_cols = ['20日報酬率', '殖利率', 'ROE', 'EPS成長率', '外資持股(%)', '毛利率', '營業利益率', '稅後淨利率', '稅前淨利率', '本業比例', '營收成長率', '淨利成長率', '負債比率', '淨負債比率', '流動比率', '速動比率', '現金流量比']
-    for c in pct_cols:
-        if c in df.columns:
-            df[c] = df[c].apply(fmt_pct)
+def build_outputs(final_df, outputs=OUTPUT_FILES):
+    """由同一份格式化結果產生各輸出檔的內容，回傳 {輸出名稱: DataFrame}"""
+    results = {}
+    if 'gvi' in outputs:
+        results['gvi'] = final_df
 
-    if '自由現金流' in df.columns:
-        df['自由現金流'] = df['自由現金流'].apply(fmt_cash)
-    if '淨負債' in df.columns:
-        df['淨負債'] = df['淨負債'].apply(fmt_cash)
+    if 'quality' in outputs:
+        quality_df = final_df
+        if '通過品質篩選' in final_df.columns:
+            quality_df = final_df[final_df['通過品質篩選'].astype(bool)]
+        close_col = next((c for c in final_df.columns if c.startswith('收盤')), '收盤')
+        cols = [close_col if c == '收盤' else c for c in QUALITY_COLUMNS]
+        results['quality'] = quality_df[[c for c in cols if c in quality_df.columns]]
 
-    df['張數'] = df['張數'].apply(lambda x: f"{int(x):,}" if isinstance(x, (int, float)) and not pd.isna(x) else "-")
+    return results
 
-    return df
 
+def prefilter_stocks(stock_list, ref_df, plan):
+    """
+    預先篩選: 先以參考資料判斷品質篩選中用得到的排除條件 (如本益比、ROE)，
+    確定會被排除的股票不再下載股價、逐檔抓取 info 與財報
+    只使用第一順位來源為參考資料的欄位，這些欄位有值時就是最終合併結果；缺值的股票一律保留
+    """
+    symbols = pd.Index(stock_list, name='證券代號')
+    ref = build_reference_table(ref_df, symbols)
+    cheap = pd.DataFrame({
+        name: ref[spec[0][1]]
+        for name, spec in {**METRIC_SOURCES, **CALC_SOURCES}.items()
+        if spec[0][0] == 'ref' and spec[0][1] in ref.columns
+    }, index=symbols)
+
+    excluded, used = run_prefilter(cheap, plan, set(cheap.columns))
+    survivors = [symbol for symbol, drop in zip(stock_list, excluded) if not drop]
+    print(f"預先篩選 ({', '.join(used) or '無可提前判斷的條件'}): {len(stock_list)} 檔 -> {len(survivors)} 檔")
+    return survivors
+
+
+def run_pipeline(outputs=tuple(OUTPUT_FILES), filename="stock_list.txt", strict=True, prefilter=False,
+                 universe="list", price_source=None):
+    """
+    抓取一次資料並產生所有指定的輸出檔 (public 資料夾)
+    outputs: OUTPUT_FILES 中的名稱 (gvi: 完整清單, quality: 通過品質篩選的股票)
+    prefilter: 先以參考資料排除確定無法通過品質篩選的股票，只對剩下的股票抓取資料
+               (輸出只含剩下的股票，三因子評分的百分位排名也只在這些股票間計算)
+    universe: list 為 filename 中的自選清單，market 為全部上市、上櫃四碼普通股 (見 stock_universe.py)；
+              market 不做逐檔請求，只使用全市場整批來源 (見 fetch_stock_data 的 per_symbol)
+    price_source: 股價來源 (見 fetch_stock_data)，未指定時 list 為 yfinance、market 為 exchange
+    """
+    unknown = [name for name in outputs if name not in OUTPUT_FILES]
+    if unknown:
+        print(f"未知的輸出: {', '.join(unknown)} (可用: {', '.join(OUTPUT_FILES)})")
+        return {}
 
-if __name__ == "__main__":
-    my_stocks = get_stock_list()
+    if universe == 'market':
+        my_stocks = get_universe_symbols()
+    else:
+        my_stocks = get_stock_list(filename)
 
     # 讀取參考資料
     ref_df = load_reference_data()
 
-    raw_df = fetch_stock_data(my_stocks, ref_df)
-
-    if not raw_df.empty:
-        # 1. 計算三因子評分
-        scored_df = calculate_scores(raw_df)
-
-        # 2. 計算財務健康評分
-        scored_df = calculate_financial_health_score(scored_df)
-
-        # 3. 四道關卡選股分析
-        scored_df = evaluate_four_levels(scored_df)
-
-        # 4. 三好一公道分析
-        scored_df = evaluate_three_good_one_fair(scored_df)
+    # 只抓取輸出檔、評分與選股規則用得到的欄位
+    columns = EXPORT_COLUMNS if 'gvi' in outputs else QUALITY_COLUMNS
+    plan = compile_screens(quality='strict' if strict else 'loose')
+    if prefilter:
+        my_stocks = prefilter_stocks(my_stocks, ref_df, plan)
+        if not my_stocks:
+            print("預先篩選後無候選股票")
+            return {}
+    required = ['收盤日期', *SCORE_COLUMNS, *plan.input_columns, *columns]
+
+    if price_source is None:
+        price_source = 'exchange' if universe == 'market' else 'yfinance'
+    raw_df = fetch_stock_data(my_stocks, ref_df, columns=required, price_source=price_source,
+                              per_symbol=universe != 'market')
+    if raw_df.empty:
+        print("查無資料")
+        return {}
 
-        # 4.5 choose_stock.py 選股條件評估
-        scored_df = evaluate_choose_stock_criteria(scored_df)
+    # 1. 計算三因子評分
+    scored_df = calculate_scores(raw_df)
 
-        # 5. 品質篩選 (可選擇 strict=True 為嚴格模式)
-        scored_df = filter_quality_stocks(scored_df, strict=True)
+    # 2. 財務健康評分、四道關卡、三好一公道、choose_stock 條件、品質篩選 (strict=True 為嚴格模式)
+    scored_df = apply_screens(scored_df, plan=plan)
 
-        # 6. 格式化輸出
-        final_df = format_and_export(scored_df)
+    # 3. 綜合排序並格式化 (只處理要輸出的欄位)
+    final_df = format_and_export(scored_df, columns, plan=plan)
 
-        # 依財務健康評分 + 三因子評分排序
-        if '三好一公道分數' in final_df.columns and '財務健康評分' in final_df.columns:
-            final_df = final_df.sort_values(
-                by=['三好一公道分數', '四關卡_基本面', '財務健康評分', '通過品質篩選', '三因子評分'],
-                ascending=[False, True, False, False, False]
-            )
-        elif '三好一公道分數' in final_df.columns:
-            final_df = final_df.sort_values('三好一公道分數', ascending=False)
-        elif '三因子評分' in final_df.columns:
-            final_df = final_df.sort_values('三因子評分', ascending=False)
+    # 顯示綜合排序前 20 檔
+    print("=== 三好一公道綜合排序 (前20檔) ===")
+    print(final_df.head(20).to_string(index=False))
 
-        # 顯示綜合排序前 20 檔
-        print("=== 三好一公道綜合排序 (前20檔) ===")
-        print(final_df.head(20).to_string(index=False))
+    # 設定輸出路徑到 public 資料夾
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    public_dir = os.path.join(os.path.dirname(current_dir), 'public')
+    os.makedirs(public_dir, exist_ok=True)
 
-        # 設定輸出路徑到 public 資料夾
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        public_dir = os.path.join(os.path.dirname(current_dir), 'public')
+    results = build_outputs(final_df, outputs)
+    for name, df in results.items():
+        output_path = os.path.join(public_dir, OUTPUT_FILES[name])
+        df.to_csv(output_path, index=False, encoding='utf-8-sig')
+        print(f"已輸出 {len(df)} 檔至 {output_path}")
+    return results
 
-        # 確保 public 資料夾存在
-        if not os.path.exists(public_dir):
-            os.makedirs(public_dir)
 
-        # 輸出完整清單
-        output_path = os.path.join(public_dir, 'Stock_GVI_ThreeFactor.csv')
-        final_df.to_csv(output_path, index=False, encoding='utf-8-sig')
-        print(f"\n已輸出完整清單至 {output_path}")
-    else:
-        print("查無資料")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="GVI 三因子 / 品質篩選選股")
+    parser.add_argument(
+        "--outputs", nargs="+", choices=list(OUTPUT_FILES), default=list(OUTPUT_FILES),
+        help="要產生的輸出檔 (預設全部)"
+    )
+    parser.add_argument("--loose", action="store_true", help="品質篩選改用寬鬆模式")
+    parser.add_argument("--prefilter", action="store_true", help="先以參考資料排除無法通過品質篩選的股票，只抓取剩下的股票")
+    parser.add_argument(
+        "--universe", choices=["list", "market"], default="list",
+        help="list: stock_list.txt 自選清單 (預設)，market: 全部上市、上櫃四碼普通股"
+    )
+    parser.add_argument(
+        "--prices", choices=["yfinance", "exchange"], default=None,
+        help="yfinance: 逐批下載還原股價 (--universe list 預設)，exchange: 交易所每日整批行情 (未還原除權息，--universe market 預設)"
+    )
+    args = parser.parse_args()
+
+    run_pipeline(outputs=args.outputs, strict=not args.loose, prefilter=args.prefilter,
+                 universe=args.universe, price_source=args.prices)
@@ -0,0 +1,205 @@
+"""
+批次計算效能測試
+以隨機產生的股價矩陣比較逐檔計算與整個矩陣一次計算的耗時
+
+執行: python benchmark.py
+端到端 (含網路抓取): python benchmark.py --end-to-end [--universe market] [--prices exchange]
+"""
+
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from price_store import make_random_store
+
+BENCHMARK_SIZES = [100, 1000, 10000]
+BENCHMARK_DAYS = 750     # 約 3 年交易日
+UNIVERSE_SIZES = [110, 500, 1000, 2000]     # 自選清單約 110 檔，全市場約 1,900 檔
+
+
+def timeit(func, *args, repeat=3):
+    """回傳最佳耗時 (秒)"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def print_row(size, loop_seconds, batch_seconds):
+    loop_text = f"{loop_seconds * 1000:10.1f} ms" if loop_seconds is not None else "         - "
+    speedup = f"{loop_seconds / batch_seconds:8.1f}x" if loop_seconds is not None else "       -"
+    print(f"{size:>8} 檔 | 逐檔 {loop_text} | 批次 {batch_seconds * 1000:10.1f} ms | {speedup}")
+
+
+def benchmark_volume_analysis(sizes=BENCHMARK_SIZES, loop_limit=1000):
+    """成交量 / 箱型突破分析: calculate_volume_analysis vs calculate_volume_analysis_batch"""
+    from Stock_Filter import calculate_volume_analysis, calculate_volume_analysis_batch
+
+    print("=== 成交量分析 ===")
+    for size in sizes:
+        store = make_random_store(size, BENCHMARK_DAYS)
+
+        def run_loop():
+            return [calculate_volume_analysis(store, symbol) for symbol in store.symbols]
+
+        # 逐檔計算太慢時只測 loop_limit 以內的規模
+        loop_seconds = timeit(run_loop, repeat=1) if size <= loop_limit else None
+        batch_seconds = timeit(calculate_volume_analysis_batch, store)
+        print_row(size, loop_seconds, batch_seconds)
+
+
+def benchmark_kd(sizes=BENCHMARK_SIZES, loop_limit=1000):
+    """KD 值: 逐檔逐日迴圈 (calculate_kd_loop) vs 線性濾波矩陣計算 (calculate_kd)"""
+    from Step10_KD import calculate_kd, calculate_kd_loop
+
+    print("=== KD 值 ===")
+    for size in sizes:
+        store = make_random_store(size, BENCHMARK_DAYS)
+        loop_seconds = timeit(calculate_kd_loop, store, repeat=1) if size <= loop_limit else None
+        batch_seconds = timeit(calculate_kd, store)
+        print_row(size, loop_seconds, batch_seconds)
+
+
+def benchmark_export_format(sizes=BENCHMARK_SIZES, seed=0):
+    """輸出格式化: 逐格 apply vs export_format 整欄格式化"""
+    from export_format import format_column
+
+    print("=== 輸出格式化 (百分比欄位) ===")
+    rng = np.random.default_rng(seed)
+    for size in sizes:
+        values = pd.Series(rng.normal(0, 50, size))
+        values[rng.random(size) < 0.1] = np.nan
+
+        def run_loop():
+            return values.apply(lambda x: f"{x:.2f}%" if isinstance(x, (int, float)) and not pd.isna(x) else "-")
+
+        loop_seconds = timeit(run_loop)
+        batch_seconds = timeit(format_column, values, "%.2f%%")
+        print_row(size, loop_seconds, batch_seconds)
+
+
+def make_random_metrics(symbols, seed=0):
+    """產生隨機的合併後指標表 (欄位與 fetch_stock_data 輸出相同，約 10% 缺值)"""
+    from Stock_Filter import OUTPUT_COLUMNS
+
+    rng = np.random.default_rng(seed)
+    size = len(symbols)
+    df = pd.DataFrame({
+        column: rng.normal(20, 30, size) for column in OUTPUT_COLUMNS if column != '證券代號'
+    })
+    df = df.mask(rng.random(df.shape) < 0.1)
+    df['殖利率'] = rng.random(size) * 0.08
+    df['收盤日期'] = pd.Timestamp.today().strftime('%Y-%m-%d')
+    df['證券名稱'] = symbols
+    df['本益比區間'] = '10.0~20.0'
+    df['量能訊號'] = '-'
+    df.insert(0, '證券代號', symbols)
+    return df
+
+
+def measure(func, *args):
+    """回傳 (耗時秒數, 記憶體峰值 MB)，記憶體以 tracemalloc 另外執行一次量測"""
+    seconds = timeit(func, *args, repeat=1)
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak / 1e6
+
+
+def benchmark_universe_scaling(sizes=UNIVERSE_SIZES, seed=0):
+    """
+    全市場規模: 抓取完成後的本機計算 (股價矩陣批次計算、評分、選股規則、格式化) 耗時與記憶體隨檔數的變化
+    網路抓取的耗時取決於連線與同時請求數 (DOWNLOAD_MAX_WORKERS / FETCH_MAX_WORKERS)，不在此量測
+    """
+    from Stock_Filter import (calculate_volume_analysis_batch, calculate_min_pe_5y_batch, calculate_scores,
+                              format_and_export)
+    from screening_rules import compile_screens, run_screens
+
+    print("=== 全市場規模 (本機計算) ===")
+    plan = compile_screens()
+    rng = np.random.default_rng(seed)
+    for size in sizes:
+        store = make_random_store(size, BENCHMARK_DAYS, seed=seed)
+        years = np.unique(store.years)
+        eps_df = pd.DataFrame({
+            '證券代號': np.repeat(store.symbols, len(years)),
+            '年度': np.tile(years, size),
+            'EPS': rng.normal(3, 2, size * len(years)),
+        })
+        metrics = make_random_metrics(store.symbols, seed=seed)
+
+        def run_prices():
+            calculate_volume_analysis_batch(store)
+            calculate_min_pe_5y_batch(store, eps_df)
+
+        def run_scoring():
+            scored = run_screens(calculate_scores(metrics.copy()), plan)
+            format_and_export(scored, plan=plan)
+
+        matrix_mb = sum(a.nbytes for a in (store.close, store.high, store.low, store.volume)) / 1e6
+        price_seconds, price_peak = measure(run_prices)
+        score_seconds, score_peak = measure(run_scoring)
+        print(f"{size:>8} 檔 | 股價矩陣 {matrix_mb:7.1f} MB | 股價計算 {price_seconds * 1000:8.1f} ms (峰值 {price_peak:7.1f} MB)"
+              f" | 評分輸出 {score_seconds * 1000:8.1f} ms (峰值 {score_peak:6.1f} MB)")
+
+
+def timed(label, func, *args, **kwargs):
+    """執行 func 並印出耗時，回傳 (結果, 秒數)"""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    print(f"[{label}] {seconds:8.1f} 秒")
+    return result, seconds
+
+
+def benchmark_end_to_end(universe="list", price_source=None, strict=True):
+    """
+    端到端執行 (含網路抓取): 與 run_pipeline 相同的步驟，逐一量測耗時 (不寫出輸出檔)
+    全市場的每日行情與財報歷史第一次需要回補 (見 market_prices.py、statement_history.py)，應以之後的執行為準
+    """
+    from Stock_Filter import (EXPORT_COLUMNS, SCORE_COLUMNS, apply_screens, calculate_scores, fetch_stock_data,
+                              format_and_export, get_stock_list, load_reference_data)
+    from screening_rules import compile_screens
+    from stock_universe import get_universe_symbols
+
+    if price_source is None:
+        price_source = 'exchange' if universe == 'market' else 'yfinance'
+    print(f"=== 端到端 (universe={universe}, prices={price_source}) ===")
+    stages = {}
+    symbols, stages['股票清單'] = timed("股票清單", get_universe_symbols if universe == 'market' else get_stock_list)
+    ref_df, stages['參考資料'] = timed("參考資料", load_reference_data)
+    plan = compile_screens(quality='strict' if strict else 'loose')
+    required = ['收盤日期', *SCORE_COLUMNS, *plan.input_columns, *EXPORT_COLUMNS]
+
+    raw_df, stages['抓取與合併'] = timed(
+        "抓取與合併", fetch_stock_data, symbols, ref_df, columns=required, price_source=price_source,
+        per_symbol=universe != 'market',
+    )
+    scored, stages['評分'] = timed("評分", calculate_scores, raw_df)
+    scored, stages['選股規則'] = timed("選股規則", apply_screens, scored, plan=plan)
+    _, stages['格式化'] = timed("格式化", format_and_export, scored, EXPORT_COLUMNS, plan=plan)
+    total = sum(stages.values())
+    print(f"{len(symbols)} 檔，合計 {total:.1f} 秒 (抓取與合併佔 {stages['抓取與合併'] / total:.0%})")
+    return stages
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="批次計算效能測試")
+    parser.add_argument("--end-to-end", action="store_true", help="量測含網路抓取的完整選股流程 (需連網)")
+    parser.add_argument("--universe", choices=["list", "market"], default="list", help="端到端量測的股票範圍")
+    parser.add_argument("--prices", choices=["yfinance", "exchange"], default=None, help="端到端量測的股價來源")
+    args = parser.parse_args()
+
+    if args.end_to_end:
+        benchmark_end_to_end(args.universe, args.prices)
+    else:
+        benchmark_volume_analysis()
+        benchmark_kd()
+        benchmark_export_format()
+        benchmark_universe_scaling()
@@ -0,0 +1,151 @@
+"""
+每日籌碼歷史資料
+由證交所全市場整批報表逐日抓取外資持股比率 (MI_QFIIS) 與融資融券餘額 (MI_MARGN)，
+每個交易日存成一個檔案 (含所有上市股票)，供 step4_k_chart.get_transactions 計算籌碼均線
+
+- 回補: 缺少的日期同時抓取 (證交所請求間隔至少 CHIP_REQUEST_INTERVAL 秒)，每日抓完即存檔，
+  中斷後重新執行只抓尚未完成的日期；遇到證交所封鎖頁面時立即停止
+- 過去的日期存檔後不再重新抓取 (假日存成空檔)；當天的資料在收盤公布前可能還沒有，不存檔
+"""
+
+import argparse
+import os
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+import utils
+
+TWSE_FOREIGN_HOLDING_URL = "https://www.twse.com.tw/rwd/zh/fund/MI_QFIIS?selectType=ALLBUT0999&response=json&date={date}"
+TWSE_MARGIN_URL = "https://www.twse.com.tw/rwd/zh/marginTrading/MI_MARGN?selectType=ALL&response=json&date={date}"
+
+CHIP_HISTORY_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Data", "ChipHistory")
+CHIP_HISTORY_DAYS = 90        # 預設回補的營業日數 (扣除假日後約 60 個交易日，足夠計算 60 日均線)
+CHIP_MAX_WORKERS = 2          # 同時抓取的日期數
+CHIP_REQUEST_INTERVAL = 3     # 證交所請求的最小間隔 (秒)，所有執行緒共用 (請求過快會被暫時封鎖)
+CHIP_REQUEST_JITTER = 2       # 另加的隨機延遲 (秒)
+CHIP_COLUMNS = ["證券代號", "外資持股(%)", "券資比(%)"]
+
+# MI_MARGN 個股表格中融資、融券的今日餘額欄位 (兩者欄名相同，以 groups 的標題或出現順序區分)
+BALANCE_FIELD = "今日餘額"
+
+
+def to_number(series):
+    return pd.to_numeric(series.astype(str).str.replace(",", "", regex=False), errors="coerce")
+
+
+def parse_foreign_holding(json_data):
+    """MI_QFIIS 回應轉成 (證券代號, 外資持股(%))"""
+    if json_data.get("stat") != "OK" or not json_data.get("data"):
+        return pd.DataFrame(columns=CHIP_COLUMNS[:2])
+    df = pd.DataFrame(json_data["data"], columns=json_data["fields"])
+    ratio = next(field for field in json_data["fields"] if "持股比率" in field and "全體" in field)
+    return pd.DataFrame({
+        "證券代號": df["證券代號"].astype(str).str.strip(),
+        "外資持股(%)": to_number(df[ratio]),
+    })
+
+
+def balance_positions(table):
+    """
+    融資、融券今日餘額的欄位位置: 表格有 groups (融資、融券各自的欄位範圍) 時取範圍內的今日餘額，
+    否則依出現順序 (先融資後融券)；找不到時為 None
+    """
+    fields = [str(field).strip() for field in table["fields"]]
+    positions = [i for i, field in enumerate(fields) if field == BALANCE_FIELD]
+    spans = {
+        str(group.get("title", "")).strip(): range(group["start"], group["start"] + group["span"])
+        for group in table.get("groups") or [] if "start" in group and "span" in group
+    }
+
+    def find(title, order):
+        span = next((span for name, span in spans.items() if title in name), None)
+        if span is not None:
+            return next((i for i in positions if i in span), None)
+        return positions[order] if len(positions) > order else None
+
+    return find("融資", 0), find("融券", 1)
+
+
+def parse_margin(json_data):
+    """MI_MARGN 回應中的個股表格轉成 (證券代號, 券資比(%))，融資餘額為 0 時為 NaN"""
+    tables = json_data.get("tables") or []
+    table = next((t for t in tables if t.get("fields") and str(t["fields"][0]).strip() == "代號" and t.get("data")), None)
+    if json_data.get("stat") != "OK" or table is None:
+        return pd.DataFrame(columns=["證券代號", CHIP_COLUMNS[2]])
+    margin_position, short_position = balance_positions(table)
+    if margin_position is None or short_position is None:
+        print(f"MI_MARGN 個股表格找不到融資、融券{BALANCE_FIELD}欄位: {table['fields']}")
+        return pd.DataFrame(columns=["證券代號", CHIP_COLUMNS[2]])
+    df = pd.DataFrame(table["data"])
+    margin = to_number(df[margin_position])
+    short = to_number(df[short_position])
+    return pd.DataFrame({
+        "證券代號": df[0].astype(str).str.strip(),
+        "券資比(%)": (short / margin.where(margin > 0) * 100).round(2),
+    })
+
+
+def fetch_chip_day(day, limiter=None):
+    """
+    抓取單日全市場籌碼資料，該日沒有資料 (假日或尚未公布) 時回傳空的 DataFrame
+    limiter: 限制請求頻率 (utils.RateLimiter)，證交所回傳封鎖頁面時拋出 utils.BlockedError
+    """
+    key = day.strftime("%Y%m%d")
+    foreign = parse_foreign_holding(utils.fetch_json(TWSE_FOREIGN_HOLDING_URL.format(date=key), limiter))
+    margin = parse_margin(utils.fetch_json(TWSE_MARGIN_URL.format(date=key), limiter))
+    if foreign.empty and margin.empty:
+        return pd.DataFrame(columns=CHIP_COLUMNS)
+    return foreign.merge(margin, on="證券代號", how="outer")[CHIP_COLUMNS]
+
+
+def day_path(day, history_dir=CHIP_HISTORY_DIR):
+    return os.path.join(history_dir, f"{day:%Y%m%d}.pkl")
+
+
+def update_chip_history(days=CHIP_HISTORY_DAYS, max_workers=CHIP_MAX_WORKERS, history_dir=CHIP_HISTORY_DIR):
+    """回補最近 days 個營業日的籌碼資料，回傳 (成功存檔的日期, 失敗的日期)"""
+    today = pd.Timestamp(date.today())
+    tasks = [day for day in utils.recent_business_days(days) if not os.path.exists(day_path(day, history_dir))]
+    print(f"籌碼歷史: 最近 {days} 個營業日，需抓取 {len(tasks)} 日")
+
+    limiter = utils.RateLimiter(CHIP_REQUEST_INTERVAL, CHIP_REQUEST_JITTER)
+
+    def fetch(day):
+        df = fetch_chip_day(day, limiter)
+        # 當天尚未公布的資料不存檔，下次重新抓取
+        return None if df.empty and day >= today else df
+
+    return utils.backfill(
+        tasks, fetch, lambda day: day_path(day, history_dir),
+        max_workers=max_workers, describe=lambda day: f"{day:%Y-%m-%d} 籌碼資料", report_every=10,
+    )
+
+
+def load_chip_panel(column, days=CHIP_HISTORY_DAYS, history_dir=CHIP_HISTORY_DIR):
+    """讀取已存檔的日期，回傳 (日期 × 證券代號) 的寬表 (日期由舊到新，略過假日與沒有存檔的日期)"""
+    series = {}
+    for day in utils.recent_business_days(days):
+        path = day_path(day, history_dir)
+        if os.path.exists(path):
+            df = pd.read_pickle(path)
+            if not df.empty:
+                series[day] = df.drop_duplicates("證券代號").set_index("證券代號")[column]
+    if not series:
+        return pd.DataFrame()
+    return pd.DataFrame(series).T.astype(np.float64)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="每日籌碼歷史資料回補")
+    parser.add_argument("--days", type=int, default=CHIP_HISTORY_DAYS, help="回補的營業日數")
+    parser.add_argument("--workers", type=int, default=CHIP_MAX_WORKERS, help="同時抓取的日期數")
+    args = parser.parse_args()
+
+    utils.init()
+    update_chip_history(args.days, max_workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
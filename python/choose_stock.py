@@ -4,8 +4,8 @@ import time
 import random
 from step1_basic_stock_info import get_basic_stock_info
 from step2_fin_detail import get_fin_detail
-from step3_pe_ratio_chart import get_pe
-from step4_k_chart import get_transaction
+from step3_pe_ratio_chart import get_pe, get_pe_bands
+from step4_k_chart import get_transaction, get_transactions, transaction_column
 import step5_shareholder_distribution as shareholderDistribution
 from step6_stock_dividend_policy import get_dividend
 from step7_volume_data import get_volume
@@ -48,23 +48,43 @@ stocks = [
 ]
 
 
+# op 0 過濾清單條件 (資本額 / 本益比在基礎資料即可判斷，毛利率 / 營業利益率在營益分析合併後判斷)
+CHAMPION_SCREENS = {
+    '資本額': lambda s: s > 15,
+    '本益比': lambda s: s < 15,
+    '毛利率': lambda s: s > 30,
+    '營業利益率': lambda s: s > 30,
+}
+
+
 def Sleep():
     time.sleep(random.randint(10, 20))
 
 
+def select_local_row(local_df, stockId, required_column, fallback):
+    """從本地整批計算的結果取出單一股票 (去除證券代號欄)，required_column 沒有資料時改用 fallback 抓 goodinfo"""
+    row = local_df[local_df["證券代號"] == stockId]
+    if row.empty or row[required_column].isna().all() or (row[required_column] == "").all():
+        Sleep()
+        return fallback(stockId)
+    return row.drop(columns="證券代號").reset_index(drop=True)
+
+
+def select_pe_bands(pe_bands_df, stockId):
+    """本益比級距 (欄位與 get_pe 相同)"""
+    return select_local_row(pe_bands_df, stockId, "本益比-級距1倍數", get_pe)
+
+
+def select_transaction(transactions_df, stockId):
+    """均線與籌碼指標 (欄位與 get_transaction 相同)"""
+    return select_local_row(transactions_df, stockId, transaction_column("收盤"), get_transaction)
+
+
 def GetChampionStock(op):
     # 過濾清單
     if op == 0:
-        df = get_basic_stock_info(True)
-        print(df)
-
-        df.update(df.apply(lambda x: pd.to_numeric(x, errors='coerce')))
-
-        cond1 = df['毛利率'] > 30
-        cond2 = df['營業利益率'] > 30
-        cond3 = df['本益比'] < 15
-        cond3 = df['資本額'] > 15
-        df = df[cond1 & cond2 & cond3]
+        # 篩選條件交給 get_basic_stock_info 在資料到齊時立即套用，不符合的股票不再合併後面的資料來源
+        df = get_basic_stock_info(True, screens=CHAMPION_SCREENS)
         print(df)
 
         df.to_csv(f"{utils.GetRootPath()}\\Data\\Temp\\過濾清單.csv", encoding="utf_8_sig")
@@ -72,6 +92,8 @@ def GetChampionStock(op):
     # 明細資料
     if op == 2:
         basicStockInfo_df = get_basic_stock_info()
+        PE_bands_df = get_pe_bands()
+        transactions_df = get_transactions(stocks)
         # sum_df = pd.DataFrame()
 
         for stockId in stocks:
@@ -86,11 +108,10 @@ def GetChampionStock(op):
                 finDetail_df = get_fin_detail(stockId)
                 print(finDetail_df)
 
-                PE_df = get_pe(stockId)
+                PE_df = select_pe_bands(PE_bands_df, stockId)
                 print(PE_df)
 
-                Sleep()
-                transaction_df = get_transaction(stockId)
+                transaction_df = select_transaction(transactions_df, stockId)
                 print(transaction_df)
 
                 volume_df = get_volume(stockId)
@@ -181,6 +202,7 @@ def GetChampionStock(op):
     # 日常籌碼面資料
     if op == 3:
         basicStockInfo_df = get_basic_stock_info()
+        transactions_df = get_transactions(stocks)
         # sum_df = pd.DataFrame()
         for stockId in stocks:
             print(stockId)
@@ -190,8 +212,7 @@ def GetChampionStock(op):
             print(stockInfo_df)
 
             if not stockInfo_df.empty:
-                Sleep()
-                transaction_df = get_transaction(stockId)
+                transaction_df = select_transaction(transactions_df, stockId)
                 print(transaction_df)
 
                 volume_df = get_volume(stockId)
@@ -210,6 +231,7 @@ def GetChampionStock(op):
     # 大戶、本益比
     if op == 4:
         shareholderDistribution.WriteData()
+        PE_bands_df = get_pe_bands()
 
         for stockId in stocks:
             print(stockId)
@@ -218,8 +240,7 @@ def GetChampionStock(op):
             distribution_df = shareholderDistribution.GetDistribution(stockId)
             print(distribution_df)
 
-            Sleep()
-            PE_df = get_pe(stockId)
+            PE_df = select_pe_bands(PE_bands_df, stockId)
             print(PE_df)
 
             temp_df = pd.concat([PE_df, distribution_df], axis=1)
@@ -232,7 +253,8 @@ def GetChampionStock(op):
 
     if op == 7:
         basicStockInfo_df = get_basic_stock_info()
-        topVolumeStocks = daily_top_volume.get_top_volume()[:100]
+        # 以本地股價矩陣計算成交張數創近期新高排行 (不再爬 goodinfo)，取前 100 檔下載分點資料
+        topVolumeStocks = daily_top_volume.get_volume_new_high_ranking()['代號'].values[:100]
 
         for stockId in topVolumeStocks:
             print(stockId)
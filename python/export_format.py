@@ -0,0 +1,102 @@
+"""
+輸出格式化
+依欄位格式設定一次格式化整欄數值 (缺值或非數值顯示為 "-")
+
+格式設定可為 printf 格式字串 (如 "%.2f"、"%.2f%%") 或下列具名格式:
+  cash:      金額，以億 / 百萬為單位 (如 12.3億、45.6百萬)
+  volume:    成交量 (股) 轉為張數 (如 1.2萬張、3.4千張、560張)
+  thousands: 整數加千分位 (如 12,345)
+"""
+
+import numpy as np
+import pandas as pd
+
+MISSING_TEXT = "-"
+
+
+def to_float_array(series):
+    """轉成 float64 陣列，無法轉換者為 NaN"""
+    if not pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(series):
+        series = pd.to_numeric(series, errors="coerce")
+    return series.to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+def _apply_pattern(pattern, values):
+    """對一整段 float 陣列套用 printf 格式 (先轉成 Python list，避免逐格經過 pandas)"""
+    return list(map(pattern.__mod__, values.tolist()))
+
+
+def format_number(values, pattern, valid=None):
+    """以 printf 格式字串格式化整個陣列"""
+    result = np.full(values.shape, MISSING_TEXT, dtype=object)
+    if valid is None:
+        valid = ~np.isnan(values)
+    if valid.any():
+        result[valid] = _apply_pattern(pattern, values[valid])
+    return result
+
+
+def format_cash(values):
+    """金額: 絕對值 >= 1 億以億顯示，否則以百萬顯示"""
+    result = np.full(values.shape, MISSING_TEXT, dtype=object)
+    valid = ~np.isnan(values)
+    large = valid & (np.abs(values) >= 1e8)
+    small = valid & ~large
+    if large.any():
+        result[large] = _apply_pattern("%.1f億", values[large] / 1e8)
+    if small.any():
+        result[small] = _apply_pattern("%.1f百萬", values[small] / 1e6)
+    return result
+
+
+def format_volume(values):
+    """將成交量(股)轉為張數顯示 (1張 = 1000股)"""
+    result = np.full(values.shape, MISSING_TEXT, dtype=object)
+    lots = values / 1000
+    valid = ~np.isnan(lots)
+    ten_thousands = valid & (lots >= 10000)
+    thousands = valid & (lots >= 1000) & ~ten_thousands
+    units = valid & ~ten_thousands & ~thousands
+    if ten_thousands.any():
+        result[ten_thousands] = _apply_pattern("%.1f萬張", lots[ten_thousands] / 10000)
+    if thousands.any():
+        result[thousands] = _apply_pattern("%.1f千張", lots[thousands] / 1000)
+    if units.any():
+        result[units] = _apply_pattern("%.0f張", lots[units])
+    return result
+
+
+def format_thousands(values):
+    """整數 (捨去小數) 加千分位"""
+    result = np.full(values.shape, MISSING_TEXT, dtype=object)
+    valid = np.isfinite(values)
+    if valid.any():
+        result[valid] = list(map("{:,}".format, np.trunc(values[valid]).astype(np.int64).tolist()))
+    return result
+
+
+NAMED_FORMATS = {
+    "cash": format_cash,
+    "volume": format_volume,
+    "thousands": format_thousands,
+}
+
+
+def format_column(series, fmt):
+    """依格式設定格式化單一欄位，回傳 object 陣列"""
+    values = to_float_array(series)
+    if fmt in NAMED_FORMATS:
+        return NAMED_FORMATS[fmt](values)
+    # %d 遇到無限大會失敗，整數格式只處理有限值
+    valid = np.isfinite(values) if fmt.endswith("d") else None
+    return format_number(values, fmt, valid=valid)
+
+
+def format_frame(df, formats):
+    """格式化 df 中有設定格式的欄位 (不在 df 中的設定略過)，回傳新的 DataFrame"""
+    formatted = {
+        column: format_column(df[column], fmt)
+        for column, fmt in formats.items()
+        if column in df.columns
+    }
+    return df.assign(**formatted) if formatted else df.copy()
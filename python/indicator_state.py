@@ -0,0 +1,326 @@
+"""
+技術指標串流狀態
+保存每檔股票計算指標所需的最少狀態，每天收盤後只需把當天的一根 K 棒餵進去即可更新所有指標，
+不必每次以完整的歷史視窗重新計算
+
+- 移動平均 (收盤 5/20/60 日、成交量 5/20/60 日): 環狀緩衝區 + 滾動加總，加入新值、扣掉移出視窗的值
+- 近 20 日高低點、箱型 (T-125 ~ T-5) 高低點、KD 的 9 日高低點: 單調佇列 (monotonic deque)
+- KD: 只保存最後的 K、D
+- 20 日報酬率: 由環狀緩衝區取 19 個交易日前的收盤
+
+所有股票以 numpy 陣列同時更新，每檔股票每天的更新為 O(1) (單調佇列為攤銷 O(1))，
+只計算有收盤價的交易日 (與 PriceStore.tail 相同，停牌日略過)
+
+狀態記錄建立時股價矩陣的來源 (PriceStore.source) 與已加入的交易日；來源不同、矩陣中狀態日期以前的交易日
+與已加入的不同 (之後補進較早的交易日)、矩陣少了狀態中的股票，或新出現的股票在狀態日期之前已有股價時，以完整股價重新建立
+(Stock_Filter 以 exchange 股價矩陣執行時由此取得成交量分析)
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+import utils
+from price_store import history_unchanged, load_price_store
+from Stock_Filter import classify_volume_signals
+from Step10_KD import KD_INITIAL, KD_PERIOD, KD_WEIGHT
+
+INDICATOR_STATE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Data", "IndicatorState", "indicator_state.pkl")
+
+SMA_WINDOWS = (5, 20, 60)
+RANGE_WINDOW = 20            # 近 20 日高低點
+BOX_WINDOW = 120             # 箱型期間 (排除最近 BOX_OFFSET 個交易日)
+BOX_OFFSET = 5
+RETURN_WINDOW = 20           # 20 日報酬率 (與 build_history_table 的 close_20d 相同，為 19 個交易日前的收盤)
+BUFFER_SIZE = 128            # 環狀緩衝區長度 (需大於最長的回看天數 BOX_WINDOW + BOX_OFFSET)
+
+
+class MonotonicWindow:
+    """
+    所有股票各自的滑動視窗最大值 (或最小值)，以固定容量的環狀單調佇列實作
+    佇列中保存 (數值, 交易日序號)，由前到後數值遞減 (最大值) 或遞增 (最小值)，最前面即為視窗極值
+    """
+
+    def __init__(self, n, window, mode="max"):
+        self.window = window
+        self.mode = mode
+        capacity = window + 1
+        self.values = np.full((n, capacity), np.nan)
+        self.index = np.zeros((n, capacity), dtype=np.int64)
+        self.head = np.zeros(n, dtype=np.int64)
+        self.size = np.zeros(n, dtype=np.int64)
+
+    @property
+    def capacity(self):
+        return self.values.shape[1]
+
+    def push(self, rows, values, index):
+        """rows 這些股票加入新的數值 (index 為各自的交易日序號)，並移除超出視窗的舊值"""
+        # 從後面移除不再可能成為極值的數值 (每個數值最多被移除一次，攤銷 O(1))
+        active, candidates = rows, values
+        while active.size:
+            back = (self.head[active] + self.size[active] - 1) % self.capacity
+            tail = self.values[active, back]
+            dominated = tail <= candidates if self.mode == "max" else tail >= candidates
+            keep = (self.size[active] > 0) & dominated
+            active, candidates = active[keep], candidates[keep]
+            self.size[active] -= 1
+
+        position = (self.head[rows] + self.size[rows]) % self.capacity
+        self.values[rows, position] = values
+        self.index[rows, position] = index
+        self.size[rows] += 1
+
+        # 每天只加入一個數值，最前面最多只有一個數值超出視窗
+        front = self.head[rows]
+        expired = self.index[rows, front] <= index - self.window
+        self.head[rows[expired]] = (front[expired] + 1) % self.capacity
+        self.size[rows[expired]] -= 1
+
+    def current(self):
+        """每檔股票目前視窗的極值，沒有數值時為 NaN"""
+        result = self.values[np.arange(len(self.head)), self.head]
+        return np.where(self.size > 0, result, np.nan)
+
+
+class IndicatorState:
+    """
+    每檔股票的指標狀態 (股票順序與 symbols 相同)
+      bars: 累積的交易日數；close_buffer / volume_buffer: 最近 BUFFER_SIZE 個交易日的環狀緩衝區
+      close_sums / volume_sums: 各移動平均視窗的滾動加總；k / d: 最後的 K、D
+      source: 建立狀態的股價矩陣來源；date: 最後加入的交易日；dates: 已加入的交易日
+    """
+
+    def __init__(self, symbols, source=None):
+        self.symbols = list(symbols)
+        self.symbol_index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.source = source
+        self.date = None
+        self.dates = pd.DatetimeIndex([])
+        n = len(self.symbols)
+
+        self.bars = np.zeros(n, dtype=np.int64)
+        self.close_buffer = np.full((n, BUFFER_SIZE), np.nan)
+        self.volume_buffer = np.zeros((n, BUFFER_SIZE))
+        self.close_sums = {window: np.zeros(n) for window in SMA_WINDOWS}
+        self.volume_sums = {window: np.zeros(n) for window in SMA_WINDOWS}
+        self.k = np.full(n, KD_INITIAL)
+        self.d = np.full(n, KD_INITIAL)
+
+        self.windows = {
+            "high_20d": MonotonicWindow(n, RANGE_WINDOW, "max"),
+            "low_20d": MonotonicWindow(n, RANGE_WINDOW, "min"),
+            "box_high": MonotonicWindow(n, BOX_WINDOW, "max"),
+            "box_low": MonotonicWindow(n, BOX_WINDOW, "min"),
+            "kd_high": MonotonicWindow(n, KD_PERIOD, "max"),
+            "kd_low": MonotonicWindow(n, KD_PERIOD, "min"),
+        }
+
+    def ingest(self, close, high, low, volume, date=None):
+        """
+        加入一個交易日的 K 棒 (各參數為與 symbols 對齊的陣列)，收盤價為 NaN 的股票當天不更新
+        最高 / 最低價缺值時以收盤價代替
+        """
+        close = np.asarray(close, dtype=np.float64)
+        rows = np.flatnonzero(~np.isnan(close))
+        close = close[rows]
+        high = np.asarray(high, dtype=np.float64)[rows]
+        low = np.asarray(low, dtype=np.float64)[rows]
+        high = np.where(np.isnan(high), close, high)
+        low = np.where(np.isnan(low), close, low)
+        volume = np.nan_to_num(np.asarray(volume, dtype=np.float64)[rows])
+
+        bar = self.bars[rows]
+        position = bar % BUFFER_SIZE
+
+        # 滾動加總: 加入新值，扣掉剛移出視窗的值 (環狀緩衝區中 window 個交易日前的值)
+        for window in SMA_WINDOWS:
+            leaving = bar >= window
+            old = (bar - window) % BUFFER_SIZE
+            self.close_sums[window][rows] += close - np.where(leaving, self.close_buffer[rows, old], 0)
+            self.volume_sums[window][rows] += volume - np.where(leaving, self.volume_buffer[rows, old], 0)
+
+        self.close_buffer[rows, position] = close
+        self.volume_buffer[rows, position] = volume
+
+        self.windows["high_20d"].push(rows, close, bar)
+        self.windows["low_20d"].push(rows, close, bar)
+
+        # 箱型: BOX_OFFSET 個交易日前的收盤進入箱型視窗
+        boxed = bar >= BOX_OFFSET
+        box_rows, box_bar = rows[boxed], bar[boxed] - BOX_OFFSET
+        box_close = self.close_buffer[box_rows, box_bar % BUFFER_SIZE]
+        self.windows["box_high"].push(box_rows, box_close, box_bar)
+        self.windows["box_low"].push(box_rows, box_close, box_bar)
+
+        # KD: RSV 以最近 KD_PERIOD 個交易日的最高 / 最低價計算，交易日數不足時為初始值
+        self.windows["kd_high"].push(rows, high, bar)
+        self.windows["kd_low"].push(rows, low, bar)
+        highest = self.windows["kd_high"].current()[rows]
+        lowest = self.windows["kd_low"].current()[rows]
+        spread = highest - lowest
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rsv = np.where(spread > 0, (close - lowest) / spread * 100, KD_INITIAL)
+        rsv[bar + 1 < KD_PERIOD] = KD_INITIAL
+        self.k[rows] = (1 - KD_WEIGHT) * self.k[rows] + KD_WEIGHT * rsv
+        self.d[rows] = (1 - KD_WEIGHT) * self.d[rows] + KD_WEIGHT * self.k[rows]
+
+        self.bars[rows] = bar + 1
+        if date is not None:
+            self.date = pd.Timestamp(date)
+            self.dates = self.dates.append(pd.DatetimeIndex([self.date]))
+
+    def lookback(self, buffer, days):
+        """每檔股票 days 個交易日前的數值 (0 為最新)，交易日數不足時為 NaN"""
+        bars = self.bars
+        values = buffer[np.arange(len(bars)), (bars - 1 - days) % BUFFER_SIZE]
+        return np.where(bars > days, values, np.nan)
+
+    def moving_average(self, sums, window):
+        """最近 window 個交易日的平均 (交易日數不足時以現有的交易日平均，與 step4 的 head(period).mean() 相同)"""
+        count = np.minimum(self.bars, window)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(count > 0, sums[window] / count, np.nan)
+
+    def values(self):
+        """目前所有指標 (索引為股票代號)"""
+        close = self.lookback(self.close_buffer, 0)
+        close_20d = self.lookback(self.close_buffer, RETURN_WINDOW - 1)
+        table = {
+            "close": close,
+            "volume": self.lookback(self.volume_buffer, 0),
+            **{f"sma_{window}": self.moving_average(self.close_sums, window) for window in SMA_WINDOWS},
+            **{f"vol_ma{window}": self.moving_average(self.volume_sums, window) for window in SMA_WINDOWS},
+            "high_20d": self.windows["high_20d"].current(),
+            "low_20d": self.windows["low_20d"].current(),
+            "box_high": self.windows["box_high"].current(),
+            "box_low": self.windows["box_low"].current(),
+            "r_20d": (close - close_20d) / close_20d,
+            "k": np.where(self.bars > 0, self.k, np.nan),
+            "d": np.where(self.bars > 0, self.d, np.nan),
+            "bars": self.bars,
+        }
+        return pd.DataFrame(table, index=pd.Index(self.symbols, name="證券代號"))
+
+    def volume_analysis(self):
+        """成交量訊號 (與 Stock_Filter.calculate_volume_analysis_batch 的結果相同)"""
+        values = self.values()
+        full = self.bars >= RANGE_WINDOW
+        return classify_volume_signals(
+            current_close=values["close"].to_numpy(),
+            current_vol=values["volume"].to_numpy(),
+            vol_ma5=np.where(self.bars >= 5, values["vol_ma5"], np.nan),
+            vol_ma20=np.where(full, values["vol_ma20"], np.nan),
+            box_high=values["box_high"].to_numpy(),
+            box_low=values["box_low"].to_numpy(),
+            high_20d=values["high_20d"].to_numpy(),
+            low_20d=values["low_20d"].to_numpy(),
+            counts=self.bars,
+            index=values.index,
+        )
+
+    def add_symbols(self, symbols):
+        """加入新的股票 (從空的狀態開始累積)"""
+        new = [symbol for symbol in symbols if symbol not in self.symbol_index]
+        if not new:
+            return
+        grown = IndicatorState(self.symbols + new, self.source)
+        n = len(self.symbols)
+        grown.date, grown.dates = self.date, self.dates
+        grown.bars[:n] = self.bars
+        grown.close_buffer[:n] = self.close_buffer
+        grown.volume_buffer[:n] = self.volume_buffer
+        grown.k[:n], grown.d[:n] = self.k, self.d
+        for window in SMA_WINDOWS:
+            grown.close_sums[window][:n] = self.close_sums[window]
+            grown.volume_sums[window][:n] = self.volume_sums[window]
+        for name, window in self.windows.items():
+            target = grown.windows[name]
+            target.values[:n], target.index[:n] = window.values, window.index
+            target.head[:n], target.size[:n] = window.head, window.size
+        self.__dict__.update(grown.__dict__)
+
+    def matches(self, prices):
+        """
+        股價矩陣是否可接續此狀態更新: 來源相同、矩陣中狀態日期 (含) 以前的交易日與已加入的相同、
+        狀態中的股票都還在，且新出現的股票在狀態日期 (含) 之前沒有股價 (否則這些交易日不會被加入)
+        """
+        if getattr(self, "source", None) != prices.source:
+            return False
+        if self.date is None:
+            return True
+        if not history_unchanged(getattr(self, "dates", None), prices.dates, self.date):
+            return False
+        if not set(self.symbols) <= set(prices.symbols):
+            return False
+        new = [i for i, symbol in enumerate(prices.symbols) if symbol not in self.symbol_index]
+        end = prices.dates.get_loc(self.date) + 1
+        return bool(np.isnan(np.asarray(prices.close)[new, :end]).all())
+
+    def update_from_prices(self, prices):
+        """
+        將股價矩陣中 self.date 之後的交易日依序加入，回傳加入的日數
+        股價矩陣中新出現的股票從加入的第一天開始累積
+        """
+        self.add_symbols(prices.symbols)
+        rows = np.array([self.symbol_index[symbol] for symbol in prices.symbols], dtype=np.int64)
+        start = 0 if self.date is None else prices.dates.searchsorted(self.date, side="right")
+
+        n = len(self.symbols)
+        for column in range(start, len(prices.dates)):
+            bar = {}
+            for name in ("close", "high", "low", "volume"):
+                values = np.full(n, np.nan)
+                values[rows] = getattr(prices, name)[:, column]
+                bar[name] = values
+            self.ingest(bar["close"], bar["high"], bar["low"], bar["volume"], prices.dates[column])
+        return max(len(prices.dates) - start, 0)
+
+    def save(self, path=INDICATOR_STATE_PATH):
+        """寫入狀態 (中斷時不會留下寫到一半的檔案)"""
+        utils.save_pickle(self, path)
+
+    @classmethod
+    def load(cls, path=INDICATOR_STATE_PATH):
+        """讀取狀態，沒有存檔時回傳 None"""
+        if not os.path.exists(path):
+            return None
+        return pd.read_pickle(path)
+
+    @classmethod
+    def from_prices(cls, prices):
+        """由完整的股價矩陣建立狀態"""
+        state = cls(prices.symbols, prices.source)
+        state.update_from_prices(prices)
+        return state
+
+
+def update_indicator_state(prices=None, path=INDICATOR_STATE_PATH):
+    """
+    讀取存檔的狀態並加入股價矩陣中的新交易日 (沒有存檔時以完整股價建立)，寫回後回傳狀態
+    prices 未指定時讀取全市場股價矩陣，沒有存檔時回傳 None
+    """
+    if prices is None:
+        prices = load_price_store("exchange")
+        if prices is None:
+            return None
+
+    state = IndicatorState.load(path)
+    if state is not None and not state.matches(prices):
+        print("指標狀態與股價矩陣的來源、股票清單或已加入的交易日不同，以完整股價重新建立")
+        state = None
+    if state is None:
+        state = IndicatorState.from_prices(prices)
+        print(f"以完整股價建立指標狀態: {len(state.symbols)} 檔 × {len(prices.dates)} 日")
+    else:
+        days = state.update_from_prices(prices)
+        print(f"指標狀態更新 {days} 個交易日 (至 {state.date:%Y-%m-%d})")
+    state.save(path)
+    return state
+
+
+if __name__ == "__main__":
+    state = update_indicator_state()
+    if state is not None:
+        print(state.values().round(2).to_string(max_rows=40))
@@ -0,0 +1,189 @@
+"""
+全市場每日行情
+由證交所 (上市) 與櫃買中心 (上櫃) 的每日收盤行情整批報表，每個交易日一次請求取得所有證券的開高低收與成交股數，
+每個交易日存成一個檔案，再併入股價矩陣 (price_store.PriceStore)，讓所有以股價計算的指標共用同一份本地資料
+
+- 回補: 缺少的日期同時抓取 (各交易所的請求間隔至少 QUOTE_REQUEST_INTERVAL 秒)，每日抓完即存檔，
+  中斷後重新執行只抓尚未完成的日期；遇到封鎖頁面時立即停止
+- 過去的日期存檔後不再重新抓取 (假日存成空檔)；當天的資料在收盤公布前可能還沒有，不存檔
+- 股價矩陣 (Data/PriceStore/exchange，與 Stock_Filter 的 yfinance 矩陣分開) 只追加尚未併入的日期；股價為交易所公布的原始價格 (未還原除權息)，代號與 yfinance 相同 (上市 .TW、上櫃 .TWO)
+"""
+
+import argparse
+import os
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+import utils
+from price_store import PriceStore, PRICE_STORE_DIRS
+
+# 各市場的整批行情: 網址、日期格式、代號後綴、報表欄位對應的行情欄位
+MARKET_QUOTE_SOURCES = {
+    "上市": {
+        "url": "https://www.twse.com.tw/rwd/zh/afterTrading/MI_INDEX?type=ALLBUT0999&response=json&date={date}",
+        "date_format": "%Y%m%d",
+        "suffix": ".TW",
+        "fields": {"證券代號": "代號", "開盤價": "開盤", "最高價": "最高", "最低價": "最低", "收盤價": "收盤", "成交股數": "成交股數"},
+    },
+    "上櫃": {
+        "url": "https://www.tpex.org.tw/www/zh-tw/afterTrading/dailyQuotes?type=EW&response=json&date={date}",
+        "date_format": "%Y/%m/%d",
+        "suffix": ".TWO",
+        "fields": {"代號": "代號", "開盤": "開盤", "最高": "最高", "最低": "最低", "收盤": "收盤", "成交股數": "成交股數"},
+    },
+}
+
+QUOTE_HISTORY_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Data", "DailyQuotes")
+QUOTE_HISTORY_DAYS = 1305     # 預設回補的營業日數 (約 5 年，涵蓋 step3 本益比河流圖的級距期間)
+QUOTE_MAX_WORKERS = 2         # 同時抓取的日期數
+QUOTE_REQUEST_INTERVAL = 3    # 同一交易所請求的最小間隔 (秒)，所有執行緒共用 (請求過快會被暫時封鎖)
+QUOTE_REQUEST_JITTER = 2      # 另加的隨機延遲 (秒)
+QUOTE_COLUMNS = ["代號", "開盤", "最高", "最低", "收盤", "成交股數"]
+QUOTE_SOURCE = "exchange"     # 由本模組建立的股價矩陣 (PriceStore.source 與 PRICE_STORE_DIRS 的鍵)
+
+# 行情欄位對應股價矩陣的陣列
+QUOTE_ARRAYS = {"開盤": "open", "最高": "high", "最低": "low", "收盤": "close", "成交股數": "volume"}
+
+
+def to_number(values):
+    """報表數值 (含千分位逗號，沒有成交時為 -- 等符號) 轉成 float64，無法轉換時為 NaN"""
+    return pd.to_numeric(values.astype(str).str.replace(",", "", regex=False).str.strip(), errors="coerce").to_numpy(dtype=np.float64)
+
+
+def quote_tables(json_data):
+    """回應中有資料的表格 (新版 tables 清單，或舊版 fieldsN / dataN 成對的欄位)，欄位名稱去除前後空白"""
+    tables = [t for t in json_data.get("tables") or [] if t.get("fields") and t.get("data")]
+    for key in json_data:
+        if key.startswith("fields") and json_data.get("data" + key[len("fields"):]):
+            tables.append({"fields": json_data[key], "data": json_data["data" + key[len("fields"):]]})
+    return [{"fields": [str(field).strip() for field in t["fields"]], "data": t["data"]} for t in tables]
+
+
+def parse_quotes(json_data, market):
+    """
+    整批行情回應轉成 QUOTE_COLUMNS (代號加上市場後綴)，找不到個股行情表格時回傳空的 DataFrame
+    (假日沒有任何表格；有表格但欄位都對不上時印出警告，可能是報表格式改變)
+    """
+    source = MARKET_QUOTE_SOURCES[market]
+    tables = quote_tables(json_data)
+    table = next((t for t in tables if set(source["fields"]) <= set(t["fields"])), None)
+    if table is None:
+        if tables:
+            print(f"{market}行情找不到個股表格 (需要欄位 {list(source['fields'])})，回應中的表格: "
+                  + "; ".join(",".join(t["fields"]) for t in tables))
+        return pd.DataFrame(columns=QUOTE_COLUMNS)
+
+    df = pd.DataFrame(table["data"], columns=table["fields"])
+    df = df.loc[:, ~df.columns.duplicated()]
+    quotes = {}
+    for field, target in source["fields"].items():
+        if target == "代號":
+            quotes[target] = df[field].astype(str).str.strip().to_numpy() + source["suffix"]
+        else:
+            quotes[target] = to_number(df[field])
+    return pd.DataFrame(quotes)[QUOTE_COLUMNS]
+
+
+def fetch_quote_day(day, markets=tuple(MARKET_QUOTE_SOURCES), limiters=None):
+    """
+    抓取單日所有市場的行情，所有市場都沒有資料 (假日) 時回傳空的 DataFrame；
+    只有部分市場有資料 (另一市場尚未公布) 時回傳 None，不存檔，下次重抓
+    limiters: {市場: utils.RateLimiter}，交易所回傳封鎖頁面時拋出 utils.BlockedError
+    """
+    frames = []
+    for market in markets:
+        source = MARKET_QUOTE_SOURCES[market]
+        url = source["url"].format(date=day.strftime(source["date_format"]))
+        frames.append(parse_quotes(utils.fetch_json(url, (limiters or {}).get(market)), market))
+
+    if all(df.empty for df in frames):
+        return pd.DataFrame(columns=QUOTE_COLUMNS)
+    if any(df.empty for df in frames):
+        return None
+    return pd.concat(frames, ignore_index=True).drop_duplicates("代號")
+
+
+def day_path(day, history_dir=QUOTE_HISTORY_DIR):
+    return os.path.join(history_dir, f"{day:%Y%m%d}.pkl")
+
+
+def update_daily_quotes(days=QUOTE_HISTORY_DAYS, max_workers=QUOTE_MAX_WORKERS, history_dir=QUOTE_HISTORY_DIR):
+    """回補最近 days 個營業日的整批行情，回傳 (成功存檔的日期, 失敗的日期)"""
+    today = pd.Timestamp(date.today())
+    tasks = [day for day in utils.recent_business_days(days) if not os.path.exists(day_path(day, history_dir))]
+    print(f"每日行情: 最近 {days} 個營業日，需抓取 {len(tasks)} 日")
+
+    limiters = {market: utils.RateLimiter(QUOTE_REQUEST_INTERVAL, QUOTE_REQUEST_JITTER) for market in MARKET_QUOTE_SOURCES}
+
+    def fetch(day):
+        df = fetch_quote_day(day, limiters=limiters)
+        # 當天尚未公布的資料不存檔，下次重新抓取
+        return None if df is not None and df.empty and day >= today else df
+
+    return utils.backfill(
+        tasks, fetch, lambda day: day_path(day, history_dir),
+        max_workers=max_workers, describe=lambda day: f"{day:%Y-%m-%d} 行情", report_every=50,
+    )
+
+
+def write_quotes(store, day, quotes):
+    """單日行情寫入股價矩陣的對應日期 (代號需已在矩陣中)，沒有成交的欄位維持 NaN，成交量缺值為 0"""
+    col = store.dates.get_loc(day)
+    rows = pd.Index(store.symbols).get_indexer(quotes["代號"])
+    for column, name in QUOTE_ARRAYS.items():
+        values = quotes[column].to_numpy(dtype=np.float64)
+        if name == "volume":
+            values = np.nan_to_num(values, nan=0)
+        getattr(store, name)[rows, col] = values
+
+
+def update_price_store(days=QUOTE_HISTORY_DAYS, path=PRICE_STORE_DIRS[QUOTE_SOURCE], history_dir=QUOTE_HISTORY_DIR):
+    """
+    將已存檔的每日行情併入股價矩陣並存檔，回傳以 memory-map 開啟的 PriceStore
+    既有的矩陣由本模組建立時只追加尚未併入的日期 (超出最近 days 個營業日的日期捨去)；
+    不存在或不是本模組建立的矩陣時以存檔的行情重建
+    """
+    window = utils.recent_business_days(days)
+    store = PriceStore.load(path) if os.path.exists(path) else None
+    if store is None or store.source != QUOTE_SOURCE:
+        if store is not None:
+            print(f"股價矩陣來源為 {store.source}，改以每日行情重建")
+        store = PriceStore([], [])
+        store.source = QUOTE_SOURCE
+
+    pending = {}
+    for day in window:
+        if day not in store.dates and os.path.exists(day_path(day, history_dir)):
+            quotes = pd.read_pickle(day_path(day, history_dir))
+            if not quotes.empty:
+                pending[day] = quotes
+    stale = len(store.dates) > 0 and store.dates[0] < window[0]
+    if not pending and not stale:
+        print(f"股價矩陣已是最新: {len(store.symbols)} 檔 × {len(store.dates)} 日")
+        return store
+
+    symbols = set().union(*(quotes["代號"] for quotes in pending.values()))
+    dates = store.dates[store.dates >= window[0]].append(pd.DatetimeIndex(list(pending)))
+    store = store.extended(symbols, dates)
+    for day, quotes in pending.items():
+        write_quotes(store, day, quotes)
+
+    print(f"股價矩陣追加 {len(pending)} 日: {len(store.symbols)} 檔 × {len(store.dates)} 日")
+    return store.save(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="全市場每日行情回補並併入股價矩陣")
+    parser.add_argument("--days", type=int, default=QUOTE_HISTORY_DAYS, help="回補的營業日數")
+    parser.add_argument("--workers", type=int, default=QUOTE_MAX_WORKERS, help="同時抓取的日期數")
+    args = parser.parse_args()
+
+    utils.init()
+    update_daily_quotes(args.days, max_workers=args.workers)
+    update_price_store(args.days)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+多來源指標合併
+每個資料來源整理成以證券代號對齊的表格，輸出欄位依優先順序逐欄取第一個有值的來源，
+並記錄每一格資料的來源代碼
+"""
+
+import numpy as np
+import pandas as pd
+
+# 來源代碼 (0 表示所有來源皆無資料)
+SOURCE_CODES = {
+    "ref": 1,       # 彙整清單參考資料
+    "info": 2,      # yfinance info
+    "stmt": 3,      # 財報計算 (損益表 / 資產負債表 / 現金流量表)
+    "hist": 4,      # 歷史股價矩陣
+    "calc": 5,      # 由已合併的欄位再計算
+    "default": 6,   # 預設值
+    "mops": 7,      # MOPS 彙總報表 (全市場一次取得)
+}
+SOURCE_NAMES = {code: name for name, code in SOURCE_CODES.items()}
+SOURCE_NAMES[0] = "-"
+
+
+def parse_float_series(series):
+    """parse_float 的向量化版本：去除千分位與 %，"20.5 / 0" 取前段，無法轉換者為 NaN"""
+    if pd.api.types.is_numeric_dtype(series):
+        return pd.to_numeric(series, errors="coerce").astype(float)
+
+    text = (
+        series.astype("string")
+        .str.replace(",", "", regex=False)
+        .str.replace("%", "", regex=False)
+        .str.split("/").str[0]
+        .str.strip()
+    )
+    return pd.to_numeric(text, errors="coerce").astype(float)
+
+
+def coalesce_metrics(sources, spec, index, zero_as_missing=()):
+    """
+    依優先順序合併各來源
+
+    參數:
+      sources (dict): 來源名稱 -> DataFrame (索引為證券代號)
+      spec (dict): 輸出欄位 -> [(來源名稱, 欄位名稱), ...]；來源為 "default" 時第二項為常數
+      index: 輸出的證券代號索引
+      zero_as_missing: 值為 0 時視為缺值、繼續找下一個來源的欄位 (預設值除外)
+    回傳:
+      (values DataFrame, provenance DataFrame[int8])
+    """
+    values = {}
+    provenance = {}
+
+    for metric, candidates in spec.items():
+        result = pd.Series(np.nan, index=index, dtype=object)
+        code = np.zeros(len(index), dtype=np.int8)
+
+        for source, column in candidates:
+            if source == "default":
+                candidate = pd.Series(column, index=index, dtype=object)
+            else:
+                table = sources.get(source)
+                if table is None or column not in table.columns:
+                    continue
+                candidate = table[column].reindex(index)
+
+            available = candidate.notna().to_numpy()
+            if metric in zero_as_missing and source != "default":
+                available = available & (candidate != 0).to_numpy()
+
+            take = available & (code == 0)
+            if take.any():
+                result = result.where(~take, candidate)
+                code[take] = SOURCE_CODES[source]
+
+        values[metric] = result.infer_objects()
+        provenance[metric] = code
+
+    return pd.DataFrame(values, index=index), pd.DataFrame(provenance, index=index)
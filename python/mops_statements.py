@@ -0,0 +1,262 @@
+"""
+MOPS 彙總報表
+綜合損益 (t163sb04)、資產負債 (t163sb05)、營益分析 (t163sb06) 彙總表的抓取與解析
+
+MOPS 回傳的頁面依產業別分成多個表格 (一般業、金控、銀行、保險、證券等)，各表格的科目名稱不同，
+此處解析頁面中的每一個表格，依 STATEMENT_SCHEMA 對應到同一組欄位 (數值皆為 float64)，
+各報表類型與各市場 (上市、上櫃) 同時抓取
+"""
+
+import re
+from datetime import date
+
+import lxml.html
+import numpy as np
+import pandas as pd
+
+import utils
+
+MOPS_API_URL = "https://mops.twse.com.tw/mops/api/redirectToOld"
+
+# 財務報表類型對應
+REPORT_TYPE_MAP = {
+    "綜合損益": "t163sb04",
+    "資產負債": "t163sb05",
+    "營益分析": "t163sb06"
+}
+
+# 市場別與 MOPS 查詢代碼 (上市 sii、上櫃 otc)
+MARKETS = {"上市": "sii", "上櫃": "otc"}
+
+KEY_COLUMNS = ["證券代號", "公司名稱", "市場別"]
+
+# 各季財報公布截止日 (月, 日)，Q4 為次年
+REPORT_DEADLINES = {1: (5, 15), 2: (8, 14), 3: (11, 14), 4: (3, 31)}
+
+# 最新財報期間快取 (日期, (民國年, 季))
+_report_period_cache = None
+
+# 統一欄位: [各產業表格中的科目名稱 (依序取第一個存在的)]
+# 科目名稱比對前先經過 normalize_item_name (去除括號內文字、斜線與空白)
+STATEMENT_SCHEMA = {
+    "綜合損益": {
+        "營業收入": ["營業收入", "淨收益", "收益"],
+        "營業成本": ["營業成本"],
+        "營業毛利": ["營業毛利淨額", "營業毛利"],
+        "營業費用": ["營業費用", "支出及費用"],
+        "營業利益": ["營業利益"],
+        "營業外收入及支出": ["營業外收入及支出", "營業外損益"],
+        "稅前淨利": ["稅前淨利", "繼續營業單位稅前淨利", "繼續營業單位稅前損益", "繼續營業單位稅前純益"],
+        "所得稅費用": ["所得稅費用", "所得稅"],
+        "本期淨利": ["本期淨利", "本期稅後淨利"],
+        "歸屬母公司淨利": ["淨利歸屬於母公司業主"],
+        "綜合損益總額": ["本期綜合損益總額"],
+        "基本每股盈餘": ["基本每股盈餘"],
+    },
+    "資產負債": {
+        "流動資產": ["流動資產"],
+        "非流動資產": ["非流動資產"],
+        "資產總額": ["資產總額", "資產總計"],
+        "流動負債": ["流動負債"],
+        "非流動負債": ["非流動負債"],
+        "負債總額": ["負債總額", "負債總計"],
+        "股本": ["股本"],
+        "資本公積": ["資本公積"],
+        "保留盈餘": ["保留盈餘"],
+        "歸屬母公司權益": ["歸屬於母公司業主之權益合計", "歸屬於母公司業主之權益"],
+        "權益總額": ["權益總額", "權益總計"],
+        "每股參考淨值": ["每股參考淨值"],
+    },
+    "營益分析": {
+        "營業收入": ["營業收入"],
+        "毛利率": ["毛利率"],
+        "營業利益率": ["營業利益率"],
+        "稅前純益率": ["稅前純益率"],
+        "稅後純益率": ["稅後純益率"],
+    },
+}
+
+PAREN_PATTERN = re.compile(r"\([^)]*\)")
+FULLWIDTH_PARENS = str.maketrans({"（": "(", "）": ")"})
+
+
+def normalize_item_name(name):
+    """科目名稱正規化，例如 "營業毛利（毛損）" -> "營業毛利"、"毛利率(%)(營業毛利)/(營業收入)" -> "毛利率" """
+    name = str(name).translate(FULLWIDTH_PARENS)
+    return re.sub(r"[\s/]", "", PAREN_PATTERN.sub("", name))
+
+
+def get_latest_report_period(today=None):
+    """計算最新財報期間 (民國年, 季)，同一天只計算一次"""
+    global _report_period_cache
+
+    if today is None:
+        today = date.today()
+
+    # 如果是同一天且已有快取，直接返回
+    if _report_period_cache and _report_period_cache[0] == today:
+        return _report_period_cache[1]
+
+    year = today.year
+    roc_year = year - 1911
+
+    # 財報公布截止日 (Q4 為前一年的年報)
+    deadlines = {season: date(year, *REPORT_DEADLINES[season]) for season in REPORT_DEADLINES}
+
+    # 3/31 前前一年 Q4 尚未公布，最新為前一年 Q3
+    if today <= deadlines[4]:
+        period = (roc_year - 1, 3)
+    elif today <= deadlines[1]:
+        period = (roc_year - 1, 4)
+    elif today <= deadlines[2]:
+        period = (roc_year, 1)
+    elif today <= deadlines[3]:
+        period = (roc_year, 2)
+    else:
+        period = (roc_year, 3)
+
+    _report_period_cache = (today, period)
+    return period
+
+
+def report_deadline(year, season):
+    """民國年、季的財報公布截止日 (此日之後全部公司的財報都已公布)"""
+    month, day = REPORT_DEADLINES[season]
+    return date(year + 1911 + (season == 4), month, day)
+
+
+def parse_html_tables(html):
+    """
+    以 lxml 直接取出頁面中所有含 "公司代號" 的表格，回傳 [(標題列, 資料列), ...]
+    表格中重複出現的標題列會略過
+    """
+    tables = []
+    for table in lxml.html.fromstring(html).iter("table"):
+        header = None
+        rows = []
+        # 只取本表格的列 (不含巢狀表格中的列)
+        for tr in table.xpath("./tr | ./thead/tr | ./tbody/tr"):
+            cells = [cell.text_content().strip() for cell in tr if cell.tag in ("th", "td")]
+            if not cells:
+                continue
+            if cells[0] == "公司代號":
+                header = header or cells
+                continue
+            if header and len(cells) == len(header):
+                rows.append(cells)
+        if header and rows:
+            tables.append((header, rows))
+    return tables
+
+
+def to_float_columns(rows, positions):
+    """將字串資料列中指定位置的欄位轉成 float64 (去除千分位，"--" 等無法轉換者為 NaN)"""
+    text = pd.DataFrame([[row[i] for i in positions] for row in rows])
+    return text.apply(lambda column: pd.to_numeric(column.str.replace(",", "", regex=False), errors="coerce"))
+
+
+def map_statement_table(header, rows, schema):
+    """將單一產業表格依 schema 對應到統一欄位，表格中沒有的科目為 NaN"""
+    names = [normalize_item_name(name) for name in header]
+    columns = {}
+    for column, aliases in schema.items():
+        position = next((names.index(alias) for alias in aliases if alias in names), None)
+        if position is not None:
+            columns[column] = position
+
+    df = pd.DataFrame({
+        "證券代號": [row[0] for row in rows],
+        "公司名稱": [row[1] for row in rows],
+    })
+    values = np.full((len(rows), len(schema)), np.nan)
+    if columns:
+        parsed = to_float_columns(rows, list(columns.values())).to_numpy(dtype=np.float64)
+        for i, column in enumerate(columns):
+            values[:, list(schema).index(column)] = parsed[:, i]
+    return pd.concat([df, pd.DataFrame(values, columns=list(schema))], axis=1)
+
+
+def parse_statement_html(html, report_type):
+    """解析 MOPS 彙總報表頁面中的所有產業表格，合併成統一欄位的 DataFrame"""
+    schema = STATEMENT_SCHEMA[report_type]
+    frames = [map_statement_table(header, rows, schema) for header, rows in parse_html_tables(html)]
+    if not frames:
+        return pd.DataFrame(columns=KEY_COLUMNS[:2] + list(schema))
+    return pd.concat(frames, ignore_index=True)
+
+
+def fetch_statement_html(report_type, year, season, typek, limiter=None):
+    """
+    向 MOPS 查詢單一報表、單一市場 (typek: sii 上市、otc 上櫃)，回傳報表頁面 HTML (查無資料為 None)
+    limiter: 限制請求頻率 (utils.RateLimiter)，MOPS 回傳封鎖頁面時拋出 utils.BlockedError
+    """
+    payload = {
+        "apiName": f"ajax_{REPORT_TYPE_MAP[report_type]}",
+        "parameters": {
+            "year": str(year),
+            "season": str(season).zfill(2),
+            "TYPEK": typek,
+            "isQuery": "Y",
+            "firstin": 1,
+            "off": 1,
+            "step": 1,
+            "encodeURIComponent": 1,
+        },
+    }
+
+    response = utils.fetch_limited(MOPS_API_URL, limiter, json=payload, method="post")
+    final_url = response.json().get("result", {}).get("url")
+    if not final_url:
+        print(f"無法獲取財務報表 URL: {report_type} ({typek})")
+        return None
+
+    final_response = utils.fetch_limited(final_url, limiter)
+    if "查詢無資料" in final_response.text:
+        print(f"查詢無資料：民國 {year} 年第 {season} 季 {report_type} ({typek})")
+        return None
+    return final_response.text
+
+
+def fetch_statement(report_type, year, season, market, limiter=None):
+    """
+    抓取並解析單一報表、單一市場，失敗時回傳空的 DataFrame
+    指定 limiter 時 (回補多季) 遇到封鎖頁面會拋出 utils.BlockedError，讓呼叫端停止後續請求
+    """
+    try:
+        html = fetch_statement_html(report_type, year, season, MARKETS[market], limiter)
+        if html is None:
+            return pd.DataFrame()
+        df = parse_statement_html(html, report_type)
+        df.insert(2, "市場別", market)
+        return df
+    except Exception as e:
+        if limiter is not None and isinstance(e, utils.BlockedError):
+            raise
+        print(f"獲取{market}{report_type}報表失敗: {e}")
+        return pd.DataFrame()
+
+
+def get_statements(year, season, report_types=tuple(REPORT_TYPE_MAP), markets=tuple(MARKETS)):
+    """
+    同時抓取多種報表 × 多個市場 (民國年、季)
+    回傳 {報表類型: DataFrame}，每個 DataFrame 含所有產業格式的公司，欄位為 KEY_COLUMNS + STATEMENT_SCHEMA
+    """
+    if not (1 <= season <= 4):
+        raise ValueError("季度必須是 1, 2, 3, 4 之一")
+
+    tasks = {
+        (report_type, market): (lambda r=report_type, m=market: fetch_statement(r, year, season, m))
+        for report_type in report_types
+        for market in markets
+    }
+    results = utils.fetch_concurrently(tasks)
+
+    statements = {}
+    for report_type in report_types:
+        frames = [results[(report_type, market)] for market in markets]
+        frames = [df for df in frames if not df.empty]
+        columns = KEY_COLUMNS + list(STATEMENT_SCHEMA[report_type])
+        df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+        statements[report_type] = df.drop_duplicates("證券代號").reset_index(drop=True)[columns]
+        print(f"{report_type}: 民國 {year} 年第 {season} 季共 {len(statements[report_type])} 家公司")
+    return statements
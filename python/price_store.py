@@ -0,0 +1,377 @@
+"""
+股價矩陣儲存
+將歷史股價整理成 (股票 × 日期) 的 numpy 陣列，供篩選程式以代號快速取用
+"""
+
+import json
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import yfinance as yf
+from dateutil.relativedelta import relativedelta
+
+# 分批下載設定
+DOWNLOAD_CHUNK_SIZE = 50     # 每批股票數量
+DOWNLOAD_MAX_WORKERS = 4     # 同時下載的批次上限
+DOWNLOAD_RETRIES = 3         # 每批失敗重試次數
+
+PRICE_FIELDS = ["Open", "Close", "High", "Low", "Volume"]
+
+# 股價矩陣存放位置 (memory-mapped .npy)，各來源分開存放，互不覆蓋
+PRICE_STORE_ROOT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Data", "PriceStore")
+PRICE_STORE_DIRS = {
+    "yfinance": os.path.join(PRICE_STORE_ROOT, "yfinance"),   # Stock_Filter 清單的還原股價 (download_prices)
+    "exchange": os.path.join(PRICE_STORE_ROOT, "exchange"),   # 交易所整批行情的全市場原始股價 (market_prices.py)
+}
+ARRAY_DTYPES = {"open": np.float32, "close": np.float32, "high": np.float32, "low": np.float32, "volume": np.int64}
+
+
+def compact_rows(valid):
+    """
+    每列有值的位置移到最前面 (依日期順序)，回傳 (原始欄位順序, 每列有值的個數)
+    order[i, j] 為第 i 列第 j 個有值數值的原始欄位
+    """
+    order = np.argsort(~valid, axis=1, kind="stable")
+    return order, valid.sum(axis=1)
+
+
+def right_align(valid, window, *arrays):
+    """
+    各陣列每列最近 window 個有效位置的數值 (依日期順序靠右對齊，最新在最後，不足補 NaN)，回傳 float64 陣列的 list
+    valid: (列 × 日期) 有效位置 (例如有收盤價的交易日)，所有陣列使用同一個排列
+    """
+    # 穩定排序讓無效位置排在前面、有效位置依日期順序排在最後
+    order = np.argsort(valid, axis=1, kind="stable")[:, -window:]
+    aligned_valid = np.take_along_axis(valid, order, axis=1)
+    pad = window - order.shape[1]
+
+    result = []
+    for array in arrays:
+        values = np.take_along_axis(np.asarray(array), order, axis=1).astype(np.float64)
+        values[~aligned_valid] = np.nan
+        if pad > 0:
+            values = np.hstack([np.full((len(values), pad), np.nan), values])
+        result.append(values)
+    return result
+
+
+class PriceStore:
+    """(股票 × 日期) 股價矩陣，開高低收為 float32，成交量為 int64 (缺值為 0)"""
+
+    def __init__(self, symbols, dates, arrays=None):
+        self.symbols = list(symbols)
+        self.dates = pd.DatetimeIndex(dates)
+        self.symbol_index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.path = None
+
+        # 未提供的陣列 (例如舊版存檔沒有開盤價) 以空值建立
+        arrays = dict(arrays or {})
+        shape = (len(self.symbols), len(self.dates))
+        for name, dtype in ARRAY_DTYPES.items():
+            if name not in arrays:
+                arrays[name] = np.zeros(shape, dtype=dtype) if name == "volume" else np.full(shape, np.nan, dtype=dtype)
+        self.open = arrays["open"]
+        self.close = arrays["close"]
+        self.high = arrays["high"]
+        self.low = arrays["low"]
+        self.volume = arrays["volume"]
+        self.source = None       # 資料來源 (yfinance: 還原股價，exchange: 交易所整批行情，見 market_prices.py)
+        self._lock = threading.Lock()
+        self._years = None
+
+    @property
+    def empty(self):
+        return self.close.size == 0 or bool(np.isnan(self.close).all())
+
+    def __contains__(self, symbol):
+        return symbol in self.symbol_index
+
+    @property
+    def years(self):
+        """每個日期欄位對應的西元年 (快取)"""
+        if self._years is None:
+            self._years = self.dates.year.to_numpy()
+        return self._years
+
+    def view(self, symbol):
+        """
+        取得單一股票的列視圖 (不複製資料)
+        回傳 dict: open/close/high/low/volume 為 numpy 視圖，valid 為有收盤價的遮罩；查無代號回傳 None
+        """
+        row = self.symbol_index.get(symbol)
+        if row is None:
+            return None
+        close = self.close[row]
+        return {
+            "open": self.open[row],
+            "close": close,
+            "high": self.high[row],
+            "low": self.low[row],
+            "volume": self.volume[row],
+            "valid": ~np.isnan(close),
+        }
+
+    def tail(self, window, fields=("close", "volume")):
+        """
+        每檔股票最近 window 個有效交易日 (靠右對齊，不足補 NaN)
+        回傳 (dict: 欄位 -> (股票 × window) float64 陣列, 每檔有效交易日數)
+        """
+        valid = ~np.isnan(self.close)
+        aligned = right_align(valid, window, *(getattr(self, name) for name in fields))
+        return dict(zip(fields, aligned)), valid.sum(axis=1)
+
+    def save(self, path):
+        """將矩陣寫成 .npy 檔 (含代號與日期索引)，回傳以 memory-map 開啟的 PriceStore"""
+        tmp_path = f"{path}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        for name in ARRAY_DTYPES:
+            np.save(os.path.join(tmp_path, f"{name}.npy"), getattr(self, name))
+        meta = {
+            "symbols": self.symbols,
+            "dates": [d.strftime("%Y-%m-%d") for d in self.dates],
+            "source": self.source,
+        }
+        with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+        # 先寫入暫存資料夾再替換，避免其他行程讀到寫一半的檔案
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+        print(f"股價矩陣已儲存至: {path}")
+        return PriceStore.load(path)
+
+    @classmethod
+    def load(cls, path, mode="r"):
+        """以 memory-map 開啟已儲存的矩陣，多個行程可共用同一份資料而不重新載入"""
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mode)
+            for name in ARRAY_DTYPES
+            if os.path.exists(os.path.join(path, f"{name}.npy"))
+        }
+        store = cls(meta["symbols"], pd.to_datetime(meta["dates"]), arrays)
+        store.path = path
+        store.source = meta.get("source")
+        return store
+
+    def extended(self, symbols, dates):
+        """
+        回傳涵蓋原有代號與 symbols、日期為 dates 的新矩陣 (新增的代號依序排在後面)
+        原有的資料複製到對應位置，不在 dates 中的日期捨去
+        """
+        new_symbols = sorted(set(symbols) - set(self.symbol_index))
+        store = PriceStore(self.symbols + new_symbols, pd.DatetimeIndex(dates).unique().sort_values())
+        store.source = self.source
+
+        cols = store.dates.get_indexer(self.dates)
+        keep = cols >= 0
+        for name in ARRAY_DTYPES:
+            getattr(store, name)[:len(self.symbols), cols[keep]] = getattr(self, name)[:, keep]
+        return store
+
+    def write_chunk(self, df, symbols):
+        """將 yf.download(group_by='ticker') 的結果寫入矩陣，回傳成功寫入的代號"""
+        if df is None or df.empty:
+            return []
+
+        dates = pd.DatetimeIndex(df.index)
+        if dates.tz is not None:
+            dates = dates.tz_localize(None)
+        cols = self.dates.get_indexer(dates.normalize())
+        keep = cols >= 0
+        cols = cols[keep]
+
+        # 單一代號時 yfinance 可能不回傳 MultiIndex 欄位
+        if not isinstance(df.columns, pd.MultiIndex):
+            df = pd.concat({symbols[0]: df}, axis=1)
+
+        written = []
+        for symbol in symbols:
+            if symbol not in df.columns.get_level_values(0) or symbol not in self.symbol_index:
+                continue
+            sub = df[symbol]
+            if "Close" not in sub.columns:
+                continue
+            close = pd.to_numeric(sub["Close"], errors="coerce").to_numpy(dtype=np.float64)[keep]
+            if np.isnan(close).all():
+                continue
+
+            row = self.symbol_index[symbol]
+            with self._lock:
+                self.close[row, cols] = close
+                for field, target in (("Open", self.open), ("High", self.high), ("Low", self.low)):
+                    if field in sub.columns:
+                        target[row, cols] = pd.to_numeric(sub[field], errors="coerce").to_numpy(dtype=np.float64)[keep]
+                if "Volume" in sub.columns:
+                    volume = pd.to_numeric(sub["Volume"], errors="coerce").to_numpy(dtype=np.float64)[keep]
+                    self.volume[row, cols] = np.nan_to_num(volume, nan=0).astype(np.int64)
+            written.append(symbol)
+
+        return written
+
+    def compact(self):
+        """移除所有股票皆無資料的日期 (假日)"""
+        valid = ~np.isnan(self.close).all(axis=0)
+        if valid.all():
+            return self
+        self.dates = self.dates[valid]
+        self.open = np.ascontiguousarray(self.open[:, valid])
+        self.close = np.ascontiguousarray(self.close[:, valid])
+        self.high = np.ascontiguousarray(self.high[:, valid])
+        self.low = np.ascontiguousarray(self.low[:, valid])
+        self.volume = np.ascontiguousarray(self.volume[:, valid])
+        self._years = None
+        return self
+
+    def frame(self, symbol):
+        """取得單一股票的 DataFrame (Open/Close/High/Low/Volume)，查無代號回傳空表"""
+        row = self.symbol_index.get(symbol)
+        if row is None:
+            return pd.DataFrame()
+
+        close = self.close[row]
+        volume = self.volume[row].astype(np.float64)
+        volume[np.isnan(close)] = np.nan
+        return pd.DataFrame({
+            "Open": self.open[row],
+            "Close": close,
+            "High": self.high[row],
+            "Low": self.low[row],
+            "Volume": volume,
+        }, index=self.dates)
+
+
+def load_price_store(source="exchange"):
+    """
+    讀取指定來源的股價矩陣 (見 PRICE_STORE_DIRS)，沒有存檔時印出提示並回傳 None
+    全市場的本地指標 (KD、本益比河流圖、均線、量能排行、指標狀態) 都讀取 exchange，不受 Stock_Filter 清單影響
+    """
+    path = PRICE_STORE_DIRS[source]
+    if not os.path.exists(path):
+        hint = "請先執行 market_prices.py 回補每日行情" if source == "exchange" else "請先執行 Stock_Filter.py 下載股價"
+        print(f"找不到 {source} 股價矩陣 ({path})，{hint}")
+        return None
+    return PriceStore.load(path)
+
+
+def history_unchanged(saved_dates, dates, last):
+    """
+    股價矩陣的交易日 dates 中 last (含) 以前的部分是否與增量狀態已加入的交易日 saved_dates 相同
+    補抓到 last 之前的交易日 (中斷的回補之後補齊)、或矩陣往前延伸時為 False；矩陣捨去的較舊日期不影響
+    """
+    if saved_dates is None or last not in dates:
+        return False
+    current = dates[dates <= last]
+    return current.equals(saved_dates[saved_dates >= current[0]])
+
+
+def make_random_store(symbol_count, day_count, seed=0):
+    """產生隨機漫步股價的 PriceStore (含少量停牌缺值)，供 benchmark.py 與 tests 使用"""
+    rng = np.random.default_rng(seed)
+    symbols = [f"{1000 + i}.TW" for i in range(symbol_count)]
+    dates = pd.bdate_range(end=pd.Timestamp.today().normalize(), periods=day_count)
+    store = PriceStore(symbols, dates)
+
+    returns = rng.normal(0, 0.02, size=(symbol_count, day_count))
+    close = 50 * np.exp(np.cumsum(returns, axis=1))
+    spread = np.abs(rng.normal(0, 0.01, size=close.shape))
+    store.close[:] = close
+    store.high[:] = close * (1 + spread)
+    store.low[:] = close * (1 - spread)
+    store.volume[:] = rng.integers(100_000, 5_000_000, size=close.shape)
+
+    # 約 1% 的交易日停牌
+    suspended = rng.random(close.shape) < 0.01
+    store.close[suspended] = np.nan
+    store.high[suspended] = np.nan
+    store.low[suspended] = np.nan
+    store.volume[suspended] = 0
+    return store
+
+
+def get_period_dates(period="3y", end=None):
+    """依 yfinance period 字串 (如 3y、6mo) 產生涵蓋的營業日"""
+    end = pd.Timestamp(end or datetime.today()).normalize()
+    unit_map = {"y": "years", "mo": "months", "d": "days"}
+    for suffix, unit in unit_map.items():
+        if period.endswith(suffix):
+            start = end - relativedelta(**{unit: int(period[:-len(suffix)])})
+            return pd.bdate_range(start=start, end=end)
+    raise ValueError(f"不支援的期間格式: {period}")
+
+
+def _download_chunk(symbols, period, retries):
+    """下載單一批次，失敗或缺資料的代號各自重試"""
+    frames = []
+    pending = list(symbols)
+
+    for attempt in range(1, retries + 1):
+        try:
+            df = yf.download(
+                pending, period=period, group_by="ticker",
+                threads=False, auto_adjust=True, progress=False
+            )
+        except Exception as e:
+            print(f"批次下載第 {attempt} 次失敗 ({pending[0]}...): {e}")
+            df = pd.DataFrame()
+
+        if not df.empty:
+            if not isinstance(df.columns, pd.MultiIndex):
+                df = pd.concat({pending[0]: df}, axis=1)
+            got = [
+                s for s in pending
+                if s in df.columns.get_level_values(0) and df[s]["Close"].notna().any()
+            ]
+            if got:
+                frames.append(df[got])
+            pending = [s for s in pending if s not in got]
+
+        if not pending:
+            break
+
+    return frames, pending
+
+
+def download_prices(stock_list, period="3y", chunk_size=DOWNLOAD_CHUNK_SIZE,
+                    max_workers=DOWNLOAD_MAX_WORKERS, retries=DOWNLOAD_RETRIES, path=None):
+    """
+    分批下載歷史股價並寫入 PriceStore
+    每批下載完即寫入矩陣後釋放，記憶體用量只與 chunk_size × max_workers 有關
+    指定 path 時會存檔並回傳 memory-mapped 的 PriceStore
+    """
+    store = PriceStore(stock_list, get_period_dates(period))
+    store.source = "yfinance"
+    chunks = [stock_list[i:i + chunk_size] for i in range(0, len(stock_list), chunk_size)]
+    print(f"分 {len(chunks)} 批下載 {len(stock_list)} 檔股價 (每批 {chunk_size} 檔，同時 {max_workers} 批)")
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(_download_chunk, chunk, period, retries): chunk for chunk in chunks}
+        for future in as_completed(futures):
+            chunk = futures[future]
+            try:
+                frames, pending = future.result()
+            except Exception as e:
+                print(f"批次處理失敗 ({chunk[0]}...): {e}")
+                frames, pending = [], chunk
+
+            for df in frames:
+                store.write_chunk(df, list(df.columns.get_level_values(0).unique()))
+            failed.extend(pending)
+
+    if failed:
+        print(f"無法取得股價: {', '.join(failed)}")
+
+    store.compact()
+    print(f"股價矩陣: {len(store.symbols)} 檔 × {len(store.dates)} 日")
+    if path:
+        return store.save(path)
+    return store
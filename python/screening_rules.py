@@ -0,0 +1,440 @@
+"""
+選股規則引擎
+所有選股方案 (財務健康評分、四道關卡、三好一公道、choose_stock 條件、品質篩選) 的條件、權重與評等級距
+定義在 screening_rules.json，編譯成執行計畫後對同一份數值表一次算完
+
+規則寫法:
+  條件式: "欄位 運算子 值"，運算子前後需有空白
+    值可為數字、'文字'、另一個欄位名稱 (可乘倍數，如 "本益比 < 近五年最低本益比 * 1.1")
+    "欄位 isna" / "欄位 notna" 判斷是否有值；欄位缺值時比較結果一律為 False
+  組合條件: criteria 中以 all / any 組合條件式或其他組合條件的名稱，output=true 的會輸出成欄位
+  權重、標籤、排除條件中可直接寫條件式，不必另外命名
+"""
+
+import json
+import os
+import re
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+SCREEN_RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "screening_rules.json")
+
+OPERATORS = {
+    ">": np.greater,
+    ">=": np.greater_equal,
+    "<": np.less,
+    "<=": np.less_equal,
+    "==": np.equal,
+    "!=": np.not_equal,
+}
+
+CONDITION_PATTERN = re.compile(r"^(\S+)\s+(>=|<=|==|!=|>|<)\s+(.+)$")
+NULL_CHECK_PATTERN = re.compile(r"^(\S+)\s+(isna|notna)$")
+REF_PATTERN = re.compile(r"^(\S+)(?:\s*\*\s*(\S+))?$")
+
+
+@dataclass(frozen=True)
+class Condition:
+    """單一比較條件；ref=True 時 value 為另一個欄位名稱 (比較前乘上 scale)"""
+    column: str
+    op: str
+    value: object = None
+    ref: bool = False
+    scale: float = 1.0
+
+    @property
+    def columns(self):
+        return (self.column, self.value) if self.ref else (self.column,)
+
+
+@dataclass(frozen=True)
+class Criterion:
+    """組合條件: terms 為 Condition 或其他組合條件名稱，mode 為 all / any"""
+    name: str
+    terms: tuple
+    mode: str = "all"
+    output: bool = False
+
+
+@dataclass(frozen=True)
+class LabelRule:
+    """依序判斷 cases ((標籤, 組合條件名稱), ...)，都不符合時為 default"""
+    column: str
+    cases: tuple
+    default: str
+    categories: tuple = ()
+
+
+@dataclass(frozen=True)
+class ScoreRule:
+    """加權計分 weights ((組合條件名稱, 分數), ...)，可依 grades ((門檻, 評等), ...) 由高到低給評等"""
+    column: str
+    weights: tuple
+    dtype: str = "int"
+    grade_column: str = None
+    grades: tuple = ()
+    grade_default: str = ""
+
+
+@dataclass(frozen=True)
+class FilterRule:
+    """符合任一排除條件即不通過，排除原因依序串接"""
+    pass_column: str
+    reason_column: str
+    exclude: tuple
+
+
+@dataclass
+class ScreenPlan:
+    """編譯後的執行計畫"""
+    criteria: dict
+    labels: dict
+    scores: list
+    filter: FilterRule
+    steps: list
+    conditions: list
+    input_columns: list
+    percent_columns: tuple = ()
+    reference_count: int = 0
+    flag_columns: list = field(default_factory=list)
+
+
+def parse_condition(text):
+    """將條件式字串轉成 Condition，不是條件式時回傳 None"""
+    text = text.strip()
+    match = NULL_CHECK_PATTERN.match(text)
+    if match:
+        return Condition(match.group(1), match.group(2))
+
+    match = CONDITION_PATTERN.match(text)
+    if not match:
+        return None
+    column, op, value = match.groups()
+    value = value.strip()
+
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in "'\"":
+        return Condition(column, op, value[1:-1])
+    try:
+        return Condition(column, op, float(value))
+    except ValueError:
+        pass
+
+    ref = REF_PATTERN.match(value)
+    if not ref:
+        raise ValueError(f"無法解析條件: {text}")
+    scale = float(ref.group(2)) if ref.group(2) else 1.0
+    return Condition(column, op, ref.group(1), ref=True, scale=scale)
+
+
+def load_screen_rules(path=SCREEN_RULES_FILE):
+    """讀取規則檔"""
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compile_screens(rules=None, quality="strict"):
+    """
+    將規則編譯成執行計畫
+    - 條件式去除重複 (如 本益比 > 0 在多個方案中只算一次)
+    - 依相依關係排出組合條件與標籤的計算順序
+    - 找出需要轉成數值的輸入欄位
+    quality: 使用 filters 中的哪一組品質篩選 (strict / loose)
+    """
+    if rules is None:
+        rules = load_screen_rules()
+
+    criteria = {}
+    for name, item in rules.get("criteria", {}).items():
+        mode = "any" if "any" in item else "all"
+        criteria[name] = Criterion(name, tuple(item[mode]), mode, bool(item.get("output", False)))
+
+    def resolve(term):
+        """名稱直接回傳；條件式包成匿名組合條件 (以條件式本身為名稱)"""
+        if term in criteria:
+            return term
+        condition = parse_condition(term)
+        if condition is None:
+            raise ValueError(f"未定義的條件: {term}")
+        criteria[term] = Criterion(term, (term,))
+        return term
+
+    labels = {
+        column: LabelRule(
+            column,
+            tuple((label, resolve(term)) for label, term in item["cases"]),
+            item["default"],
+            tuple(item.get("categories", ())),
+        )
+        for column, item in rules.get("labels", {}).items()
+    }
+
+    scores = [
+        ScoreRule(
+            column,
+            tuple((resolve(term), weight) for term, weight in item["weights"].items()),
+            item.get("dtype", "int"),
+            item.get("grade_column"),
+            tuple((threshold, grade) for threshold, grade in item.get("grades", ())),
+            item.get("grade_default", ""),
+        )
+        for column, item in rules.get("scores", {}).items()
+    ]
+
+    filters = rules.get("filters", {})
+    if quality not in filters:
+        raise ValueError(f"找不到品質篩選規則: {quality}")
+    filter_item = filters[quality]
+    filter_rule = FilterRule(
+        filter_item["pass_column"],
+        filter_item["reason_column"],
+        tuple((resolve(term), reason) for term, reason in filter_item["exclude"]),
+    )
+
+    # 組合條件的每一項轉成 Condition 或名稱
+    for name, criterion in list(criteria.items()):
+        terms = []
+        for term in criterion.terms:
+            condition = parse_condition(term) if term not in criteria or term == name else None
+            if condition is not None:
+                terms.append(condition)
+            elif term in criteria and term != name:
+                terms.append(term)
+            else:
+                raise ValueError(f"未定義的條件: {term} (於 {name})")
+        criteria[name] = Criterion(name, tuple(terms), criterion.mode, criterion.output)
+
+    # 依相依關係排序 (條件式可引用標籤欄位，例如 估值狀態 == '便宜')
+    steps = []
+    state = {}
+
+    def visit(kind, name):
+        key = (kind, name)
+        if state.get(key) == "done":
+            return
+        if state.get(key) == "visiting":
+            raise ValueError(f"規則循環引用: {name}")
+        state[key] = "visiting"
+
+        if kind == "criterion":
+            for term in criteria[name].terms:
+                if isinstance(term, Condition):
+                    for column in term.columns:
+                        if column in labels:
+                            visit("label", column)
+                else:
+                    visit("criterion", term)
+        else:
+            for _, term in labels[name].cases:
+                visit("criterion", term)
+
+        state[key] = "done"
+        steps.append(key)
+
+    for name, criterion in criteria.items():
+        if criterion.output:
+            visit("criterion", name)
+    for column in labels:
+        visit("label", column)
+    for score in scores:
+        for term, _ in score.weights:
+            visit("criterion", term)
+    for term, _ in filter_rule.exclude:
+        visit("criterion", term)
+
+    # 只保留用得到的組合條件，並收集不重複的條件式
+    used = {name for kind, name in steps if kind == "criterion"}
+    criteria = {name: c for name, c in criteria.items() if name in used}
+    conditions = []
+    reference_count = 0
+    for kind, name in steps:
+        if kind != "criterion":
+            continue
+        for term in criteria[name].terms:
+            if isinstance(term, Condition):
+                reference_count += 1
+                if term not in conditions:
+                    conditions.append(term)
+
+    input_columns = []
+    for condition in conditions:
+        for column in condition.columns:
+            if column not in labels and column not in input_columns:
+                input_columns.append(column)
+
+    return ScreenPlan(
+        criteria=criteria,
+        labels=labels,
+        scores=scores,
+        filter=filter_rule,
+        steps=steps,
+        conditions=conditions,
+        input_columns=input_columns,
+        percent_columns=tuple(rules.get("percent_columns", ())),
+        reference_count=reference_count,
+        flag_columns=[name for name, c in criteria.items() if c.output],
+    )
+
+
+def build_typed_values(df, plan):
+    """將用到的輸入欄位轉成 float64 陣列 (缺少的欄位視為全部缺值)"""
+    values = {}
+    for column in plan.input_columns:
+        if column not in df.columns:
+            values[column] = np.full(len(df), np.nan)
+            continue
+        series = df[column]
+        if not pd.api.types.is_numeric_dtype(series):
+            series = pd.to_numeric(series, errors="coerce")
+        values[column] = series.to_numpy(dtype=np.float64, na_value=np.nan)
+
+    # 以小數儲存的百分比 (如殖利率 0.05) 轉成百分比數值再比較
+    for column in plan.percent_columns:
+        if column in values:
+            finite = values[column][~np.isnan(values[column])]
+            if finite.size and finite.max() < 1:
+                values[column] = values[column] * 100
+    return values
+
+
+def evaluate_condition(condition, values):
+    if condition.op == "isna":
+        return pd.isna(values[condition.column])
+    if condition.op == "notna":
+        return ~pd.isna(values[condition.column])
+
+    left = values[condition.column]
+    right = values[condition.value] * condition.scale if condition.ref else condition.value
+    return np.asarray(OPERATORS[condition.op](left, right), dtype=bool)
+
+
+def evaluate_steps(values, plan, steps, n):
+    """依序計算組合條件與標籤 (標籤結果寫入 values 供後續條件引用)，回傳 {組合條件名稱: bool 陣列}"""
+    masks = {}
+    flags = {}
+    for kind, name in steps:
+        if kind == "criterion":
+            criterion = plan.criteria[name]
+            parts = []
+            for term in criterion.terms:
+                if isinstance(term, Condition):
+                    if term not in masks:
+                        masks[term] = evaluate_condition(term, values)
+                    parts.append(masks[term])
+                else:
+                    parts.append(flags[term])
+            reduce = np.logical_and.reduce if criterion.mode == "all" else np.logical_or.reduce
+            flags[name] = reduce(parts) if parts else np.zeros(n, dtype=bool)
+        else:
+            label = plan.labels[name]
+            values[name] = np.select(
+                [flags[term] for _, term in label.cases],
+                [text for text, _ in label.cases],
+                default=label.default,
+            ).astype(object)
+    return flags
+
+
+def pushdown_exclusions(plan, columns):
+    """
+    找出品質篩選中只用到 columns 的排除條件，可在抓取其他資料前先判斷
+    只接受比較運算 (缺值時為 False) 且不引用標籤的條件，因此缺值的股票一律保留，不會誤刪
+    回傳 (可提前判斷的排除條件 [(名稱, 原因), ...], 所需的計算步驟)
+    """
+    pushable = {}
+
+    def check(name):
+        if name not in pushable:
+            ok = True
+            for term in plan.criteria[name].terms:
+                if isinstance(term, Condition):
+                    ok = ok and term.op in OPERATORS and all(c in columns for c in term.columns)
+                else:
+                    ok = ok and check(term)
+            pushable[name] = ok
+        return pushable[name]
+
+    exclusions = [(term, reason) for term, reason in plan.filter.exclude if check(term)]
+    steps = [(kind, name) for kind, name in plan.steps if kind == "criterion" and pushable.get(name)]
+    return exclusions, steps
+
+
+def run_prefilter(df, plan, columns):
+    """
+    以 columns 中已有的資料先套用可提前判斷的排除條件
+    回傳 (是否排除的 bool 陣列, 使用到的排除條件名稱)
+    """
+    exclusions, steps = pushdown_exclusions(plan, columns)
+    excluded = np.zeros(len(df), dtype=bool)
+    if not exclusions:
+        return excluded, []
+
+    values = build_typed_values(df, plan)
+    flags = evaluate_steps(values, plan, steps, len(df))
+    for term, _ in exclusions:
+        excluded |= flags[term]
+    return excluded, [term for term, _ in exclusions]
+
+
+def evaluate_screens(values, plan, n):
+    """
+    以型別化的數值表計算所有選股方案
+    回傳 {欄位: 陣列}，含旗標 (bool)、標籤 (Categorical)、分數與評等、品質篩選欄位
+    """
+    flags = evaluate_steps(values, plan, plan.steps, n)
+
+    result = {}
+    for column in plan.flag_columns:
+        result[column] = flags[column]
+
+    for column, label in plan.labels.items():
+        if label.categories:
+            result[column] = pd.Categorical(values[column], categories=list(label.categories))
+        else:
+            result[column] = values[column]
+
+    for score in plan.scores:
+        dtype = np.float64 if score.dtype == "float" else np.int64
+        total = np.zeros(n, dtype=dtype)
+        for term, weight in score.weights:
+            total += flags[term] * dtype(weight)
+        result[score.column] = total
+        if score.grade_column:
+            result[score.grade_column] = np.select(
+                [total >= threshold for threshold, _ in score.grades],
+                [grade for _, grade in score.grades],
+                default=score.grade_default,
+            ).astype(object)
+
+    excluded = np.zeros(n, dtype=bool)
+    reasons = np.full(n, "", dtype=object)
+    for term, reason in plan.filter.exclude:
+        excluded |= flags[term]
+        reasons = reasons + np.where(flags[term], reason, "").astype(object)
+    result[plan.filter.pass_column] = ~excluded
+    result[plan.filter.reason_column] = reasons
+    return result
+
+
+def attach_screens(df, plan, screens):
+    """將選股結果 (DataFrame，索引與 df 相同) 併回 df，並將非數值的輸入欄位寫回轉換後的數值"""
+    # 百分比換算只用於比較，不寫回
+    converted = {
+        column: pd.to_numeric(df[column], errors="coerce")
+        for column in plan.input_columns
+        if column in df.columns and not pd.api.types.is_numeric_dtype(df[column])
+    }
+    if converted:
+        screens = screens.assign(**converted)
+    return pd.concat([df.drop(columns=[c for c in screens.columns if c in df.columns]), screens], axis=1)
+
+
+def run_screens(df, plan):
+    """
+    依執行計畫一次計算所有選股方案
+    回傳加上旗標 (bool)、標籤 (Categorical)、分數與評等、品質篩選欄位的 DataFrame
+    """
+    values = build_typed_values(df, plan)
+    screens = pd.DataFrame(evaluate_screens(values, plan, len(df)), index=df.index)
+    return attach_screens(df, plan, screens)
@@ -0,0 +1,215 @@
+"""
+財報歷史資料
+將 MOPS 彙總報表 (綜合損益、資產負債、營益分析) 依 (報表類型, 民國年, 季) 逐季存檔，
+每季檔案含所有公司 (以證券代號區分)，可計算年增率與多季趨勢
+
+- 回補: 缺少的季別依序抓取 (MOPS 請求間隔 3 ~ 10 秒)，每季抓完即存檔，中斷後重新執行只抓尚未完成的季別；
+  遇到 MOPS 封鎖頁面時立即停止
+- 已結束的季別 (早於最新財報期間) 存檔後不再重新抓取；最新一季每天最多更新一次 (補上晚申報的公司)
+- 綜合損益與營益分析為年度累計數 (Q2 為上半年合計)，單季數值以 quarterly_values 換算
+"""
+
+import argparse
+import os
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+import utils
+from mops_statements import MARKETS, REPORT_TYPE_MAP, fetch_statement, get_latest_report_period
+
+STATEMENT_HISTORY_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Data", "StatementHistory")
+HISTORY_PERIODS = 8          # 預設保留的季數 (8 季可計算年增率與兩年趨勢)
+HISTORY_MAX_WORKERS = 1      # 同時回補的季別數 (MOPS 封鎖最嚴格，預設依序抓取)
+MOPS_REQUEST_INTERVAL = 3    # MOPS 請求的最小間隔 (秒)
+MOPS_REQUEST_JITTER = 7      # 另加的隨機延遲 (秒)，與 utils.sleep() 相同為 3 ~ 10 秒
+TREND_MIN_POINTS = 4         # 計算趨勢至少需要的季數
+
+
+def recent_periods(count=HISTORY_PERIODS, latest=None):
+    """最近 count 季的 (民國年, 季)，由舊到新"""
+    year, season = latest or get_latest_report_period()
+    periods = []
+    for _ in range(count):
+        periods.append((year, season))
+        year, season = (year, season - 1) if season > 1 else (year - 1, 4)
+    return periods[::-1]
+
+
+def season_path(report_type, year, season, history_dir=STATEMENT_HISTORY_DIR):
+    return os.path.join(history_dir, REPORT_TYPE_MAP[report_type], f"{year}Q{season}.pkl")
+
+
+def needs_fetch(path, closed):
+    """尚未存檔需要抓取；已結束的季別不再抓取；最新一季當天已更新過則略過"""
+    if not os.path.exists(path):
+        return True
+    if closed:
+        return False
+    return date.fromtimestamp(os.path.getmtime(path)) < date.today()
+
+
+def fetch_season(report_type, year, season, markets=tuple(MARKETS), limiter=None):
+    """抓取單一報表、單一季別的所有市場，任一市場沒有資料時回傳 None (不存檔，下次重抓)"""
+    frames = [fetch_statement(report_type, year, season, market, limiter) for market in markets]
+    if any(df.empty for df in frames):
+        return None
+    return pd.concat(frames, ignore_index=True).drop_duplicates("證券代號").reset_index(drop=True)
+
+
+def update_statement_history(periods=HISTORY_PERIODS, report_types=tuple(REPORT_TYPE_MAP),
+                             markets=tuple(MARKETS), max_workers=HISTORY_MAX_WORKERS,
+                             history_dir=STATEMENT_HISTORY_DIR):
+    """
+    回補並更新最近 periods 季的財報，回傳 (成功存檔的季別, 失敗的季別) [(報表類型, 民國年, 季), ...]
+    """
+    latest = get_latest_report_period()
+    tasks = [
+        (report_type, year, season)
+        for report_type in report_types
+        for year, season in recent_periods(periods, latest)
+        if needs_fetch(season_path(report_type, year, season, history_dir), (year, season) < latest)
+    ]
+    print(f"財報歷史: 最近 {periods} 季 × {len(report_types)} 種報表，需抓取 {len(tasks)} 份")
+
+    limiter = utils.RateLimiter(MOPS_REQUEST_INTERVAL, MOPS_REQUEST_JITTER)
+    return utils.backfill(
+        tasks,
+        lambda task: fetch_season(*task, markets, limiter=limiter),
+        lambda task: season_path(*task, history_dir),
+        max_workers=max_workers,
+        describe=lambda task: f"{task[0]} {task[1]}Q{task[2]}",
+    )
+
+
+def load_statement_history(report_type, periods=None, history_dir=STATEMENT_HISTORY_DIR):
+    """
+    讀取已存檔的季別，回傳長表 (年度、季別、證券代號、公司名稱、市場別、各科目)
+    periods: [(民國年, 季), ...]，預設為最近 HISTORY_PERIODS 季；沒有存檔的季別略過
+    """
+    frames = []
+    for year, season in periods or recent_periods():
+        path = season_path(report_type, year, season, history_dir)
+        if os.path.exists(path):
+            df = pd.read_pickle(path)
+            df.insert(0, "季別", season)
+            df.insert(0, "年度", year)
+            frames.append(df)
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
+
+
+def statement_panel(history, column):
+    """長表轉成 (證券代號 × 季別) 的寬表，欄位為 (年度, 季別) 由舊到新"""
+    if history.empty:
+        return pd.DataFrame()
+    return history.pivot(index="證券代號", columns=["年度", "季別"], values=column).sort_index(axis=1)
+
+
+def quarterly_values(panel):
+    """年度累計數換算成單季數值 (Q1 不變，其餘季別減去同年度前一季；前一季缺檔時為 NaN)"""
+    values = panel.to_numpy(dtype=np.float64)
+    periods = list(panel.columns)
+    position = {period: i for i, period in enumerate(periods)}
+
+    result = values.copy()
+    for i, (year, season) in enumerate(periods):
+        if season == 1:
+            continue
+        previous = position.get((year, season - 1))
+        result[:, i] = values[:, i] - values[:, previous] if previous is not None else np.nan
+    return pd.DataFrame(result, index=panel.index, columns=panel.columns)
+
+
+def trailing_four_quarters(panel):
+    """單季數值的近四季合計 (例如近四季 EPS)，四季中任一季缺檔或缺值時為 NaN"""
+    values = panel.to_numpy(dtype=np.float64)
+    position = {period: i for i, period in enumerate(panel.columns)}
+
+    result = np.full(values.shape, np.nan)
+    for i, (year, season) in enumerate(panel.columns):
+        quarters = [(year, season - k) if season > k else (year - 1, season - k + 4) for k in range(4)]
+        columns = [position.get(quarter) for quarter in quarters]
+        if None not in columns:
+            result[:, i] = values[:, columns].sum(axis=1)
+    return pd.DataFrame(result, index=panel.index, columns=panel.columns)
+
+
+def yoy_growth(panel):
+    """每一季相對去年同季的成長率 (%)，去年同季缺值或為 0 時為 NaN"""
+    previous = panel.reindex(columns=pd.MultiIndex.from_tuples(
+        [(year - 1, season) for year, season in panel.columns], names=panel.columns.names
+    ))
+    current = panel.to_numpy(dtype=np.float64)
+    base = previous.to_numpy(dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        growth = np.where(base != 0, (current - base) / np.abs(base) * 100, np.nan)
+    return pd.DataFrame(growth, index=panel.index, columns=panel.columns)
+
+
+def trend_slope(panel, window=HISTORY_PERIODS, min_points=TREND_MIN_POINTS):
+    """最近 window 季的線性趨勢 (每季變動量，最小平方法，略過缺值)，有值的季數不足 min_points 時為 NaN"""
+    values = panel.iloc[:, -window:].to_numpy(dtype=np.float64)
+    valid = ~np.isnan(values)
+    x = np.broadcast_to(np.arange(values.shape[1], dtype=np.float64), values.shape)
+
+    count = valid.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_x = np.where(valid, x, 0).sum(axis=1) / count
+        mean_y = np.where(valid, values, 0).sum(axis=1) / count
+        dx = np.where(valid, x - mean_x[:, None], 0)
+        dy = np.where(valid, values - mean_y[:, None], 0)
+        slope = (dx * dy).sum(axis=1) / (dx * dx).sum(axis=1)
+    slope[count < min_points] = np.nan
+    return pd.Series(slope, index=panel.index)
+
+
+def margin_panel(income, numerator):
+    """單季利潤率 (%) = 單季 numerator / 單季營業收入"""
+    revenue = quarterly_values(statement_panel(income, "營業收入"))
+    amount = quarterly_values(statement_panel(income, numerator)).reindex_like(revenue)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return amount / revenue.where(revenue > 0) * 100
+
+
+def history_metrics(periods=HISTORY_PERIODS, history_dir=STATEMENT_HISTORY_DIR):
+    """
+    由已存檔的財報計算各公司的成長與趨勢指標 (索引為證券代號)
+      營收年增率 / 稅後淨利年增率 / EPS年增率: 最新一季年度累計數相對去年同期 (%)
+      單季營收年增率: 最新一季單季營收相對去年同季 (%)
+      毛利率趨勢 / 營業利益率趨勢: 單季利潤率的線性趨勢 (每季百分點)
+    """
+    income = load_statement_history("綜合損益", recent_periods(periods), history_dir)
+    if income.empty:
+        return pd.DataFrame()
+
+    latest = statement_panel(income, "營業收入").columns[-1]
+    metrics = pd.DataFrame({
+        "營收年增率": yoy_growth(statement_panel(income, "營業收入"))[latest],
+        "稅後淨利年增率": yoy_growth(statement_panel(income, "本期淨利"))[latest],
+        "EPS年增率": yoy_growth(statement_panel(income, "基本每股盈餘"))[latest],
+        "單季營收年增率": yoy_growth(quarterly_values(statement_panel(income, "營業收入")))[latest],
+        "毛利率趨勢": trend_slope(margin_panel(income, "營業毛利"), periods),
+        "營業利益率趨勢": trend_slope(margin_panel(income, "營業利益"), periods),
+    })
+    metrics.index.name = "證券代號"
+    return metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MOPS 財報歷史資料回補")
+    parser.add_argument("--periods", type=int, default=HISTORY_PERIODS, help="回補的季數")
+    parser.add_argument("--workers", type=int, default=HISTORY_MAX_WORKERS, help="同時抓取的季別數")
+    args = parser.parse_args()
+
+    utils.init()
+    update_statement_history(args.periods, max_workers=args.workers)
+    metrics = history_metrics(args.periods)
+    if not metrics.empty:
+        print(metrics.sort_values("營收年增率", ascending=False).head(20).round(2).to_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -4,16 +4,20 @@
 """
 
 import pandas as pd
-from datetime import datetime, timedelta, date
+from datetime import datetime, timedelta
 from io import StringIO
 from typing import Dict, List, Optional, Tuple
 import utils
+from mops_statements import MARKETS, REPORT_TYPE_MAP, get_latest_report_period, get_statements
 
 # 全域配置參數
 TWSE_DAILY_REPORT_URL = "https://www.twse.com.tw/rwd/zh/afterTrading/BWIBBU_d?response=json"
 TWSE_DAILY_EXCHANGE_URL = "https://www.twse.com.tw/rwd/zh/afterTrading/BFT41U?selectType=ALL&response=json"
 MOPS_CAPITAL_URL = "https://mopsfin.twse.com.tw/opendata/t187ap03_L.csv"
-MOPS_API_URL = "https://mops.twse.com.tw/mops/api/redirectToOld"
+MOPS_OTC_CAPITAL_URL = "https://mopsfin.twse.com.tw/opendata/t187ap03_O.csv"
+TPEX_PE_RATIO_URL = "https://www.tpex.org.tw/openapi/v1/tpex_mainboard_peratio_analysis"
+TPEX_DAILY_QUOTES_URL = "https://www.tpex.org.tw/openapi/v1/tpex_mainboard_daily_close_quotes"
+TPEX_DAILY_EXCHANGE_URL = "https://www.tpex.org.tw/openapi/v1/tpex_mainboard_afterhours_trading"
 TDCC_SHAREHOLDER_URL = "https://opendata.tdcc.com.tw/getOD.ashx?id=1-5"
 DIRECTOR_SHAREHOLDER_URL = "https://norway.twsthr.info/StockBoardTop.aspx"
 ROE_URL = "https://stock.wespai.com/p/10291"
@@ -37,15 +41,23 @@ COLUMN_RENAME_MAP = {
     "實收資本額": "資本額"
 }
 
-# 財務報表類型對應
-REPORT_TYPE_MAP = {
-    "綜合損益": "t163sb04",
-    "資產負債": "t163sb05",
-    "營益分析": "t163sb06"
+# 櫃買中心 OpenAPI 欄位對應 (對應到上市資料的欄位名稱)
+TPEX_FIELD_MAP = {
+    "SecuritiesCompanyCode": "證券代號",
+    "CompanyName": "證券名稱",
+    "Close": "收盤價",
+    "YieldRatio": "殖利率(%)",
+    "PriceEarningRatio": "本益比",
+    "PriceBookRatio": "股價淨值比",
+    "TradePrice": "成交價",
 }
 
-# 添加全域快取變數
-_report_period_cache = None
+# 各 OpenAPI 需要的欄位，回應中缺少時印出警告 (可能是欄位名稱改變，對應的欄位會是空的)
+TPEX_REQUIRED_FIELDS = {
+    TPEX_PE_RATIO_URL: ["SecuritiesCompanyCode", "YieldRatio", "PriceEarningRatio", "PriceBookRatio"],
+    TPEX_DAILY_QUOTES_URL: ["SecuritiesCompanyCode", "Close"],
+    TPEX_DAILY_EXCHANGE_URL: ["SecuritiesCompanyCode", "TradePrice"],
+}
 
 
 def apply_filters(df, filters):
@@ -75,18 +87,73 @@ def filter_stock_code(df, column="證券代號"):
     return df
 
 
-def get_daily_exchange_report(apply_filter=False):
-    """獲取每日交易報告"""
+def get_tpex_openapi(url):
+    """
+    讀取櫃買中心 OpenAPI (JSON 陣列)，欄位依 TPEX_FIELD_MAP 換成上市資料的名稱
+    回應缺少 TPEX_REQUIRED_FIELDS 中的欄位時印出警告
+    """
+    response = utils.fetch_data(url)
+    df = pd.DataFrame(response.json())
+    missing = [field for field in TPEX_REQUIRED_FIELDS.get(url, []) if field not in df.columns]
+    if missing and not df.empty:
+        print(f"櫃買中心 OpenAPI 缺少欄位 {missing} ({url})，回應中的欄位: {list(df.columns)}")
+    return df.rename(columns=TPEX_FIELD_MAP)
+
+
+def get_twse_daily_report():
+    """上市: 證交所每日本益比、殖利率及股價淨值比"""
+    response = utils.fetch_data(TWSE_DAILY_REPORT_URL)
+    data = response.json().get("data", [])
+    return pd.DataFrame(data, columns=DAILY_REPORT_COLUMNS)
+
+
+def get_tpex_daily_report():
+    """上櫃: 櫃買中心本益比分析，收盤價另由每日收盤行情補上"""
+    results = utils.fetch_concurrently({
+        "本益比": lambda: get_tpex_openapi(TPEX_PE_RATIO_URL),
+        "收盤": lambda: get_tpex_openapi(TPEX_DAILY_QUOTES_URL),
+    })
+    df = results["本益比"].drop(columns=["收盤價"], errors="ignore")
+    quotes = results["收盤"]
+    if not quotes.empty:
+        df = df.merge(quotes[["證券代號", "收盤價"]], on="證券代號", how="left")
+    return df.reindex(columns=DAILY_REPORT_COLUMNS)
+
+
+DAILY_REPORT_FETCHERS = {"上市": get_twse_daily_report, "上櫃": get_tpex_daily_report}
+
+
+def fetch_markets(fetchers, markets, description):
+    """
+    同時抓取各市場的資料並合併，單一市場失敗時只略過該市場
+    fetchers: {市場別: 無參數函式}
+    """
+    def safe(market):
+        def run():
+            try:
+                return fetchers[market]()
+            except Exception as e:
+                print(f"獲取{market}{description}失敗: {e}")
+                return pd.DataFrame()
+        return run
+
+    results = utils.fetch_concurrently({market: safe(market) for market in markets})
+    frames = [df for df in results.values() if not df.empty]
+    for market, df in results.items():
+        print(f"{market}{description}: {len(df)} 筆")
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+def get_daily_exchange_report(apply_filter=False, markets=tuple(MARKETS)):
+    """獲取每日交易報告 (上市、上櫃同時抓取)"""
     try:
         print("正在獲取每日交易報告...")
-        response = utils.fetch_data(TWSE_DAILY_REPORT_URL)
-        data = response.json().get("data", [])
+        df = fetch_markets(DAILY_REPORT_FETCHERS, markets, "每日交易報告")
 
-        if not data:
+        if df.empty:
             print("每日交易報告無資料")
             return pd.DataFrame()
 
-        df = pd.DataFrame(data, columns=DAILY_REPORT_COLUMNS)
         df = df.rename(columns=COLUMN_RENAME_MAP)
 
         if apply_filter:
@@ -112,13 +179,27 @@ def get_daily_exchange_report(apply_filter=False):
         return pd.DataFrame()
 
 
-def get_stock_capital(apply_filter=False):
-    """獲取股本資料"""
+def read_capital_csv(url):
+    """讀取 MOPS 公司基本資料 CSV (上櫃檔案的上櫃日期統一為上市日期)"""
+    response = utils.fetch_data(url)
+    response.encoding = "utf-8"
+    df = pd.read_csv(StringIO(response.text))
+    return df.rename(columns={"上櫃日期": "上市日期"})
+
+
+CAPITAL_FETCHERS = {
+    "上市": lambda: read_capital_csv(MOPS_CAPITAL_URL),
+    "上櫃": lambda: read_capital_csv(MOPS_OTC_CAPITAL_URL),
+}
+
+
+def get_stock_capital(apply_filter=False, markets=tuple(MARKETS)):
+    """獲取股本資料 (上市、上櫃同時抓取)"""
     try:
         print("正在獲取股本資料...")
-        response = utils.fetch_data(MOPS_CAPITAL_URL)
-        response.encoding = "utf-8"
-        df = pd.read_csv(StringIO(response.text))
+        df = fetch_markets(CAPITAL_FETCHERS, markets, "股本資料")
+        if df.empty:
+            return df
 
         if apply_filter:
             cutoff_date = datetime.today() - timedelta(days=LISTING_YEARS_THRESHOLD * 365)
@@ -145,14 +226,27 @@ def get_stock_capital(apply_filter=False):
         return pd.DataFrame()
 
 
-def get_daily_exchange():
-    """獲取盤後定價交易資料"""
+def get_twse_daily_exchange():
+    """上市: 證交所盤後定價交易"""
+    response = utils.fetch_data(TWSE_DAILY_EXCHANGE_URL)
+    data = response.json()
+    return pd.DataFrame(data["data"], columns=data["fields"])
+
+
+DAILY_EXCHANGE_FETCHERS = {
+    "上市": get_twse_daily_exchange,
+    "上櫃": lambda: get_tpex_openapi(TPEX_DAILY_EXCHANGE_URL),
+}
+
+
+def get_daily_exchange(markets=tuple(MARKETS)):
+    """獲取盤後定價交易資料 (上市、上櫃同時抓取)"""
     try:
         print("正在獲取盤後定價交易資料...")
-        response = utils.fetch_data(TWSE_DAILY_EXCHANGE_URL)
-        data = response.json()
+        df = fetch_markets(DAILY_EXCHANGE_FETCHERS, markets, "盤後交易資料")
+        if df.empty:
+            return df
 
-        df = pd.DataFrame(data["data"], columns=data["fields"])
         result = df[["證券代號", "成交價"]]
 
         print(f"成功獲取 {len(result)} 筆盤後交易資料")
@@ -163,100 +257,20 @@ def get_daily_exchange():
         return pd.DataFrame()
 
 
-def get_latest_report_period(today=None):
-    """計算最新財報期間（添加快取機制）"""
-    global _report_period_cache
-
-    if today is None:
-        today = date.today()
-
-    # 如果是同一天且已有快取，直接返回
-    if _report_period_cache and _report_period_cache[0] == today:
-        return _report_period_cache[1]
-
-    year = today.year
-    roc_year = year - 1911
-
-    # 財報公布截止日
-    deadlines = {
-        1: date(year, 5, 15),   # Q1
-        2: date(year, 8, 14),   # Q2
-        3: date(year, 11, 14),  # Q3
-        4: date(year, 3, 31)    # Q4 (前一年)
-    }
-
-    if today <= deadlines[4]:
-        return roc_year - 2, 3
-    elif today <= deadlines[1]:
-        return roc_year - 1, 4
-    elif today <= deadlines[2]:
-        return roc_year, 1
-    elif today <= deadlines[3]:
-        return roc_year, 2
-    else:
-        return roc_year, 3
-
-
-def get_financial_statement(report_type="綜合損益", year=None, season=None):
-    """獲取財務報表"""
+def get_financial_statement(report_type="綜合損益", year=None, season=None, markets=tuple(MARKETS)):
+    """
+    獲取財務報表 (上市、上櫃同時查詢後合併)
+    頁面中各產業格式的表格都會解析並對應到統一欄位 (見 mops_statements.STATEMENT_SCHEMA)
+    """
     try:
         if year is None or season is None:
             year, season = get_latest_report_period()
 
-        if not (1 <= season <= 4):
-            raise ValueError("季度必須是 1, 2, 3, 4 之一")
-
-        ajax_code = REPORT_TYPE_MAP.get(report_type)
-        if not ajax_code:
+        if report_type not in REPORT_TYPE_MAP:
             print(f"不支援的報表類型: {report_type}")
             return pd.DataFrame()
 
-        # 構建請求參數
-        payload = {
-            "apiName": f"ajax_{ajax_code}",
-            "parameters": {
-                "year": str(year),
-                "season": str(season).zfill(2),
-                "TYPEK": "sii",
-                "isQuery": "Y",
-                "firstin": 1,
-                "off": 1,
-                "step": 1,
-                "encodeURIComponent": 1,
-            },
-        }
-
-        # 發送請求
-        response = utils.post_data(MOPS_API_URL, json=payload)
-        api_response = response.json()
-        final_url = api_response.get("result", {}).get("url")
-
-        if not final_url:
-            print("無法獲取財務報表 URL")
-            return pd.DataFrame()
-
-        # 獲取最終資料
-        final_response = utils.fetch_data(final_url)
-
-        if "查詢無資料" in final_response.text:
-            print(f"查詢無資料：民國 {year} 年第 {season} 季 {report_type}")
-            return pd.DataFrame()
-
-        # 解析 HTML 表格
-        df_list = pd.read_html(StringIO(final_response.text))
-        if not df_list:
-            print("找不到任何表格")
-            return pd.DataFrame()
-
-        df = df_list[0]
-        df = df[df.iloc[:, 0] != df.columns[0]]  # 移除重複標頭
-        df = df.rename(columns={"公司代號": "證券代號"})
-
-        # 轉換數值欄位
-        for col in df.columns[2:]:
-            df[col] = pd.to_numeric(df[col], errors="coerce")
-
-        return df.reset_index(drop=True)
+        return get_statements(year, season, (report_type,), markets)[report_type]
 
     except Exception as e:
         print(f"獲取財務報表失敗: {e}")
@@ -272,13 +286,8 @@ def get_operating_margin():
         if df.empty:
             return df
 
-        df.columns = [
-            "證券代號", "公司名稱", "營業收入", "毛利率",
-            "營業利益率", "稅前純益率", "稅後純益率"
-        ]
-
-        df["營業收入"] = (pd.to_numeric(df["營業收入"], errors='coerce') / 100).round(4)
-        result = df.drop(columns=["公司名稱"])
+        result = df[["證券代號", "營業收入", "毛利率", "營業利益率", "稅前純益率", "稅後純益率"]].copy()
+        result["營業收入"] = (result["營業收入"] / 100).round(4)
 
         print(f"成功獲取 {len(result)} 筆營業利益率資料")
         return result
@@ -427,14 +436,41 @@ def get_all_shareholder_distribution():
     ]
 
 
-def get_basic_stock_info(apply_filter=False):
-    """獲取基本股票資訊"""
+# 額外資料來源: (名稱, 取得函式, 成本)
+# 依成本由低到高抓取，每個來源合併後立即套用欄位已到齊的篩選條件，
+# 沒有候選股票時不再抓取後面的來源 (董監持股需開啟瀏覽器，排在最後)；輸出欄位仍依此處順序排列
+ADDITIONAL_SOURCES = [
+    ("營業利益率", get_operating_margin, 1),               # MOPS 上市、上櫃各一次請求 (同時進行)
+    ("盤後交易", get_daily_exchange, 1),                   # TWSE、TPEx 各一次請求 (同時進行)
+    ("董監持股", get_director_shareholders, 3),            # Playwright 瀏覽器
+    ("股東分布", get_all_shareholder_distribution, 2),     # TDCC 全市場 CSV
+]
+
+
+def apply_ready_screens(df, screens):
+    """套用欄位已存在的篩選條件，回傳 (篩選後資料, 尚未套用的條件)"""
+    ready = {column: condition for column, condition in screens.items() if column in df.columns}
+    if ready:
+        df = apply_filters(df, ready)
+    return df, {column: condition for column, condition in screens.items() if column not in ready}
+
+
+def get_basic_stock_info(apply_filter=False, screens=None):
+    """
+    獲取基本股票資訊
+    screens: 額外的篩選條件 {欄位: {'min': ..., 'max': ...} 或 函式}，格式同 apply_filters，
+             在該欄位的資料來源合併後立即套用，後面的來源只對留下的股票合併
+    """
     try:
         print("開始分析股票資料...")
 
-        # 獲取基礎資料
-        exchange_report = get_daily_exchange_report(apply_filter)
-        capital = get_stock_capital(apply_filter)
+        # 獲取基礎資料 (兩項來源互不相依，同時抓取)
+        base = utils.fetch_concurrently({
+            "每日交易報告": lambda: get_daily_exchange_report(apply_filter),
+            "股本資料": lambda: get_stock_capital(apply_filter),
+        })
+        exchange_report = base["每日交易報告"]
+        capital = base["股本資料"]
 
         if exchange_report.empty or capital.empty:
             print("基礎資料獲取失敗")
@@ -448,24 +484,27 @@ def get_basic_stock_info(apply_filter=False):
         merged_df = pd.merge(capital, exchange_report, on="證券代號", how="inner")
         print(f"基礎資料合併完成，共 {len(merged_df)} 筆")
 
+        merged_df, pending_screens = apply_ready_screens(merged_df, screens or {})
+        stage_counts = [("基礎資料", len(merged_df))]
+        base_columns = list(merged_df.columns)
+        source_columns = {}
+
         # 如果需要篩選，則加入額外資料
         if apply_filter:
-            # 定義額外資料來源
-            additional_sources = [
-                ("營業利益率", get_operating_margin),
-                ("盤後交易", get_daily_exchange),
-                ("董監持股", get_director_shareholders),
-                ("股東分布", get_all_shareholder_distribution)
-            ]
+            for name, fetch_func, _ in sorted(ADDITIONAL_SOURCES, key=lambda source: source[2]):
+                if merged_df.empty:
+                    print(f"已無候選股票，略過: {name}")
+                    continue
 
-            for name, fetch_func in additional_sources:
                 try:
                     print(f"正在處理: {name}")
                     additional_df = fetch_func()
 
                     if not additional_df.empty:
                         additional_df = utils.ensure_string_type(additional_df, "證券代號")
+                        before = set(merged_df.columns)
                         merged_df = pd.merge(merged_df, additional_df, on="證券代號", how="left")
+                        source_columns[name] = [col for col in merged_df.columns if col not in before]
                         print(f"{name} 資料合併完成")
                     else:
                         print(f"{name} 無可用資料")
@@ -473,10 +512,20 @@ def get_basic_stock_info(apply_filter=False):
                 except Exception as e:
                     print(f"處理 {name} 時發生錯誤: {e}")
 
-        # 重新排列欄位
+                merged_df, pending_screens = apply_ready_screens(merged_df, pending_screens)
+                stage_counts.append((name, len(merged_df)))
+
+            print("各階段剩餘筆數: " + " -> ".join(f"{name} {count}" for name, count in stage_counts))
+
+        # 重新排列欄位 (額外資料依 ADDITIONAL_SOURCES 順序)
         if not merged_df.empty:
+            ordered = base_columns + [
+                col for name, _, _ in ADDITIONAL_SOURCES for col in source_columns.get(name, [])
+            ]
+            ordered = [col for col in ordered if col in merged_df.columns]
+            ordered += [col for col in merged_df.columns if col not in ordered]
             cols = ["證券代號", "證券名稱"] + [
-                col for col in merged_df.columns
+                col for col in ordered
                 if col not in ["證券代號", "證券名稱"]
             ]
             merged_df = merged_df[cols]
@@ -1,6 +1,14 @@
 import utils
 from decimal import Decimal, ROUND_HALF_UP
+import numpy as np
 import pandas as pd
+from mops_statements import get_latest_report_period, get_statements
+
+# get_fin_detail_batch 的輸出欄位 (與 get_fin_detail 相同，現金流量與財報評分為 goodinfo 獨有，MOPS 彙總表沒有)
+FIN_DETAIL_COLUMNS = [
+    "毛利率", "營業利益率", "ROE", "稅前淨利率", "稅後淨利率", "總資產週轉率",
+    "本業收益", "本業收益比率", "每股營業現金流量", "每股自由現金流量", "財報評分", "EPS",
+]
 
 """
 1. 營業收入累計年增率 > 0 %
@@ -206,6 +214,96 @@ def get_fin_detail(stockId):
     
     return pd.DataFrame([financial_metrics])
 
+def divide_half_up(numerator, denominator, scale):
+    """
+    整數除法並四捨五入 (ROUND_HALF_UP，.5 遠離 0)，回傳 numerator * scale / denominator 的 int64 結果
+    與 Decimal(numerator / denominator * scale).quantize(Decimal("1"), ROUND_HALF_UP) 相同；分母為 0 時為 0
+    """
+    numerator = numerator * scale
+    sign = np.sign(numerator) * np.sign(denominator)
+    safe = np.where(denominator == 0, 1, np.abs(denominator))
+    quotient, remainder = np.divmod(np.abs(numerator), safe)
+    quotient = quotient + (2 * remainder >= safe)
+    return np.where(denominator == 0, 0, sign * quotient)
+
+
+def to_scaled_int(series):
+    """金額欄位 (仟元整數) 轉成 int64 陣列與是否有值的遮罩"""
+    values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+    valid = ~np.isnan(values)
+    return np.where(valid, values, 0).astype(np.int64), valid
+
+
+def compute_fin_detail(income, balance):
+    """
+    以 MOPS 綜合損益與資產負債彙總表 (見 mops_statements.STATEMENT_SCHEMA) 一次計算所有公司的財務比率
+    公式與 get_fin_detail 相同，以 int64 整數運算後四捨五入到小數 2 位 (ROUND_HALF_UP)，結果與 Decimal 計算一致
+    科目缺值 (如金融業沒有營業成本) 的比率為 NaN
+    """
+    df = income.drop_duplicates("證券代號").merge(
+        balance[["證券代號", "資產總額", "權益總額"]].drop_duplicates("證券代號"), on="證券代號", how="left"
+    )
+
+    revenue, has_revenue = to_scaled_int(df["營業收入"])
+    costs, has_costs = to_scaled_int(df["營業成本"])
+    expenses, has_expenses = to_scaled_int(df["營業費用"])
+    non_operating, has_non_operating = to_scaled_int(df["營業外收入及支出"])
+    tax, has_tax = to_scaled_int(df["所得稅費用"])
+    assets, has_assets = to_scaled_int(df["資產總額"])
+    equity, has_equity = to_scaled_int(df["權益總額"])
+
+    gross_profit = revenue - costs
+    operating_profit = gross_profit - expenses
+    pre_tax = operating_profit + non_operating
+    post_tax = pre_tax - tax
+
+    has_gross = has_revenue & has_costs
+    has_operating = has_gross & has_expenses
+    has_pre_tax = has_operating & has_non_operating
+    has_post_tax = has_pre_tax & has_tax
+
+    def percent(numerator, denominator, valid):
+        """百分比 (小數 2 位)"""
+        return np.where(valid, divide_half_up(numerator, denominator, 10000) / 100, np.nan)
+
+    core_ratio = percent(operating_profit, pre_tax, has_pre_tax)
+    result = pd.DataFrame({
+        "證券代號": df["證券代號"].to_numpy(),
+        "公司名稱": df["公司名稱"].to_numpy(),
+        "毛利率": percent(gross_profit, revenue, has_gross),
+        "營業利益率": percent(operating_profit, revenue, has_operating),
+        "ROE": percent(post_tax, equity, has_post_tax & has_equity),
+        "稅前淨利率": percent(pre_tax, revenue, has_pre_tax),
+        "稅後淨利率": percent(post_tax, revenue, has_post_tax),
+        "總資產週轉率": np.where(has_revenue & has_assets, divide_half_up(revenue, assets, 100) / 100, np.nan),
+        "本業收益": core_ratio,
+        "本業收益比率": core_ratio,
+        "每股營業現金流量": np.nan,
+        "每股自由現金流量": np.nan,
+        "財報評分": np.nan,
+        "EPS": df["基本每股盈餘"].to_numpy(dtype=np.float64, na_value=np.nan),
+    })
+    return result
+
+
+def get_fin_detail_batch(year=None, season=None):
+    """
+    全市場 (上市、上櫃) 財務比率，一次抓取 MOPS 彙總報表後整批計算，回傳每家公司一列
+    """
+    if year is None or season is None:
+        year, season = get_latest_report_period()
+
+    statements = get_statements(year, season, ("綜合損益", "資產負債"))
+    income, balance = statements["綜合損益"], statements["資產負債"]
+    if income.empty or balance.empty:
+        print(f"無法取得民國 {year} 年第 {season} 季的彙總報表")
+        return pd.DataFrame(columns=["證券代號", "公司名稱"] + FIN_DETAIL_COLUMNS)
+
+    result = compute_fin_detail(income, balance)
+    print(f"成功計算 {len(result)} 家公司的財務比率 (民國 {year} 年第 {season} 季)")
+    return result
+
+
 """
 盈餘再投資比率
 
@@ -1,8 +1,15 @@
+import numpy as np
 import pandas as pd
 import re
 import random
 import time
 import utils
+from mops_statements import report_deadline
+from price_store import load_price_store
+from statement_history import (
+    STATEMENT_HISTORY_DIR, load_statement_history, quarterly_values, recent_periods, statement_panel,
+    trailing_four_quarters,
+)
 """
 抓取本益比
 取得現今EPS、本益比、近五年六個級距本益比
@@ -12,6 +19,17 @@ import utils
 2. 小於近五年最小級距本益比
 """
 
+PE_BAND_COUNT = 6
+PE_BAND_HEADERS = [
+    f"本益比-級距{i}{kind}" for i in range(1, PE_BAND_COUNT + 1) for kind in ("倍數", "價格")
+]
+
+# 本地本益比河流圖 (get_pe_bands) 設定
+PE_BAND_YEARS = 5                                # 計算級距的期間 (年)
+PE_BAND_PERCENTILES = (0, 20, 40, 60, 80, 100)   # 預設以週本益比的百分位數作為級距 (級距1 = 期間最低本益比)
+PE_BAND_MIN_WEEKS = 26                           # 有本益比的週數不足時不計算級距
+PE_BAND_START_WEEKS = 4                          # 期間開頭幾週內需已有股價與 EPS，否則視為歷史不足 PE_BAND_YEARS 年
+
 
 def get_pe(stockId):
     url = f"https://goodinfo.tw/tw/ShowK_ChartFlow.asp?RPT_CAT=PER&STOCK_ID={stockId}&CHT_CAT=WEEK"
@@ -45,20 +63,7 @@ def get_pe(stockId):
 
     # 轉換成dataframe
     data = []
-    headers = [
-        "本益比-級距1倍數",
-        "本益比-級距1價格",
-        "本益比-級距2倍數",
-        "本益比-級距2價格",
-        "本益比-級距3倍數",
-        "本益比-級距3價格",
-        "本益比-級距4倍數",
-        "本益比-級距4價格",
-        "本益比-級距5倍數",
-        "本益比-級距5價格",
-        "本益比-級距6倍數",
-        "本益比-級距6價格",
-    ]
+    headers = PE_BAND_HEADERS
     for entry in dictionaries:
         #print(entry)
         data.append(entry["key"])
@@ -69,6 +74,124 @@ def get_pe(stockId):
     df = pd.DataFrame([data], columns=headers)
     return df
 
+
+def weekly_close(prices):
+    """PriceStore 的收盤價轉成週收盤 (每週最後一個有收盤價的交易日)，回傳 (週 × 股票) DataFrame"""
+    daily = pd.DataFrame(np.asarray(prices.close, dtype=np.float64).T, index=prices.dates, columns=prices.symbols)
+    return daily.resample("W-FRI").last()
+
+
+def trailing_eps_panel(years=PE_BAND_YEARS, history_dir=STATEMENT_HISTORY_DIR):
+    """
+    由財報歷史 (statement_history) 計算各季的近四季 EPS (證券代號 × (年度, 季別))
+    最新一季尚未申報的公司沿用前一季的近四季 EPS
+    """
+    # 多取 7 季: 換算單季需要同年度前幾季，近四季合計需要前三季
+    income = load_statement_history("綜合損益", recent_periods(years * 4 + 7), history_dir)
+    if income.empty:
+        return pd.DataFrame()
+    eps = trailing_four_quarters(quarterly_values(statement_panel(income, "基本每股盈餘")))
+    return eps.ffill(axis=1, limit=1)
+
+
+def align_eps_to_weeks(eps, weeks):
+    """
+    每週可用的近四季 EPS (週 × 證券代號)：以該週結束時已過公布截止日的最新一季為準，避免使用尚未公布的財報
+    """
+    deadlines = pd.DatetimeIndex([report_deadline(year, season) for year, season in eps.columns])
+    position = deadlines.searchsorted(weeks, side="right") - 1
+
+    values = eps.to_numpy(dtype=np.float64)
+    aligned = values[:, np.maximum(position, 0)]
+    aligned[:, position < 0] = np.nan
+    return pd.DataFrame(aligned.T, index=weeks, columns=eps.index)
+
+
+def history_covered(close, eps, weeks, start_weeks=PE_BAND_START_WEEKS):
+    """
+    每檔股票的股價與 EPS 是否涵蓋整個 weeks 週的期間 (期間開頭 start_weeks 週內已有數值)
+    週收盤少於 weeks 週 (股價矩陣的期間不足) 時全部為 False
+    """
+    if len(close) < weeks:
+        return np.zeros(close.shape[1], dtype=bool)
+    head = slice(0, start_weeks)
+    return (~np.isnan(close[head])).any(axis=0) & (~np.isnan(eps[head])).any(axis=0)
+
+
+def compute_pe_bands(close, eps, multiples=None, percentiles=PE_BAND_PERCENTILES,
+                     weeks=PE_BAND_YEARS * 52, min_weeks=PE_BAND_MIN_WEEKS):
+    """
+    一次計算所有股票的本益比級距
+
+    參數:
+      close: 週收盤 (週 × 證券代號)
+      eps: 與 close 對齊的近四季 EPS (週 × 證券代號)
+      multiples: 固定的級距倍數 (所有股票相同)；None 時以每檔股票近 weeks 週本益比的 percentiles 百分位數為級距，
+                 股價或 EPS 未涵蓋整個 weeks 週 (見 history_covered) 的股票級距為 NaN
+    回傳:
+      DataFrame (證券代號 + PE_BAND_HEADERS)，級距價格 = 級距倍數 × 最新近四季 EPS (EPS <= 0 時為 NaN)
+    """
+    close = close.iloc[-weeks:]
+    eps = eps.reindex_like(close).to_numpy(dtype=np.float64)
+    prices = close.to_numpy(dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pe = np.where(eps > 0, prices / eps, np.nan).T
+
+    n = pe.shape[0]
+    if multiples is not None:
+        bands = np.tile(np.asarray(multiples, dtype=np.float64), (n, 1))
+    else:
+        bands = np.full((n, len(percentiles)), np.nan)
+        enough = history_covered(prices, eps, weeks) & ((~np.isnan(pe)).sum(axis=1) >= min_weeks)
+        if enough.any():
+            bands[enough] = np.nanpercentile(pe[enough], percentiles, axis=1).T
+    bands = np.round(bands, 1)
+
+    latest_eps = eps[-1] if len(eps) else np.full(n, np.nan)
+    band_prices = np.round(bands * np.where(latest_eps > 0, latest_eps, np.nan)[:, None], 2)
+
+    data = {"證券代號": close.columns.to_numpy()}
+    for i in range(bands.shape[1]):
+        data[f"本益比-級距{i + 1}倍數"] = bands[:, i]
+        data[f"本益比-級距{i + 1}價格"] = band_prices[:, i]
+    return pd.DataFrame(data)
+
+
+def get_pe_bands(prices=None, multiples=None, percentiles=PE_BAND_PERCENTILES, years=PE_BAND_YEARS,
+                 history_dir=STATEMENT_HISTORY_DIR):
+    """
+    以本地股價 (PriceStore) 與財報歷史計算全部股票的週本益比河流圖級距，欄位與 get_pe 相同 (另含證券代號)
+    prices 未指定時讀取全市場股價矩陣 (Data/PriceStore/exchange，見 market_prices.py)；
+    財報歷史需先回補 years × 4 + 7 季 (預設為 statement_history.py --periods 27)
+    股價或財報歷史不足 years 年的股票級距為 NaN (choose_stock 對這些股票改用 get_pe 抓 goodinfo)
+    """
+    if prices is None:
+        prices = load_price_store("exchange")
+        if prices is None:
+            return pd.DataFrame(columns=["證券代號"] + PE_BAND_HEADERS)
+
+    eps = trailing_eps_panel(years, history_dir)
+    if eps.empty:
+        print("找不到財報歷史，請先執行 statement_history.py 回補")
+        return pd.DataFrame(columns=["證券代號"] + PE_BAND_HEADERS)
+
+    # 股價矩陣的代號為 yfinance 代號 (2330.TW)，財報以證券代號 (2330) 對應
+    close = weekly_close(prices)
+    close.columns = [symbol.split(".")[0] for symbol in close.columns]
+    close = close.loc[:, ~close.columns.duplicated()]
+
+    weeks = years * 52
+    if len(close) < weeks:
+        print(f"股價矩陣只有 {len(close)} 週 (需要 {weeks} 週)，請以 market_prices.py --days {years * 261} 回補")
+    if eps.shape[1] < years * 4:
+        print(f"財報歷史只有 {eps.shape[1]} 季 (需要 {years * 4 + 7} 季)，請以 statement_history.py --periods {years * 4 + 7} 回補")
+
+    weekly_eps = align_eps_to_weeks(eps, close.index)
+    result = compute_pe_bands(close, weekly_eps, multiples, percentiles, weeks)
+    print(f"本益比級距: {result['本益比-級距1倍數'].notna().sum()}/{len(result)} 檔有 {years} 年的股價、財報與足夠的本益比資料")
+    return result
+
+
 # ------ 測試 ------
 
 #data = get_pe('2330')
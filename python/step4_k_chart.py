@@ -1,7 +1,17 @@
+import numpy as np
 import pandas as pd
 import random
 import time
 import utils
+from chip_history import CHIP_HISTORY_DAYS, CHIP_HISTORY_DIR, load_chip_panel
+from price_store import load_price_store, right_align
+
+# goodinfo K 線表格的欄位 (本地計算時對應的資料來源見 get_transactions)
+TRANSACTION_HEADERS = ['收盤', '張數', '外資  持股  (%)', '券資  比  (%)']
+SMA_PERIODS = [1, 5, 20, 60]
+
+# 籌碼欄位對應 chip_history 的欄位
+CHIP_SOURCES = {'外資  持股  (%)': '外資持股(%)', '券資  比  (%)': '券資比(%)'}
 
 '''
 url_root = 'https://goodinfo.tw/StockInfo/ShowK_Chart.asp'
@@ -16,6 +26,34 @@ cssSelector = '#divPriceDetail'
 df = Utils.PostDataFrameByCssSelector(url_root, payload, cssSelector)
 '''
 
+def transaction_column(header):
+    """輸出欄位名稱，例如 收盤(1ma / 5ma / 20ma / 60ma)"""
+    return header.replace(' ', '') + '(' +  'ma / '.join(map(str, SMA_PERIODS)) + 'ma)'
+
+
+def format_sma_entry(header, smas):
+    """
+    將各期均線 (已四捨五入到小數 2 位) 組成顯示字串並加上標記
+    收盤: 1ma 大於 5ma 與 20ma 為 👍，小於 60ma 為 👎；張數: 1ma > 5ma 3 倍為 🏆
+    """
+    entry = ' / '.join(str(sma).rjust(8) for sma in smas)
+
+    if header == '收盤':
+        prefixIcon = ''
+        if smas[0] > smas[1] and smas[0] > smas[2]:
+            prefixIcon = '👍'
+        elif smas[0] < smas[3]:
+            prefixIcon = '👎'
+        entry = prefixIcon + entry
+
+    # 成交量 > 5ma 3倍
+    if header == '張數':
+        if(smas[0] / smas[1] > 3.0):
+            entry = '🏆' + entry
+
+    return entry
+
+
 def get_transaction(stockId):
     url = f'https://goodinfo.tw/tw/ShowK_Chart.asp?STOCK_ID={stockId}&CHT_CAT2=DATE'
     cssSelector = '#divDetail'
@@ -30,55 +68,89 @@ def get_transaction(stockId):
     #pd.set_option('display.max_rows', df.shape[0]+1)
     #print(df)
 
-    headers = ['收盤', '張數', '外資  持股  (%)', '券資  比  (%)']
-    smaPeriods = [1, 5, 20, 60]
-
     dict = {}
-    for header in headers:
+    for header in TRANSACTION_HEADERS:
         try:
-            #print(header)
-            entry = ''
-            for period in smaPeriods:
-                #print(df[header])
+            smas = []
+            for period in SMA_PERIODS:
                 data = pd.to_numeric(df[header], errors='coerce').dropna(how='any',axis=0).head(period)
-                #print(data)
-                sma = round(data.mean(), 2)
-                #print(sma)
-                entry += ('' if entry == '' else ' / ') + str(sma).rjust(8)
-            
-            #print(header.replace(' ', ''))
-            #print(entry)
-            
-            if header == '收盤':
-                data = [x.strip() for x in entry.split('/')]
-                prefixIcon = ''
-                if float(data[0]) > float(data[1]) and float(data[0]) > float(data[2]):
-                    prefixIcon = '👍' 
-                elif float(data[0]) < float(data[3]):
-                    prefixIcon = '👎'
-                entry = prefixIcon + entry
-
-            # 成交量 > 5ma 3倍
-            if header == '張數':
-                data = [x.strip() for x in entry.split('/')]
-                if(float(data[0]) / float(data[1]) > 3.0):
-                    entry = '🏆' + entry
-                    
-
-            dict.update({header.replace(' ', '') + '(' +  'ma / '.join(map(str, smaPeriods)) + 'ma)': str(entry)})
+                smas.append(float(round(data.mean(), 2)))
+
+            dict.update({transaction_column(header): format_sma_entry(header, smas)})
         except:
-            dict.update({header.replace(' ', '') + '(' +  'ma / '.join(map(str, smaPeriods)) + 'ma)': ''})
+            dict.update({transaction_column(header): ''})
     #print(dict)
     result = pd.DataFrame([dict])
     return result
-        #print(row)
-        #tempDf = pd.DataFrame({header.replace(' ', ''): row})
-        #print(tempDf)
-        #finalDf = pd.concat([finalDf, tempDf], axis=1)
-    #print(finalDf)
-    #return finalDf
 
 
+def tail_means(values, periods=SMA_PERIODS):
+    """
+    每列最近 period 個有值數值的平均 (有值的個數不足 period 時以現有的平均，與 head(period).mean() 相同)
+    以累加和一次計算所有期數，回傳 (列 × 期數) 陣列，完全沒有值時為 NaN
+    """
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    aligned, = right_align(valid, max(periods), values)
+    counts = np.minimum(valid.sum(axis=1), max(periods))
+    # 由最新往前累加: totals[:, k] 為最近 k + 1 個數值的合計
+    totals = np.cumsum(np.nan_to_num(aligned[:, ::-1]), axis=1)
+
+    means = np.full((len(aligned), len(periods)), np.nan)
+    for i, period in enumerate(periods):
+        n = np.minimum(counts, period)
+        has = n > 0
+        means[has, i] = totals[has, n[has] - 1] / n[has]
+    return means
+
+
+def get_transactions(symbols=None, prices=None, chip_days=CHIP_HISTORY_DAYS, history_dir=CHIP_HISTORY_DIR):
+    """
+    以本地資料一次計算所有股票的均線與標記，欄位與 get_transaction 相同 (另含證券代號)
+      收盤 / 張數: 全市場股價矩陣 (Data/PriceStore/exchange，成交量換算成張)
+      外資持股 / 券資比: 籌碼歷史 (chip_history，需先以 update_chip_history 回補)
+    symbols: 證券代號清單，預設為股價矩陣中的所有股票；沒有資料的欄位為空字串
+    """
+    if prices is None:
+        prices = load_price_store("exchange")
+        if prices is None:
+            return pd.DataFrame(columns=['證券代號'] + [transaction_column(h) for h in TRANSACTION_HEADERS])
+
+    # 股價矩陣的代號為 yfinance 代號 (2330.TW)，以證券代號對應
+    codes = pd.Index([symbol.split('.')[0] for symbol in prices.symbols])
+    if symbols is None:
+        symbols = list(dict.fromkeys(codes))
+    symbols = pd.Index(symbols)
+
+    # 各欄位的資料來源: (股票 × 日期) 陣列與列對應的證券代號
+    tail, _ = prices.tail(max(SMA_PERIODS), fields=('close', 'volume'))
+    sources = {
+        '收盤': (tail['close'], codes),
+        '張數': (np.round(tail['volume'] / 1000), codes),
+    }
+    for header, column in CHIP_SOURCES.items():
+        panel = load_chip_panel(column, chip_days, history_dir)
+        sources[header] = (panel.T.to_numpy(dtype=np.float64), panel.columns)
+
+    result = {'證券代號': symbols.to_numpy()}
+    for header in TRANSACTION_HEADERS:
+        values, index = sources[header]
+        means = np.round(tail_means(values), 2)
+        entries = []
+        for position in index.get_indexer(symbols):
+            if position < 0 or np.isnan(means[position]).all():
+                entries.append('')
+                continue
+            try:
+                entries.append(format_sma_entry(header, [float(sma) for sma in means[position]]))
+            except ZeroDivisionError:
+                entries.append('')
+        result[transaction_column(header)] = entries
+
+    df = pd.DataFrame(result)
+    print(f"均線指標: {len(df)} 檔")
+    return df
+
 
 # ------ 測試 ------
 #df = get_transaction('2330')
@@ -1,11 +1,20 @@
 from io import StringIO
 from bs4 import BeautifulSoup
+import numpy as np
 import pandas as pd
 import random
 import time
 import os
 import pyuser_agent
 import requests
+from numpy.lib.stride_tricks import sliding_window_view
+
+from price_store import load_price_store
+
+# 本地計算「日成交張數創近期新高日數」
+VOLUME_NEW_HIGH_WINDOW = 250     # 往前比較的交易日上限 (約一年)
+VOLUME_STREAK_BASE = 20          # 連續創高天數的比較期間 (成交量為近 20 個交易日最高)
+VOLUME_RANKING_COLUMNS = ['代號', '成交張數', '創新高日數', '連續創高天數']
 
 def get_top_volume():    
     cssSelector = '#divStockList'
@@ -35,6 +44,64 @@ def get_top_volume():
     #sum_df[sum_df.ne(sum_df.columns).any(1)].to_csv(f'{Utils.GetRootPath()}\Data\Monthly\董監持股比例.csv',encoding='utf_8_sig')
 
 
+def days_since_higher(volume, counts, window=VOLUME_NEW_HIGH_WINDOW):
+    """
+    最新一日成交量超過前面連續幾個交易日 (往前遇到成交量大於等於當日的交易日為止，最多 window 日)
+    volume 為靠右對齊的 (股票 × window + 1) 成交量，counts 為每檔有效交易日數
+    """
+    today = volume[:, -1:]
+    # 由前一日往前排列，第一個成交量大於等於當日的位置即為連續超過的日數
+    higher = (volume[:, -2::-1] >= today)
+    days = np.where(higher.any(axis=1), higher.argmax(axis=1), higher.shape[1])
+    return np.minimum(days, np.maximum(counts - 1, 0))
+
+
+def new_high_streak(volume, counts, base=VOLUME_STREAK_BASE):
+    """最近連續幾個交易日的成交量皆為近 base 個交易日最高 (與 rolling(base).max() 比較後計算結尾的連續長度)"""
+    rolling_max = np.fmax.reduce(sliding_window_view(volume, base, axis=1), axis=2)
+    is_high = (volume[:, base - 1:] >= rolling_max) & (volume[:, base - 1:] > 0)
+    # 只計入交易日數足夠 base 日的位置
+    positions = np.arange(is_high.shape[1])[::-1]
+    is_high &= positions[None, :] < (counts - base + 1)[:, None]
+    broken = ~is_high[:, ::-1]
+    return np.where(broken.any(axis=1), broken.argmax(axis=1), is_high.shape[1])
+
+
+def get_volume_new_high_ranking(prices=None, window=VOLUME_NEW_HIGH_WINDOW, base=VOLUME_STREAK_BASE):
+    """
+    以全市場股價矩陣 (Data/PriceStore/exchange，見 market_prices.py) 計算全市場「日成交張數創近期新高日數」排行，取代 get_top_volume 的 goodinfo 爬蟲
+      創新高日數: 最新一日成交張數超過前面連續幾個交易日 (最多 window 日)
+      連續創高天數: 最近連續幾個交易日的成交張數皆為近 base 個交易日最高
+    只保留最新交易日有成交的四碼股票，依創新高日數、成交張數由大到小排序，並存成與 get_top_volume 相同的 CSV
+    """
+    if prices is None:
+        prices = load_price_store("exchange")
+        if prices is None:
+            return pd.DataFrame(columns=VOLUME_RANKING_COLUMNS)
+    if len(prices.dates) == 0:
+        return pd.DataFrame(columns=VOLUME_RANKING_COLUMNS)
+
+    tail, counts = prices.tail(max(window + 1, base), fields=('volume',))
+    volume = tail['volume']
+    df = pd.DataFrame({
+        '代號': [symbol.split('.')[0] for symbol in prices.symbols],
+        '成交張數': np.round(volume[:, -1] / 1000),
+        '創新高日數': days_since_higher(volume[:, -(window + 1):], counts, window),
+        '連續創高天數': new_high_streak(volume, counts, base),
+    })
+
+    # 最新交易日停牌或沒有成交的股票不列入
+    traded = ~np.isnan(np.asarray(prices.close[:, -1], dtype=np.float64)) & (df['成交張數'] > 0)
+    df = df[traded & (df['代號'].str.len() == 4)]
+    df = df.sort_values(['創新高日數', '成交張數'], ascending=False, kind='stable').reset_index(drop=True)
+
+    folder = os.path.join(GetRootPath(), 'Data', 'Daily')
+    os.makedirs(folder, exist_ok=True)
+    df.to_csv(os.path.join(folder, '日成交張數創近期新高日數.csv'), encoding='utf_8_sig')
+    print(f"成交張數創近期新高排行: {len(df)} 檔")
+    return df
+
+
 # ------ 共用的 function ------
 def GetDataFrameByCssSelector(url, css_selector):
     ua = pyuser_agent.UA()
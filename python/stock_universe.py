@@ -0,0 +1,113 @@
+"""
+全市場股票清單
+由證交所 ISIN 代碼公告 (上市、上櫃整批清單) 取出所有四碼普通股，
+產生 Stock_Filter.py 可直接使用的 yfinance 代號 (上市 .TW、上櫃 .TWO)
+無法連線時改用 twstock 內建的代碼表
+"""
+
+from io import StringIO
+import os
+
+import pandas as pd
+import twstock
+
+import utils
+
+ISIN_URLS = {
+    "上市": "https://isin.twse.com.tw/isin/C_public.jsp?strMode=2",
+    "上櫃": "https://isin.twse.com.tw/isin/C_public.jsp?strMode=4",
+}
+YAHOO_SUFFIX = {"上市": ".TW", "上櫃": ".TWO"}
+COMMON_STOCK_CFI = "ESVUFR"      # 普通股的 CFI 代碼
+STOCK_CODE_PATTERN = r"^\d{4}$"
+
+UNIVERSE_COLUMNS = ["證券代號", "證券名稱", "市場別", "產業別", "上市日", "代號"]
+
+# 當日清單快取位置
+UNIVERSE_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Data", "Universe")
+
+
+def parse_isin_table(html, market):
+    """解析 ISIN 公告頁面，只保留四碼普通股"""
+    table = pd.read_html(StringIO(html), header=0)[0]
+    table.columns = [str(c).strip() for c in table.columns]
+    table = table[table["CFICode"] == COMMON_STOCK_CFI]
+
+    # 代號與名稱以全形空白分隔，例如 "2330　台積電"
+    parts = table["有價證券代號及名稱"].astype(str).str.split("　", n=1, expand=True)
+    df = pd.DataFrame({
+        "證券代號": parts[0].str.strip(),
+        "證券名稱": parts[1].str.strip() if parts.shape[1] > 1 else "",
+        "市場別": market,
+        "產業別": table["產業別"].fillna("").astype(str).str.strip(),
+        "上市日": table["上市日"].astype(str).str.strip(),
+    })
+    return df[df["證券代號"].str.match(STOCK_CODE_PATTERN)]
+
+
+def fetch_isin_universe(markets=tuple(ISIN_URLS)):
+    """下載各市場的 ISIN 公告，回傳四碼普通股清單"""
+    frames = []
+    for market in markets:
+        print(f"正在獲取{market}股票清單...")
+        response = utils.fetch_data(ISIN_URLS[market])
+        response.encoding = "cp950"
+        frames.append(parse_isin_table(response.text, market))
+    return pd.concat(frames, ignore_index=True)
+
+
+def twstock_universe(markets=tuple(ISIN_URLS)):
+    """由 twstock 內建代碼表取出四碼普通股 (離線備援)"""
+    rows = [
+        {
+            "證券代號": code,
+            "證券名稱": info.name,
+            "市場別": info.market,
+            "產業別": info.group,
+            "上市日": info.start,
+        }
+        for code, info in twstock.codes.items()
+        if info.type == "股票" and info.market in markets and info.CFI == COMMON_STOCK_CFI
+    ]
+    df = pd.DataFrame(rows, columns=UNIVERSE_COLUMNS[:-1])
+    return df[df["證券代號"].str.match(STOCK_CODE_PATTERN)]
+
+
+def get_stock_universe(markets=tuple(ISIN_URLS), use_cache=True):
+    """
+    取得全市場四碼普通股清單 (欄位見 UNIVERSE_COLUMNS，代號欄為 yfinance 代號)
+    當日已下載過時直接讀取 Data/Universe 中的快取
+    """
+    cache_path = os.path.join(UNIVERSE_CACHE_DIR, f"universe_{pd.Timestamp.today():%Y%m%d}.csv")
+    if use_cache and os.path.exists(cache_path):
+        df = pd.read_csv(cache_path, dtype=str, keep_default_na=False)
+        df = df[df["市場別"].isin(markets)]
+        print(f"讀取股票清單快取: {len(df)} 檔")
+        return df.reset_index(drop=True)
+
+    try:
+        df = fetch_isin_universe(markets)
+    except Exception as e:
+        print(f"獲取 ISIN 股票清單失敗，改用 twstock 代碼表: {e}")
+        df = twstock_universe(markets)
+
+    df = df.drop_duplicates("證券代號").sort_values("證券代號").reset_index(drop=True)
+    df["代號"] = df["證券代號"] + df["市場別"].map(YAHOO_SUFFIX)
+
+    if use_cache and set(markets) == set(ISIN_URLS):
+        os.makedirs(UNIVERSE_CACHE_DIR, exist_ok=True)
+        df.to_csv(cache_path, index=False, encoding="utf-8")
+
+    counts = df["市場別"].value_counts()
+    print(f"全市場股票清單: {len(df)} 檔 ({', '.join(f'{m} {counts.get(m, 0)} 檔' for m in markets)})")
+    return df[UNIVERSE_COLUMNS]
+
+
+def get_universe_symbols(markets=tuple(ISIN_URLS)):
+    """回傳全市場四碼普通股的 yfinance 代號清單"""
+    return get_stock_universe(markets)["代號"].tolist()
+
+
+if __name__ == "__main__":
+    utils.init()
+    print(get_stock_universe().to_string(index=False, max_rows=30))
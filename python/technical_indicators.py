@@ -0,0 +1,172 @@
+"""
+技術指標
+以股價矩陣 (PriceStore) 一次計算所有股票的最新技術指標，只使用有收盤價的交易日 (停牌日略過)
+
+- RSI (14)、ATR (14): Wilder 平滑 (前 N 日平均為起始值，之後 1/N 權重的遞迴平均)
+- MACD (12, 26, 9): 指數移動平均 (第一個收盤價為起始值)
+- 布林通道 (20 日, 2 倍標準差，母體標準差)
+- 動能: 5/20/60/120/250 個交易日前至今的報酬率 (%)
+- 創新高 / 創新低天數: 最近 20 個交易日中，收盤價為近 250 個交易日最高 (最低) 的天數
+
+遞迴平均與 Step10_KD 相同，以 exponential_filter 對 (股票 × 交易日) 矩陣做線性濾波，不逐檔迴圈
+"""
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from Step10_KD import exponential_filter
+from price_store import compact_rows
+
+RSI_PERIOD = 14
+ATR_PERIOD = 14
+MACD_FAST, MACD_SLOW, MACD_SIGNAL = 12, 26, 9
+BOLLINGER_PERIOD = 20
+BOLLINGER_WIDTH = 2
+MOMENTUM_HORIZONS = (5, 20, 60, 120, 250)
+NEW_HIGH_WINDOW = 250        # 創新高 / 創新低的比較期間
+NEW_HIGH_LOOKBACK = 20       # 計算創新高 / 創新低天數的最近交易日數
+
+TECHNICAL_FIELDS = [
+    'rsi', 'macd', 'macd_signal', 'macd_hist', 'boll_pctb', 'boll_width', 'atr', 'atr_pct',
+    *[f'mom_{horizon}' for horizon in MOMENTUM_HORIZONS], 'new_high_days', 'new_low_days',
+]
+
+
+def last_valid(values, counts, offset=0):
+    """左對齊序列中每列倒數第 offset + 1 個有值的數值 (個數不足時為 NaN)"""
+    position = counts - 1 - offset
+    rows = np.arange(len(values))
+    result = values[rows, np.maximum(position, 0)] if values.shape[1] else np.full(len(values), np.nan)
+    return np.where(position >= 0, result, np.nan)
+
+
+def ema(values, period):
+    """指數移動平均 (權重 2 / (period + 1)，以第一個數值為起始值)"""
+    filled = np.nan_to_num(values)
+    return exponential_filter(filled, filled[:, 0] if filled.shape[1] else np.zeros(len(filled)), 2 / (period + 1))
+
+
+def wilder_average(values, period):
+    """Wilder 平滑: 第 period 個數值為前 period 個的平均，之後 avg = avg + (x - avg) / period；前面的位置為 NaN"""
+    result = np.full(values.shape, np.nan)
+    if values.shape[1] < period:
+        return result
+    filled = np.nan_to_num(values)
+    seed = filled[:, :period].mean(axis=1)
+    result[:, period - 1] = seed
+    result[:, period:] = exponential_filter(filled[:, period:], seed, 1 / period)
+    return result
+
+
+def compacted(prices):
+    """收盤 / 最高 / 最低價依每檔的交易日左對齊 (有值的交易日依序排在前面)，回傳 (dict, 每檔交易日數)"""
+    close = np.asarray(prices.close, dtype=np.float64)
+    order, counts = compact_rows(~np.isnan(close))
+    arrays = {
+        name: np.take_along_axis(np.asarray(getattr(prices, name), dtype=np.float64), order, axis=1)
+        for name in ('close', 'high', 'low')
+    }
+    return arrays, counts
+
+
+def calculate_rsi(close, counts, period=RSI_PERIOD):
+    """最新 RSI (漲跌幅皆為 0 時為 50)"""
+    change = np.diff(close, axis=1)
+    avg_gain = wilder_average(np.clip(change, 0, None), period)
+    avg_loss = wilder_average(np.clip(-change, 0, None), period)
+    gain, loss = last_valid(avg_gain, counts - 1), last_valid(avg_loss, counts - 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rsi = np.where(loss > 0, 100 - 100 / (1 + gain / loss), np.where(gain > 0, 100.0, 50.0))
+    return np.where(counts > period, rsi, np.nan)
+
+
+def calculate_macd(close, counts):
+    """最新 MACD (快線 - 慢線)、訊號線與柱狀體，交易日數不足慢線天數時為 NaN"""
+    macd = ema(close, MACD_FAST) - ema(close, MACD_SLOW)
+    signal = ema(macd, MACD_SIGNAL)
+    enough = counts >= MACD_SLOW
+    line, signal_line = last_valid(macd, counts), last_valid(signal, counts)
+    return (
+        np.where(enough, line, np.nan),
+        np.where(enough, signal_line, np.nan),
+        np.where(enough, line - signal_line, np.nan),
+    )
+
+
+def calculate_atr(close, high, low, counts, period=ATR_PERIOD):
+    """最新 ATR (真實波幅的 Wilder 平均) 與 ATR 佔收盤價的百分比，最高 / 最低價缺值時以收盤價代替"""
+    high = np.where(np.isnan(high), close, high)
+    low = np.where(np.isnan(low), close, low)
+    previous = np.hstack([close[:, :1], close[:, :-1]])
+    true_range = np.fmax.reduce([high - low, np.abs(high - previous), np.abs(low - previous)])
+    atr = np.where(counts >= period, last_valid(wilder_average(true_range, period), counts), np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return atr, atr / last_valid(close, counts) * 100
+
+
+def calculate_bollinger(tail, counts, period=BOLLINGER_PERIOD, width=BOLLINGER_WIDTH):
+    """最新布林通道 %B (收盤在通道中的位置，下軌 0、上軌 1) 與帶寬 (通道寬度 / 中軌，%)"""
+    window = tail[:, -period:]
+    middle = window.mean(axis=1)
+    band = window.std(axis=1) * width
+    close = tail[:, -1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pctb = np.where(band > 0, (close - (middle - band)) / (2 * band), np.nan)
+        bandwidth = 2 * band / middle * 100
+    enough = counts >= period
+    return np.where(enough, pctb, np.nan), np.where(enough, bandwidth, np.nan)
+
+
+def calculate_momentum(tail, horizons=MOMENTUM_HORIZONS):
+    """各期間的報酬率 (%)，tail 為靠右對齊的收盤價，交易日數不足時為 NaN"""
+    close = tail[:, -1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return {horizon: (close / tail[:, -1 - horizon] - 1) * 100 for horizon in horizons}
+
+
+def count_new_extremes(tail, counts, window=NEW_HIGH_WINDOW, lookback=NEW_HIGH_LOOKBACK):
+    """最近 lookback 個交易日中收盤價為近 window 個交易日最高 / 最低的天數 (交易日數不足時為 NaN)"""
+    windows = sliding_window_view(tail[:, -(window + lookback - 1):], window, axis=1)
+    closes = tail[:, -lookback:]
+    highs = np.fmax.reduce(windows, axis=2)
+    lows = np.fmin.reduce(windows, axis=2)
+    enough = counts >= window + lookback - 1
+    return (
+        np.where(enough, (closes >= highs).sum(axis=1), np.nan),
+        np.where(enough, (closes <= lows).sum(axis=1), np.nan),
+    )
+
+
+def calculate_technical_indicators(prices):
+    """
+    計算所有股票的最新技術指標，回傳以證券代號為索引的 DataFrame (欄位見 TECHNICAL_FIELDS)
+    """
+    index = pd.Index(prices.symbols, name='證券代號')
+    if len(prices.dates) == 0:
+        return pd.DataFrame(np.nan, index=index, columns=TECHNICAL_FIELDS)
+
+    arrays, counts = compacted(prices)
+    close = arrays['close']
+    tail, _ = prices.tail(max(max(MOMENTUM_HORIZONS) + 1, NEW_HIGH_WINDOW + NEW_HIGH_LOOKBACK - 1), fields=('close',))
+    tail = tail['close']
+
+    with np.errstate(invalid='ignore'):
+        macd, macd_signal, macd_hist = calculate_macd(close, counts)
+        atr, atr_pct = calculate_atr(close, arrays['high'], arrays['low'], counts)
+        boll_pctb, boll_width = calculate_bollinger(tail, counts)
+        new_high_days, new_low_days = count_new_extremes(tail, counts)
+        table = {
+            'rsi': calculate_rsi(close, counts),
+            'macd': macd,
+            'macd_signal': macd_signal,
+            'macd_hist': macd_hist,
+            'boll_pctb': boll_pctb,
+            'boll_width': boll_width,
+            'atr': atr,
+            'atr_pct': atr_pct,
+            **{f'mom_{horizon}': values for horizon, values in calculate_momentum(tail).items()},
+            'new_high_days': new_high_days,
+            'new_low_days': new_low_days,
+        }
+    return pd.DataFrame(table, index=index)[TECHNICAL_FIELDS]
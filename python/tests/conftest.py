@@ -0,0 +1,47 @@
+"""
+測試共用設定
+python/ 下的模組為平面的腳本，測試時把 python/ 加入 sys.path 以便直接 import
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from price_store import make_random_store  # noqa: E402
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+@pytest.fixture
+def prices():
+    """
+    固定亂數種子的小型股價矩陣 (12 檔 × 160 日)，另含幾種邊界情況:
+      第 0 檔只有最後 10 日有股價 (新上市)、第 1 檔完全沒有股價、第 2 檔股價不變、
+      第 3 檔中間停牌 30 日、第 4 檔箱型整理後最後一日帶量突破、第 5 檔最後一日成交量為 0
+    """
+    store = make_random_store(12, day_count=160, seed=26)
+    for name in ("close", "high", "low"):
+        getattr(store, name)[0, :-10] = np.nan
+        getattr(store, name)[1, :] = np.nan
+        getattr(store, name)[3, 60:90] = np.nan
+    store.volume[0, :-10] = 0
+    store.volume[1, :] = 0
+    store.volume[3, 60:90] = 0
+
+    store.close[2, :] = store.high[2, :] = store.low[2, :] = 30.0
+
+    box = 50 + np.sin(np.arange(159)) * 2
+    store.close[4, :-1] = box
+    store.high[4, :-1] = box + 0.5
+    store.low[4, :-1] = box - 0.5
+    store.close[4, -1] = store.high[4, -1] = 55.0
+    store.low[4, -1] = 52.0
+    store.volume[4, :-1] = 1_000_000
+    store.volume[4, -1] = 5_000_000
+
+    store.volume[5, -1] = 0
+    return store
@@ -0,0 +1,70 @@
+"""
+櫃買中心 OpenAPI 欄位對應 (step1_basic_stock_info.py) 的測試：手動建立的 JSON 回應
+"""
+
+import pandas as pd
+
+import step1_basic_stock_info as step1
+from step1_basic_stock_info import (
+    DAILY_REPORT_COLUMNS, TPEX_DAILY_EXCHANGE_URL, TPEX_DAILY_QUOTES_URL, TPEX_PE_RATIO_URL,
+    get_tpex_daily_report, get_tpex_openapi,
+)
+
+PAYLOADS = {
+    TPEX_PE_RATIO_URL: [
+        {"Date": "1130102", "SecuritiesCompanyCode": "6488", "CompanyName": "環球晶",
+         "PriceEarningRatio": "12.50", "DividendPerShare": "25.00", "YieldRatio": "4.81", "PriceBookRatio": "2.31"},
+    ],
+    TPEX_DAILY_QUOTES_URL: [
+        {"Date": "1130102", "SecuritiesCompanyCode": "6488", "CompanyName": "環球晶", "Close": "520.00"},
+    ],
+    TPEX_DAILY_EXCHANGE_URL: [
+        {"Date": "1130102", "SecuritiesCompanyCode": "6488", "CompanyName": "環球晶", "TradePrice": "520.00"},
+    ],
+}
+
+
+class FakeResponse:
+    def __init__(self, payload):
+        self.payload = payload
+
+    def json(self):
+        return self.payload
+
+
+def patch_fetch(monkeypatch, payloads):
+    monkeypatch.setattr(step1.utils, "fetch_data", lambda url, *args, **kwargs: FakeResponse(payloads[url]))
+
+
+def test_fields_renamed(monkeypatch, capsys):
+    patch_fetch(monkeypatch, PAYLOADS)
+    df = get_tpex_openapi(TPEX_DAILY_EXCHANGE_URL)
+    assert df[["證券代號", "證券名稱", "成交價"]].values.tolist() == [["6488", "環球晶", "520.00"]]
+    assert capsys.readouterr().out == ""
+
+
+def test_daily_report_columns(monkeypatch, capsys):
+    patch_fetch(monkeypatch, PAYLOADS)
+    df = get_tpex_daily_report()
+    assert list(df.columns) == DAILY_REPORT_COLUMNS
+    row = df.iloc[0]
+    assert (row["證券代號"], row["收盤價"], row["本益比"], row["殖利率(%)"], row["股價淨值比"]) == \
+        ("6488", "520.00", "12.50", "4.81", "2.31")
+    # 櫃買中心沒有提供的欄位為空值
+    assert pd.isna(row["股利年度"]) and pd.isna(row["財報年/季"])
+    assert capsys.readouterr().out == ""
+
+
+def test_missing_field_warns(monkeypatch, capsys):
+    payloads = dict(PAYLOADS)
+    payloads[TPEX_DAILY_EXCHANGE_URL] = [{"SecuritiesCompanyCode": "6488", "LastPrice": "520.00"}]
+    patch_fetch(monkeypatch, payloads)
+    df = get_tpex_openapi(TPEX_DAILY_EXCHANGE_URL)
+    assert "成交價" not in df.columns
+    output = capsys.readouterr().out
+    assert "缺少欄位 ['TradePrice']" in output and "LastPrice" in output
+
+    # 空的回應 (例如假日) 不印出警告
+    patch_fetch(monkeypatch, {TPEX_DAILY_EXCHANGE_URL: []})
+    assert get_tpex_openapi(TPEX_DAILY_EXCHANGE_URL).empty
+    assert capsys.readouterr().out == ""
@@ -0,0 +1,28 @@
+from decimal import ROUND_HALF_UP, Decimal
+
+import numpy as np
+
+from step2_fin_detail import divide_half_up
+
+
+def reference(numerator, denominator, scale):
+    if denominator == 0:
+        return 0
+    return int((Decimal(numerator) * scale / Decimal(denominator)).quantize(Decimal("1"), ROUND_HALF_UP))
+
+
+def test_matches_decimal_rounding():
+    rng = np.random.default_rng(26)
+    numerator = rng.integers(-10**9, 10**9, 2000)
+    denominator = rng.integers(-10**7, 10**7, 2000)
+    denominator[:50] = 0
+
+    result = divide_half_up(numerator, denominator, 10000)
+    expected = [reference(int(n), int(d), 10000) for n, d in zip(numerator, denominator)]
+    assert result.tolist() == expected
+
+
+def test_half_rounds_away_from_zero():
+    numerator = np.array([1, -1, 3, -3, 5, 0], dtype=np.int64)
+    denominator = np.array([2, 2, 2, -2, 0, 7], dtype=np.int64)
+    assert divide_half_up(numerator, denominator, 1).tolist() == [1, -1, 2, 2, 0, 0]
@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+
+from indicator_state import IndicatorState, update_indicator_state
+from price_store import PriceStore
+from Stock_Filter import calculate_volume_analysis_batch
+
+
+def select_days(prices, keep):
+    """股價矩陣中 keep (bool 陣列) 為 True 的交易日"""
+    arrays = {name: getattr(prices, name)[:, keep].copy() for name in ("open", "close", "high", "low", "volume")}
+    store = PriceStore(prices.symbols, prices.dates[keep], arrays)
+    store.source = "exchange"
+    return store
+
+
+def test_incremental_update_matches_full_build(prices, tmp_path):
+    path = str(tmp_path / "state.pkl")
+    days = np.arange(len(prices.dates))
+    update_indicator_state(select_days(prices, days < 140), path=path)
+    state = update_indicator_state(select_days(prices, days >= 0), path=path)
+
+    full = IndicatorState.from_prices(select_days(prices, days >= 0))
+    pd.testing.assert_frame_equal(state.values(), full.values(), check_exact=False, rtol=1e-9)
+    pd.testing.assert_frame_equal(state.volume_analysis(), calculate_volume_analysis_batch(prices))
+
+
+def test_gap_filled_day_triggers_rebuild(prices, tmp_path):
+    """中斷的回補留下缺口、之後補齊較早的交易日: 狀態需重新建立，結果與完整建立相同"""
+    path = str(tmp_path / "state.pkl")
+    days = np.arange(len(prices.dates))
+    full_prices = select_days(prices, days >= 0)
+
+    saved = update_indicator_state(select_days(prices, days != 100), path=path)
+    assert not saved.matches(full_prices)
+    state = update_indicator_state(full_prices, path=path)
+
+    full = IndicatorState.from_prices(full_prices)
+    pd.testing.assert_frame_equal(state.values(), full.values(), check_exact=False, rtol=1e-9)
+
+
+def test_trimmed_old_days_keep_state(prices):
+    """滾動視窗捨去最舊的交易日不影響接續更新"""
+    days = np.arange(len(prices.dates))
+    state = IndicatorState.from_prices(select_days(prices, days < 150))
+    assert state.matches(select_days(prices, days >= 5))
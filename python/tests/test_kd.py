@@ -0,0 +1,80 @@
+import numpy as np
+
+from price_store import PriceStore
+from Step10_KD import (build_kd_state, calculate_kd, calculate_kd_loop, get_kd, latest_kd, state_matches,
+                       update_kd_state)
+
+
+def head(prices, end):
+    """股價矩陣的前 end 個交易日"""
+    arrays = {name: getattr(prices, name)[:, :end].copy() for name in ("close", "high", "low", "volume")}
+    store = PriceStore(prices.symbols, prices.dates[:end], arrays)
+    store.source = prices.source
+    return store
+
+
+def without_day(prices, day):
+    """股價矩陣少了第 day 個交易日 (回補中斷留下的缺口)"""
+    keep = np.arange(len(prices.dates)) != day
+    arrays = {name: getattr(prices, name)[:, keep].copy() for name in ("close", "high", "low", "volume")}
+    store = PriceStore(prices.symbols, prices.dates[keep], arrays)
+    store.source = prices.source
+    return store
+
+
+def test_matrix_matches_loop(prices):
+    k, d = calculate_kd(prices)
+    latest = latest_kd(k, d)
+    expected = calculate_kd_loop(prices).reindex(latest.index)
+
+    # 完全沒有股價的股票: 矩陣計算為 NaN，逐檔計算維持初始值
+    traded = latest["K"].notna().to_numpy()
+    assert traded.tolist() == [symbol != prices.symbols[1] for symbol in prices.symbols]
+    latest, expected = latest[traded], expected[traded]
+    np.testing.assert_allclose(latest["K"].to_numpy(), expected["K"].to_numpy(), rtol=0, atol=1e-9)
+    np.testing.assert_allclose(latest["D"].to_numpy(), expected["D"].to_numpy(), rtol=0, atol=1e-9)
+
+
+def test_flat_prices_stay_at_initial_value(prices):
+    k, d = calculate_kd(prices)
+    latest = latest_kd(k, d)
+    np.testing.assert_allclose(latest.loc[prices.symbols[2], ["K", "D"]].to_numpy(float), [50, 50])
+    assert np.isnan(latest.loc[prices.symbols[1], "K"])
+
+
+def test_incremental_update_matches_full(prices):
+    full = build_kd_state(prices)
+    state = build_kd_state(head(prices, 120))
+    assert state_matches(state, head(prices, 150))
+    state = update_kd_state(head(prices, 150), state)
+    state = update_kd_state(prices, state)
+
+    np.testing.assert_allclose(state[["K", "D"]].to_numpy(), full[["K", "D"]].to_numpy(), rtol=0, atol=1e-9)
+    assert (state["交易日數"] == full["交易日數"]).all()
+
+
+def test_state_from_other_source_does_not_match(prices):
+    state = build_kd_state(prices)
+    prices.source = "exchange"
+    assert not state_matches(state, prices)
+
+
+def test_gap_filled_day_triggers_rebuild(prices):
+    """中斷的回補留下缺口、之後補齊較早的交易日: 增量更新需與完整計算相同"""
+    partial = without_day(prices, 100)
+
+    state = build_kd_state(partial)
+    assert not state_matches(state, prices)
+    updated = update_kd_state(prices, state)
+    full = build_kd_state(prices)
+    np.testing.assert_allclose(updated[["K", "D"]].to_numpy(), full[["K", "D"]].to_numpy(), rtol=0, atol=1e-9)
+
+
+def test_get_kd_rebuilds_after_gap_fill(prices, tmp_path):
+    path = str(tmp_path / "kd_state.pkl")
+    partial = without_day(prices, 100)
+
+    get_kd(partial, path=path)
+    state = get_kd(prices, path=path)
+    full = build_kd_state(prices)
+    np.testing.assert_allclose(state[["K", "D"]].to_numpy(), full[["K", "D"]].to_numpy(), rtol=0, atol=1e-9)
@@ -0,0 +1,103 @@
+"""
+全市場每日行情 (market_prices.py) 的測試：手動建立的整批行情回應與每日行情存檔
+"""
+
+import numpy as np
+import pandas as pd
+
+import utils
+from market_prices import QUOTE_COLUMNS, day_path, parse_quotes, update_price_store
+from price_store import PriceStore
+
+# 證交所新版格式: tables 清單，個股表格之前另有大盤指數表格
+TWSE_PAYLOAD = {
+    "stat": "OK",
+    "tables": [
+        {"title": "價格指數", "fields": ["指數", "收盤指數"], "data": [["發行量加權股價指數", "17,000.00"]]},
+        {"title": "漲跌證券數合計", "fields": [], "data": []},
+        {
+            "title": "每日收盤行情",
+            "fields": ["證券代號", "證券名稱", "成交股數", "成交筆數", "成交金額", "開盤價", "最高價", "最低價", "收盤價"],
+            "data": [
+                ["2330", "台積電", "25,123,456", "30,000", "14,600,000,000", "580.00", "585.00", "578.00", "583.00"],
+                ["1101 ", "台泥", "0", "0", "0", "--", "--", "--", "--"],
+            ],
+        },
+    ],
+}
+
+# 櫃買中心舊版格式: fieldsN / dataN 成對，欄位名稱前後有空白
+TPEX_PAYLOAD = {
+    "reportDate": "113/01/02",
+    "fields1": [" 代號", "名稱 ", " 收盤 ", "漲跌", "開盤", " 最高", "最低 ", "均價", "成交股數 "],
+    "data1": [
+        ["6488", "環球晶", "520.00", "+5.00", "515.00", "1,025.00", "512.00", "518.50", "1,234,000"],
+        ["8044", "網家", "---", "", "---", "---", "---", "", "0"],
+    ],
+    "fields2": ["代號", "名稱"],
+    "data2": [],
+}
+
+
+def test_parse_twse_tables():
+    quotes = parse_quotes(TWSE_PAYLOAD, "上市")
+    assert list(quotes.columns) == QUOTE_COLUMNS
+    assert quotes["代號"].tolist() == ["2330.TW", "1101.TW"]
+    np.testing.assert_array_equal(quotes.iloc[0, 1:].to_numpy(dtype=float), [580, 585, 578, 583, 25_123_456])
+    # 沒有成交時價格為 NaN，成交股數為 0
+    assert quotes.iloc[1, 1:5].isna().all()
+    assert quotes.loc[1, "成交股數"] == 0
+
+
+def test_parse_tpex_numbered_fields():
+    quotes = parse_quotes(TPEX_PAYLOAD, "上櫃")
+    assert quotes["代號"].tolist() == ["6488.TWO", "8044.TWO"]
+    np.testing.assert_array_equal(quotes.iloc[0, 1:].to_numpy(dtype=float), [515, 1025, 512, 520, 1_234_000])
+    assert quotes.iloc[1, 1:5].isna().all()
+
+
+def test_parse_missing_table(capsys):
+    # 假日沒有任何表格: 不印出警告
+    assert parse_quotes({"stat": "很抱歉，沒有符合條件的資料!"}, "上市").empty
+    assert capsys.readouterr().out == ""
+
+    # 有表格但欄位對不上: 印出警告
+    quotes = parse_quotes({"fields1": ["代號", "名稱"], "data1": [["6488", "環球晶"]]}, "上櫃")
+    assert quotes.empty and list(quotes.columns) == QUOTE_COLUMNS
+    assert "找不到個股表格" in capsys.readouterr().out
+
+
+def quote_day(close, symbols=("2330.TW",)):
+    return pd.DataFrame({
+        "代號": list(symbols),
+        "開盤": close, "最高": close + 1, "最低": close - 1, "收盤": close,
+        "成交股數": 1000.0,
+    })
+
+
+def test_out_of_order_day_merges_into_sorted_store(tmp_path):
+    history_dir = str(tmp_path / "quotes")
+    path = str(tmp_path / "store")
+    window = utils.recent_business_days(6)
+    for i, day in enumerate(window):
+        if i != 3:
+            utils.save_pickle(quote_day(100.0 + i), day_path(day, history_dir))
+    first = update_price_store(6, path, history_dir)
+    assert list(first.dates) == [day for i, day in enumerate(window) if i != 3]
+
+    # 回補中間缺少的一日，且該日多了一檔新股票
+    utils.save_pickle(quote_day(103.0, ("2330.TW", "6488.TWO")), day_path(window[3], history_dir))
+    store = update_price_store(6, path, history_dir)
+
+    assert list(store.dates) == window
+    assert store.dates.is_monotonic_increasing
+    assert store.symbols == ["2330.TW", "6488.TWO"]
+    np.testing.assert_array_equal(store.close[0], 100.0 + np.arange(6))
+    np.testing.assert_array_equal(store.high[0], 101.0 + np.arange(6))
+    np.testing.assert_array_equal(store.close[1], [np.nan, np.nan, np.nan, 103.0, np.nan, np.nan])
+    assert store.volume[1].tolist() == [0, 0, 0, 1000, 0, 0]
+
+    # 存檔後重新開啟的結果相同
+    reloaded = PriceStore.load(path)
+    assert list(reloaded.dates) == window
+    np.testing.assert_array_equal(reloaded.close, store.close)
@@ -0,0 +1,90 @@
+"""
+本益比級距 (step3_pe_ratio_chart.py) 的測試：小型的合成週收盤與近四季 EPS
+"""
+
+import numpy as np
+import pandas as pd
+
+from step3_pe_ratio_chart import PE_BAND_YEARS, align_eps_to_weeks, compute_pe_bands, history_covered
+
+WEEKS = PE_BAND_YEARS * 52
+
+
+def synthetic_panel():
+    """
+    270 週 × 3 檔:
+      A: 股價在 40~80 間擺盪，EPS 固定 2
+      B: 只有最後 100 週有股價 (歷史不足五年)
+      C: 股價固定 30，最新 EPS 轉為負值
+    """
+    weeks = pd.date_range("2019-01-04", periods=WEEKS + 10, freq="W-FRI")
+    close = pd.DataFrame({
+        "A": 60 + 20 * np.sin(np.arange(len(weeks)) / 7),
+        "B": np.r_[np.full(len(weeks) - 100, np.nan), np.linspace(20, 40, 100)],
+        "C": np.full(len(weeks), 30.0),
+    }, index=weeks)
+    eps = pd.DataFrame({
+        "A": np.full(len(weeks), 2.0),
+        "B": np.full(len(weeks), 1.5),
+        "C": np.r_[np.full(len(weeks) - 1, 3.0), -0.5],
+    }, index=weeks)
+    return close, eps
+
+
+def test_align_eps_uses_report_deadline():
+    # 112 年第 3 季的公布截止日為 2023-11-14 (週二)，第 2 季為 2023-08-14
+    eps = pd.DataFrame([[1.0, 2.0, 3.0]], index=["2330"], columns=[(112, 1), (112, 2), (112, 3)])
+    weeks = pd.DatetimeIndex(["2023-05-12", "2023-11-10", "2023-11-17", "2024-03-29"])
+    aligned = align_eps_to_weeks(eps, weeks)
+
+    assert list(aligned.columns) == ["2330"]
+    assert np.isnan(aligned.loc["2023-05-12", "2330"])      # 第 1 季截止日 (5/15) 之前沒有可用的 EPS
+    assert aligned.loc["2023-11-10", "2330"] == 2.0         # 截止日前一週仍用第 2 季
+    assert aligned.loc["2023-11-17", "2330"] == 3.0         # 截止日後一週改用第 3 季
+    assert aligned.loc["2024-03-29", "2330"] == 3.0         # 第 4 季欄位不存在時沿用最新一季
+
+
+def test_align_eps_on_deadline_day():
+    eps = pd.DataFrame([[1.0, 2.0]], index=["2330"], columns=[(112, 1), (112, 2)])
+    aligned = align_eps_to_weeks(eps, pd.DatetimeIndex(["2023-08-13", "2023-08-14"]))
+    assert aligned["2330"].tolist() == [1.0, 2.0]
+
+
+def test_history_covered():
+    close, eps = synthetic_panel()
+    covered = history_covered(close.to_numpy()[-WEEKS:], eps.to_numpy()[-WEEKS:], WEEKS)
+    assert covered.tolist() == [True, False, True]
+
+    # 股價矩陣的期間不足 weeks 週時全部為 False
+    short = close.to_numpy()[-100:]
+    assert not history_covered(short, eps.to_numpy()[-100:], WEEKS).any()
+
+
+def test_percentile_bands():
+    close, eps = synthetic_panel()
+    bands = compute_pe_bands(close, eps).set_index("證券代號")
+
+    pe = close["A"].iloc[-WEEKS:] / 2.0
+    expected = np.round(np.percentile(pe, [0, 20, 40, 60, 80, 100]), 1)
+    multiples = bands.loc["A", [f"本益比-級距{i}倍數" for i in range(1, 7)]].to_numpy(dtype=float)
+    np.testing.assert_allclose(multiples, expected)
+    np.testing.assert_allclose(bands.loc["A", "本益比-級距1價格"], round(expected[0] * 2.0, 2))
+
+    # 歷史不足五年的股票級距為 NaN
+    assert bands.loc["B"].isna().all()
+
+    # 最新 EPS 為負值時有倍數但沒有價格
+    assert bands.loc["C", "本益比-級距1倍數"] == 10.0
+    assert np.isnan(bands.loc["C", "本益比-級距1價格"])
+
+
+def test_fixed_multiples():
+    close, eps = synthetic_panel()
+    multiples = [8, 10, 12, 14, 16, 18]
+    bands = compute_pe_bands(close, eps, multiples=multiples).set_index("證券代號")
+
+    for symbol, latest_eps in (("A", 2.0), ("B", 1.5)):
+        for i, multiple in enumerate(multiples, start=1):
+            assert bands.loc[symbol, f"本益比-級距{i}倍數"] == multiple
+            assert bands.loc[symbol, f"本益比-級距{i}價格"] == round(multiple * latest_eps, 2)
+    assert bands.loc["C", [f"本益比-級距{i}價格" for i in range(1, 7)]].isna().all()
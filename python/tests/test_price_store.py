@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+
+import price_store
+from price_store import PriceStore, compact_rows, download_prices, get_period_dates, right_align
+
+
+def fake_frame(symbols, dates):
+    """yf.download(group_by='ticker') 格式的股價 (收盤 = 代號數字 + 交易日序號)"""
+    frames = {}
+    for symbol in symbols:
+        close = int(symbol.split(".")[0]) + np.arange(len(dates), dtype=np.float64)
+        frames[symbol] = pd.DataFrame({
+            "Open": close, "High": close + 1, "Low": close - 1, "Close": close, "Volume": 1000.0,
+        }, index=dates)
+    return pd.concat(frames, axis=1)
+
+
+def patch_download(monkeypatch, handler):
+    """以 handler(代號清單, 第幾次請求) 取代 yf.download，回傳每次請求的代號清單"""
+    calls = []
+
+    def download(symbols, **kwargs):
+        calls.append(list(symbols))
+        return handler(list(symbols), len(calls))
+
+    monkeypatch.setattr(price_store.yf, "download", download)
+    return calls
+
+
+def test_failed_chunk_does_not_block_other_chunks(monkeypatch):
+    dates = get_period_dates("1mo")[-10:]
+    symbols = ["1101.TW", "1102.TW", "2330.TW", "2317.TW", "2454.TW"]
+
+    def handler(pending, _):
+        if "2330.TW" in pending:
+            raise ConnectionError("timeout")
+        return fake_frame(pending, dates)
+
+    calls = patch_download(monkeypatch, handler)
+    store = download_prices(symbols, period="1mo", chunk_size=2, max_workers=2, retries=3)
+
+    # 失敗的批次重試 retries 次後放棄，其餘批次照常寫入
+    assert sum("2330.TW" in call for call in calls) == 3
+    assert list(store.dates) == list(dates)
+    for symbol in ["1101.TW", "1102.TW", "2454.TW"]:
+        np.testing.assert_array_equal(store.frame(symbol)["Close"].to_numpy(), fake_frame([symbol], dates)[symbol]["Close"])
+    for symbol in ["2330.TW", "2317.TW"]:
+        assert store.frame(symbol)["Close"].isna().all()
+
+
+def test_retry_only_missing_symbols(monkeypatch):
+    dates = get_period_dates("1mo")[-5:]
+
+    def handler(pending, call):
+        # 第一次請求漏掉 1102.TW，重試時只需要抓 1102.TW
+        got = [symbol for symbol in pending if call > 1 or symbol != "1102.TW"]
+        return fake_frame(got, dates)
+
+    calls = patch_download(monkeypatch, handler)
+    store = download_prices(["1101.TW", "1102.TW"], period="1mo", chunk_size=2, max_workers=1)
+
+    assert calls == [["1101.TW", "1102.TW"], ["1102.TW"]]
+    assert not store.frame("1102.TW")["Close"].isna().any()
+    assert store.volume[store.symbol_index["1101.TW"]].tolist() == [1000] * 5
+
+
+def test_saved_store_is_memory_mapped(monkeypatch, tmp_path):
+    dates = get_period_dates("1mo")[-5:]
+    patch_download(monkeypatch, lambda pending, _: fake_frame(pending, dates))
+    store = download_prices(["1101.TW"], period="1mo", path=str(tmp_path / "store"))
+
+    loaded = PriceStore.load(str(tmp_path / "store"))
+    assert isinstance(store.close, np.memmap)
+    assert loaded.source == "yfinance"
+    np.testing.assert_array_equal(loaded.close, store.close)
+
+
+def test_row_alignment_matches_loop(prices):
+    valid = ~np.isnan(prices.close)
+    close, volume = right_align(valid, 50, prices.close, prices.volume)
+    order, counts = compact_rows(valid)
+    tail, tail_counts = prices.tail(50, fields=("close", "volume"))
+
+    for row in range(len(prices.symbols)):
+        traded = np.flatnonzero(valid[row])
+        recent = traded[-50:]
+        expected = np.full(50, np.nan)
+        expected[50 - len(recent):] = prices.close[row, recent]
+        np.testing.assert_array_equal(close[row], expected)
+        np.testing.assert_array_equal(tail["close"][row], expected)
+        np.testing.assert_array_equal(volume[row, 50 - len(recent):], prices.volume[row, recent])
+        np.testing.assert_array_equal(order[row, :counts[row]], traded)
+    np.testing.assert_array_equal(counts, tail_counts)
@@ -0,0 +1,31 @@
+import os
+
+import pandas as pd
+
+from conftest import FIXTURE_DIR
+from screening_rules import compile_screens, run_screens
+
+
+def test_scheme_columns_match_baseline():
+    """
+    screening_rules.json 編譯後的選股結果與原本逐一實作的方案相同
+    (fixtures/screen_expected.csv 為原本的財務健康評分、四道關卡、三好一公道、choose_stock 條件、嚴格品質篩選的輸出)
+    """
+    df = pd.read_csv(os.path.join(FIXTURE_DIR, "screen_input.csv"))
+    expected = pd.read_csv(os.path.join(FIXTURE_DIR, "screen_expected.csv"), dtype=str, keep_default_na=False)
+
+    plan = compile_screens(quality="strict")
+    result = run_screens(df, plan)
+
+    for column in expected.columns:
+        values = result[column]
+        if column in plan.flag_columns:
+            values = values.map({True: "Pass", False: "Fail"})
+        assert values.astype(str).tolist() == expected[column].tolist(), column
+
+
+def test_loose_quality_passes_at_least_strict():
+    df = pd.read_csv(os.path.join(FIXTURE_DIR, "screen_input.csv"))
+    strict = run_screens(df, compile_screens(quality="strict"))["通過品質篩選"]
+    loose = run_screens(df, compile_screens(quality="loose"))["通過品質篩選"]
+    assert (loose | ~strict).all()
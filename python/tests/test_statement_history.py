@@ -0,0 +1,67 @@
+"""
+財報歷史面板 (statement_history.py) 的測試：手動建立的兩年 (111、112 年) 面板，缺 112 年第 2 季
+"""
+
+import numpy as np
+import pandas as pd
+
+from statement_history import quarterly_values, statement_panel, trailing_four_quarters, yoy_growth, trend_slope
+
+PERIODS = [(111, 1), (111, 2), (111, 3), (111, 4), (112, 1), (112, 3), (112, 4)]
+
+# 年度累計 EPS
+# X: 單季 1, 2, 3, 4 / 2, (缺), 5
+# Y: 單季 0, -1, -1, -2 / 1, (缺), 1
+CUMULATIVE = {
+    "X": [1, 3, 6, 10, 2, 9, 14],
+    "Y": [0, -1, -2, -4, 1, -1, 0],
+}
+
+
+def cumulative_panel():
+    rows = [
+        {"證券代號": symbol, "年度": year, "季別": season, "基本每股盈餘": value}
+        for symbol, values in CUMULATIVE.items()
+        for (year, season), value in zip(PERIODS, values)
+    ]
+    return statement_panel(pd.DataFrame(rows), "基本每股盈餘")
+
+
+def test_quarterly_values():
+    quarterly = quarterly_values(cumulative_panel())
+    assert list(quarterly.columns) == PERIODS
+    np.testing.assert_array_equal(quarterly.loc["X"], [1, 2, 3, 4, 2, np.nan, 5])
+    np.testing.assert_array_equal(quarterly.loc["Y"], [0, -1, -1, -2, 1, np.nan, 1])
+
+
+def test_trailing_four_quarters():
+    eps = trailing_four_quarters(quarterly_values(cumulative_panel()))
+    # (111, 4) 為當年度四季合計；(112, 1) 往回取 (111, 4)、(111, 3)、(111, 2)
+    # 112 年第 3、4 季的四季中含缺檔的第 2 季，為 NaN
+    np.testing.assert_array_equal(eps.loc["X"], [np.nan, np.nan, np.nan, 10, 11, np.nan, np.nan])
+    np.testing.assert_array_equal(eps.loc["Y"], [np.nan, np.nan, np.nan, -4, -3, np.nan, np.nan])
+
+
+def test_yoy_growth():
+    growth = yoy_growth(quarterly_values(cumulative_panel()))
+    assert growth.loc[:, 111].isna().all().all()
+    assert growth.loc["X", (112, 1)] == 100.0
+    assert growth.loc["X", (112, 4)] == 25.0
+    assert np.isnan(growth.loc["X", (112, 3)])      # 當季因前一季缺檔為 NaN
+    assert np.isnan(growth.loc["Y", (112, 1)])      # 去年同季為 0
+    assert growth.loc["Y", (112, 4)] == 150.0       # 去年同季為負值時以絕對值為基準
+
+
+def test_trend_slope():
+    quarterly = quarterly_values(cumulative_panel())
+    slope = trend_slope(quarterly, window=8)
+
+    x = np.arange(len(PERIODS), dtype=np.float64)
+    for symbol in ("X", "Y"):
+        values = quarterly.loc[symbol].to_numpy(dtype=np.float64)
+        valid = ~np.isnan(values)
+        expected = np.polyfit(x[valid], values[valid], 1)[0]
+        np.testing.assert_allclose(slope[symbol], expected)
+
+    # 最近 3 季只有 2 季有值，少於 min_points 時為 NaN
+    assert trend_slope(quarterly, window=3).isna().all()
@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+
+from Stock_Filter import calculate_volume_analysis, calculate_volume_analysis_batch
+
+COMPARED = ["vol_ma5", "vol_ma20", "vol_ratio", "vol_breakout", "low_consolidation", "vol_signal"]
+
+
+def test_batch_matches_per_symbol(prices):
+    batch = calculate_volume_analysis_batch(prices)
+    loop = pd.DataFrame(
+        [calculate_volume_analysis(prices, symbol) for symbol in prices.symbols], index=batch.index
+    )
+
+    for column in ["vol_ma5", "vol_ma20", "vol_ratio"]:
+        np.testing.assert_allclose(batch[column].to_numpy(float), loop[column].to_numpy(float), rtol=1e-12)
+    for column in ["vol_breakout", "low_consolidation", "vol_signal"]:
+        assert batch[column].tolist() == loop[column].tolist(), column
+
+
+def test_edge_cases(prices):
+    batch = calculate_volume_analysis_batch(prices)
+    symbols = prices.symbols
+
+    # 有效交易日不足 20 日、沒有股價、最後一日沒有成交量時不判斷
+    for row in (0, 1, 5):
+        assert batch.loc[symbols[row], "vol_signal"] == "-"
+        assert np.isnan(batch.loc[symbols[row], "vol_ma20"])
+
+    assert batch.loc[symbols[4], "vol_signal"] == "★底部起漲"
+    assert batch.loc[symbols[4], "bottom_breakout"]
@@ -0,0 +1,65 @@
+"""
+成交量創新高排行 (step9_daily_top_Volume.py) 的測試：矩陣計算與逐檔迴圈的結果相同
+"""
+
+import numpy as np
+import pytest
+
+from step9_daily_top_Volume import days_since_higher, new_high_streak
+
+
+def valid_volume(prices, row):
+    """單檔股票有收盤價的交易日成交量 (略過停牌日)"""
+    return prices.volume[row][~np.isnan(prices.close[row])].astype(np.float64)
+
+
+def loop_days_since_higher(volume, window):
+    days = 0
+    for previous in volume[-2::-1]:
+        if previous >= volume[-1] or days == window:
+            break
+        days += 1
+    return days
+
+
+def loop_new_high_streak(volume, base, length):
+    """只看最近 length 個交易日 (與 tail 取出的期間相同)，每日需有 base 日的比較期間"""
+    streak = 0
+    first = max(len(volume) - length + base - 1, base - 1)
+    for i in range(len(volume) - 1, first - 1, -1):
+        if volume[i] <= 0 or volume[i] < volume[i - base + 1:i + 1].max():
+            break
+        streak += 1
+    return streak
+
+
+@pytest.mark.parametrize("window, base", [(250, 20), (30, 20), (5, 10)])
+def test_matches_loop(prices, window, base):
+    length = max(window + 1, base)
+    tail, counts = prices.tail(length, fields=("volume",))
+    volume = tail["volume"]
+    days = days_since_higher(volume[:, -(window + 1):], counts, window)
+    streak = new_high_streak(volume, counts, base)
+
+    for row in range(len(prices.symbols)):
+        series = valid_volume(prices, row)
+        assert days[row] == loop_days_since_higher(series, window), row
+        assert streak[row] == loop_new_high_streak(series, base, length), row
+
+
+def test_edge_cases(prices):
+    tail, counts = prices.tail(251, fields=("volume",))
+    volume = tail["volume"]
+    days = days_since_higher(volume, counts, 250)
+    streak = new_high_streak(volume, counts, 20)
+
+    # 第 0 檔只有 10 個交易日: 少於 base 日，沒有連續創高天數
+    assert days[0] == loop_days_since_higher(valid_volume(prices, 0), 250) and streak[0] == 0
+    # 第 1 檔沒有股價
+    assert days[1] == 0 and streak[1] == 0
+    # 第 3 檔中間停牌的 30 日不計入交易日
+    assert counts[3] == len(valid_volume(prices, 3)) <= 160 - 30
+    # 第 4 檔最後一日帶量突破，超過前面所有交易日；之前成交量持平也視為創高
+    assert days[4] == 159 and streak[4] == 160 - 20 + 1
+    # 第 5 檔最後一日沒有成交
+    assert days[5] == 0 and streak[5] == 0
@@ -16,6 +16,8 @@ from io import StringIO
 import urllib3
 import sys
 from pathlib import Path
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 
 def init():
@@ -60,6 +62,144 @@ def get_headers(url):
     }
 
 
+def fetch_concurrently(tasks, max_workers=None):
+    """
+    同時執行多個抓取函式 (各市場、各資料來源的請求互不相依)
+    tasks: {名稱: 無參數函式}，回傳 {名稱: 結果}，順序與 tasks 相同
+    """
+    if not tasks:
+        return {}
+    with ThreadPoolExecutor(max_workers=max_workers or len(tasks)) as executor:
+        futures = {name: executor.submit(func) for name, func in tasks.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+
+# 網站暫時封鎖時的回應: HTTP 狀態碼，或頁面中的提示文字 (證交所、MOPS)
+BLOCKED_STATUS_CODES = (403, 429)
+BLOCKED_MARKERS = ("請求過於頻繁", "FOR SECURITY REASONS", "因為安全性考量")
+
+
+class BlockedError(Exception):
+    """網站因請求過快而暫時封鎖 (回傳封鎖頁面)"""
+
+
+class RateLimiter:
+    """
+    限制請求頻率，可由多個執行緒共用: 每次請求前呼叫 wait()，兩次請求至少間隔 interval 秒 (另加 0 ~ jitter 秒的隨機延遲)
+    遇到封鎖頁面時呼叫 block()，之後的 wait() 都會拋出 BlockedError，不再送出請求
+    """
+
+    def __init__(self, interval, jitter=0.0):
+        self.interval = interval
+        self.jitter = jitter
+        self.blocked = None
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            if self.blocked:
+                raise BlockedError(self.blocked)
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval + random.uniform(0, self.jitter)
+        time.sleep(start - now)
+        if self.blocked:
+            raise BlockedError(self.blocked)
+
+    def block(self, reason):
+        self.blocked = reason
+        return BlockedError(reason)
+
+
+def fetch_limited(url, limiter=None, data=None, json=None, method="get"):
+    """
+    送出請求前等待 limiter；回應為封鎖頁面 (BLOCKED_STATUS_CODES 或頁面含 BLOCKED_MARKERS) 時拋出 BlockedError，
+    並讓同一個 limiter 之後的請求都停止
+    """
+    if limiter is not None:
+        limiter.wait()
+    reason = None
+    try:
+        response = post_data(url, data=data, json=json) if method == "post" else fetch_data(url)
+    except requests.HTTPError as e:
+        if e.response is None or e.response.status_code not in BLOCKED_STATUS_CODES:
+            raise
+        reason = f"{urlparse(url).netloc} 回傳 HTTP {e.response.status_code}"
+    else:
+        if any(marker in response.text for marker in BLOCKED_MARKERS):
+            reason = f"{urlparse(url).netloc} 回傳封鎖頁面"
+    if reason:
+        raise limiter.block(reason) if limiter is not None else BlockedError(reason)
+    return response
+
+
+def fetch_json(url, limiter=None, data=None, json=None, method="get"):
+    """fetch_limited 並解析 JSON，回應不是 JSON (例如封鎖時回傳的 HTML 頁面) 時視為封鎖"""
+    response = fetch_limited(url, limiter, data=data, json=json, method=method)
+    try:
+        return response.json()
+    except ValueError:
+        reason = f"{urlparse(url).netloc} 回應不是 JSON，可能已被暫時封鎖"
+        raise limiter.block(reason) if limiter is not None else BlockedError(reason)
+
+
+def save_pickle(obj, path):
+    """以 pickle 寫入檔案 (先寫暫存檔再取代，中斷時不會留下寫到一半的檔案)"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    pd.to_pickle(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def recent_business_days(count, end=None):
+    """最近 count 個營業日 (由舊到新，含國定假日)"""
+    return list(pd.bdate_range(end=pd.Timestamp(end or datetime.today()).normalize(), periods=count))
+
+
+def backfill(keys, fetch, path_of, max_workers=1, describe=str, report_every=1):
+    """
+    可中斷續傳的回補: 同時以 fetch(key) 抓取各個 key，每抓完一個就存成 path_of(key) (save_pickle)
+    keys: 需要抓取的 key (已存檔而不需重抓的由呼叫端先排除)
+    fetch(key) 回傳 None 時不存檔 (例如資料尚未公布)，下次執行時重新抓取
+    遇到 BlockedError 時取消尚未開始的 key 並停止；回傳 (成功存檔的 key, 失敗或未執行的 key)
+    """
+    done, failed = [], []
+    if not keys:
+        return done, failed
+
+    blocked = False
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(fetch, key): key for key in keys}
+        for future in as_completed(futures):
+            key = futures[future]
+            result = None
+            if not future.cancelled():
+                try:
+                    result = future.result()
+                except BlockedError as e:
+                    if not blocked:
+                        blocked = True
+                        print(f"{e}，停止回補，稍後再執行")
+                        for other in futures:
+                            other.cancel()
+                except Exception as e:
+                    print(f"抓取 {describe(key)} 失敗: {e}")
+
+            if result is None:
+                failed.append(key)
+            else:
+                save_pickle(result, path_of(key))
+                done.append(key)
+            finished = len(done) + len(failed)
+            if finished % report_every == 0 or finished == len(keys):
+                print(f"已完成 {finished}/{len(keys)}: {describe(key)} ({'失敗' if result is None else '已存檔'})")
+
+    if failed:
+        print(f"未完成 {len(failed)} 項，下次執行時會重新抓取")
+    return done, failed
+
+
 def sleep():
     """Sleep for a random interval between 3 and 10 seconds."""
     time.sleep(random.randint(3, 10))